@@ -106,6 +106,29 @@ CREATE TABLE IF NOT EXISTS dl.dl_request
 );
 
 
+-- Table: dl.dl_request_metrics
+-- Timings of the stages of every download job (DL_METRICS=db), one row per stage and a 'total' row per job
+CREATE TABLE IF NOT EXISTS dl.dl_request_metrics
+(
+    id SERIAL NOT NULL,
+    dl_request_id integer NOT NULL,
+    stage character varying(32) NOT NULL,
+    started timestamp with time zone NOT NULL,
+    seconds double precision NOT NULL,
+    bytes bigint,
+    detail jsonb NOT NULL DEFAULT '{}',
+    CONSTRAINT dl_request_metrics_pkey PRIMARY KEY (id),
+    CONSTRAINT f_dl_request FOREIGN KEY (dl_request_id)
+        REFERENCES dl.dl_request (id) MATCH FULL
+        ON UPDATE NO ACTION
+        ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS dl_request_metrics_dl_request_id
+    ON dl.dl_request_metrics (dl_request_id);
+CREATE INDEX IF NOT EXISTS dl_request_metrics_stage_started
+    ON dl.dl_request_metrics (stage, started);
+
 -- INSERT DEFAULT VALUES
 
 INSERT INTO dl.dl_platform (value) VALUES
@@ -113,3 +136,22 @@ INSERT INTO dl.dl_platform (value) VALUES
 
 INSERT INTO dl.dl_status (value) VALUES
 ('PENDING'),('IN_PROGRESS'),('COMPLETED'),('FAILED');
+
+-- NOTIFY workers when a request becomes pending, so they don't have to poll
+
+CREATE OR REPLACE FUNCTION dl.notify_dl_request_pending()
+    RETURNS trigger
+    LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM pg_notify('dl_request_pending', NEW.id::text);
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS dl_request_pending_notify ON dl.dl_request;
+CREATE TRIGGER dl_request_pending_notify
+    AFTER INSERT OR UPDATE OF status ON dl.dl_request
+    FOR EACH ROW
+    WHEN (NEW.status = 'PENDING')
+    EXECUTE FUNCTION dl.notify_dl_request_pending();
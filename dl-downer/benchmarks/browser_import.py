@@ -0,0 +1,70 @@
+'''
+Measures what importing the browser module costs a process that never opens
+a browser (like a YouTube or plain manifest job): the import time and the
+memory of the process plus the child processes it started (the playwright driver).
+
+Run from the dl-downer folder:
+  python -m benchmarks.browser_import [--runs 5]
+'''
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+CASE_CODE = '''
+import json, os, sys, time
+
+def rss_kib(pid):
+  with open(f'/proc/{pid}/status') as f:
+    for line in f:
+      if line.startswith('VmRSS:'):
+        return int(line.split()[1])
+  return 0
+
+def children(pid):
+  pids = []
+  for tid in os.listdir(f'/proc/{pid}/task'):
+    with open(f'/proc/{pid}/task/{tid}/children') as f:
+      for child in f.read().split():
+        pids.append(int(child))
+        pids.extend(children(int(child)))
+  return pids
+
+start = time.perf_counter()
+import src.utils.browser
+elapsed = time.perf_counter() - start
+# give a started driver the time to load
+time.sleep(1)
+child_pids = children(os.getpid())
+print(json.dumps({
+  'elapsed': elapsed,
+  'rss': rss_kib(os.getpid()),
+  'children': len(child_pids),
+  'children_rss': sum(rss_kib(pid) for pid in child_pids),
+}))
+sys.stdout.flush()
+os._exit(0)
+'''
+
+
+def run_case() -> dict:
+  result = subprocess.run([sys.executable, '-c', CASE_CODE], capture_output=True, text=True, check=True)
+  return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--runs', type=int, default=5, help='processes started')
+  args = parser.parse_args()
+
+  results = [run_case() for _ in range(args.runs)]
+  elapsed = statistics.median(r['elapsed'] for r in results)
+  rss = statistics.median(r['rss'] for r in results)
+  children = statistics.median(r['children'] for r in results)
+  children_rss = statistics.median(r['children_rss'] for r in results)
+  print(f'import {elapsed * 1000:6.0f} ms  rss {rss / 1024:6.1f} MiB  child processes {children:.0f} using {children_rss / 1024:6.1f} MiB')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,109 @@
+'''
+Measures parsing of large synthetic MPD manifests: the time to parse and the
+memory kept by the parsed MPD, compared to the old approach of a regex
+namespace strip, a full tree and one Segment object per segment.
+
+Run from the dl-downer folder:
+  python -m benchmarks.mpd_parsing [--segments 50000] [--representations 4]
+'''
+import argparse
+import re
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+from loguru import logger
+
+from src.mpd.mpd import MPD
+from src.mpd.segment import Segment
+
+
+def make_manifest(segments: int, representations: int, repeat: bool) -> str:
+  '''
+  :param repeat: use r attributes (as most packagers do), otherwise every segment
+    gets its own <S> with slightly varying durations (worst case)
+  '''
+  s_elements = []
+  t = 0
+  i = 0
+  while i < segments:
+    d = 96000 + i % 3
+    r = min(99, segments - i - 1) if repeat else 0
+    s_elements.append(f'<S t="{t}" d="{d}" r="{r}"/>' if repeat else f'<S d="{d}"/>')
+    t += d * (r + 1)
+    i += r + 1
+  timeline = f'<SegmentTimeline>{"".join(s_elements)}</SegmentTimeline>'
+  template = f'<SegmentTemplate timescale="48000" initialization="$RepresentationID$/init.mp4" media="$RepresentationID$/$Time$.m4s">{timeline}</SegmentTemplate>'
+  video_representations = ''.join(
+    f'<Representation id="video={i}" bandwidth="{1000000 * (i + 1)}" width="1920" height="1080" codecs="avc1"/>'
+    for i in range(representations)
+  )
+  return (
+    '<?xml version="1.0" encoding="utf-8"?>'
+    '<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" xmlns:cenc="urn:mpeg:cenc:2013" type="static">'
+    '<Period id="p0">'
+    '<AdaptationSet id="1" mimeType="video/mp4" contentType="video">'
+    '<ContentProtection schemeIdUri="urn:uuid:edef8ba9-79d6-4ace-a3c8-27dcd51d21ed"><cenc:pssh>AAAA</cenc:pssh></ContentProtection>'
+    f'{template}{video_representations}'
+    '</AdaptationSet>'
+    '<AdaptationSet id="2" mimeType="audio/mp4" contentType="audio" lang="nl">'
+    f'{template}<Representation id="audio=1" bandwidth="128000" codecs="mp4a"/>'
+    '</AdaptationSet>'
+    '</Period>'
+    '</MPD>'
+  )
+
+
+def parse_legacy(mpd_string: str) -> list:
+  ''' What parsing used to do, reduced to the parts that matter for speed and memory '''
+  root = ET.fromstring(re.sub(r'xmlns=".*?"', '', mpd_string))
+  timelines = []
+  for template in root.iter('SegmentTemplate'):
+    segments = []
+    current_t = 0
+    for s in template.findall('SegmentTimeline/S'):
+      d = int(s.get('d'))
+      if s.get('t') is not None:
+        current_t = int(s.get('t'))
+      segments.append(Segment(current_t, d))
+      current_t += d
+      for _ in range(int(s.get('r', 0))):
+        segments.append(Segment(current_t, d))
+        current_t += d
+    timelines.append(segments)
+  return timelines
+
+
+def measure(name: str, parse, mpd_string: str):
+  start = time.perf_counter()
+  parse(mpd_string)
+  elapsed = time.perf_counter() - start
+  tracemalloc.start()
+  parsed = parse(mpd_string)
+  retained, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  print(f'  {name:<8} {elapsed:6.2f}s  retained {retained / 1024 / 1024:7.1f} MiB  peak {peak / 1024 / 1024:7.1f} MiB')
+  return parsed
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--segments', type=int, default=50000, help='segments per timeline')
+  parser.add_argument('--representations', type=int, default=4, help='video representations')
+  args = parser.parse_args()
+  logger.remove()
+
+  for repeat in [False, True]:
+    mpd_string = make_manifest(args.segments, args.representations, repeat)
+    print(f'{args.segments} segments per timeline, {"with" if repeat else "without"} repeats, {len(mpd_string) / 1024:.0f} KiB')
+    measure('legacy', parse_legacy, mpd_string)
+    mpd = measure('current', MPD.from_string, mpd_string)
+
+    template = mpd.periods[0].adaptation_sets[0].segment_template
+    start = time.perf_counter()
+    count = sum(1 for _ in template.segments)
+    print(f'  iterating {count} segments takes {time.perf_counter() - start:.2f}s')
+
+
+if __name__ == '__main__':
+  main()
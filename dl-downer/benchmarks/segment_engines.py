@@ -0,0 +1,101 @@
+'''
+Compares the 'threads' and 'async' segment engines against a local HTTP server
+that adds latency to every request, like a CDN far away would.
+
+Run from the dl-downer folder:
+  python -m benchmarks.segment_engines [--segments 400] [--size 262144] [--latency 0.05] [--concurrency 8] [--connections 32]
+
+Both engines are bounded by the same number of segments in flight and by the
+concurrency limit of the host. The local server only speaks HTTP/1.1, so
+HTTP/2 multiplexing is not part of this comparison, only the cost of threads
+vs. coroutines.
+'''
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.mpd.async_segment_download import AsyncSegmentDownloader
+from src.mpd.segment_download import SegmentDownloader
+
+
+def create_handler(size: int, latency: float):
+  body = os.urandom(size)
+
+  class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+      time.sleep(latency)
+      self.send_response(200)
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, format, *args):
+      pass
+
+  return Handler
+
+
+def serve(port_queue, size: int, latency: float):
+  # Own process, so the server doesn't compete with the downloader for the GIL
+  server = ThreadingHTTPServer(('127.0.0.1', 0), create_handler(size, latency))
+  server.daemon_threads = True
+  port_queue.put(server.server_address[1])
+  server.serve_forever()
+
+
+def run(name: str, create_downloader, segments: int, size: int):
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    out_file = os.path.join(tmp_dir, 'out.mp4')
+    start = time.perf_counter()
+    create_downloader(out_file, tmp_dir).download(b'')
+    elapsed = time.perf_counter() - start
+    assert os.path.getsize(out_file) == segments * size
+  print(f'{name:<28} {elapsed:6.2f}s {segments * size / elapsed / 1024 / 1024:8.1f} MB/s')
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--segments', type=int, default=400)
+  parser.add_argument('--size', type=int, default=256 * 1024, help='bytes per segment')
+  parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every request')
+  parser.add_argument('--concurrency', type=int, default=8, help='segments in flight')
+  parser.add_argument('--connections', type=int, default=32, help='connections of the async engine')
+  parser.add_argument('--max-bytes-in-flight', type=int, default=64 * 1024 * 1024)
+  args = parser.parse_args()
+
+  port_queue = multiprocessing.Queue()
+  server = multiprocessing.Process(target=serve, args=(port_queue, args.size, args.latency), daemon=True)
+  server.start()
+  port = port_queue.get()
+  urls = [f'http://127.0.0.1:{port}/{i}.m4s' for i in range(args.segments)]
+
+  print(f'{args.segments} segments of {args.size} bytes, {args.latency * 1000:.0f}ms latency')
+  run(
+    f'threads ({args.concurrency})',
+    lambda out_file, tmp_dir: SegmentDownloader(urls, out_file, tmp_dir, max_threads=args.concurrency),
+    args.segments,
+    args.size,
+  )
+  run(
+    f'async ({args.concurrency}, {args.connections} conn, {args.max_bytes_in_flight // 1024 // 1024} MiB)',
+    lambda out_file, tmp_dir: AsyncSegmentDownloader(
+      urls,
+      out_file,
+      tmp_dir,
+      max_bytes_in_flight=args.max_bytes_in_flight,
+      max_concurrency=args.concurrency,
+      max_connections=args.connections,
+    ),
+    args.segments,
+    args.size,
+  )
+  server.terminate()
+
+
+if __name__ == '__main__':
+  main()
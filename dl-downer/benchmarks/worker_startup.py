@@ -0,0 +1,56 @@
+'''
+Measures what a worker pays at startup to handle its first request of a
+platform: import time, peak memory and whether the heavy dependencies
+(playwright, pywidevine) got imported. Every case runs in a fresh process.
+'all' imports every downloader up front, as a worker would without lazy loading.
+
+Run from the dl-downer folder:
+  python -m benchmarks.worker_startup [--runs 5]
+'''
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+CASE_CODE = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import src.server
+from src.utils.downloader_registry import BUILTIN_DOWNLOADERS, get_downloader
+platforms = [p.platform for p in BUILTIN_DOWNLOADERS] if sys.argv[1] == 'all' else [sys.argv[1]]
+for platform in platforms:
+  get_downloader(platform).load()
+elapsed = time.perf_counter() - start
+print(json.dumps({
+  'elapsed': elapsed,
+  'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+  'heavy': [m for m in ['playwright', 'pywidevine'] if m in sys.modules],
+}))
+sys.stdout.flush()
+# don't wait for a started browser driver to shut down
+import os
+os._exit(0)
+'''
+
+
+def run_case(case: str) -> dict:
+  result = subprocess.run([sys.executable, '-c', CASE_CODE, case], capture_output=True, text=True, check=True)
+  return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--runs', type=int, default=5, help='processes started per case')
+  args = parser.parse_args()
+
+  for case in ['YOUTUBE', 'GENERIC_MANIFEST', 'VRTMAX', 'GOPLAY', 'all']:
+    results = [run_case(case) for _ in range(args.runs)]
+    elapsed = statistics.median(r['elapsed'] for r in results)
+    max_rss = statistics.median(r['max_rss'] for r in results)
+    heavy = ', '.join(results[0]['heavy']) or '-'
+    print(f'{case:<17} {elapsed * 1000:7.0f} ms  max rss {max_rss / 1024:6.1f} MiB  heavy imports: {heavy}')
+
+
+if __name__ == '__main__':
+  main()
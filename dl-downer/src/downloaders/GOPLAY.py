@@ -2,18 +2,21 @@ import json
 import re
 import os
 import requests
+from concurrent.futures import ThreadPoolExecutor
 
 from loguru import logger
 
 
 from ..mpd.mpd import MPD
 from ..mpd.mpd_download_options import MPDDownloadOptions
-from ..utils.browser import create_playwright_page, get_storage_state_location
+from ..utils.browser import create_playwright_page, get_storage_state_location, get_valid_token_cookie
 from ..utils.download_video_nre import download_subs_nre
 from ..utils.local_cdm import Local_CDM
+from ..utils.key_cache import get_cached_keys, store_keys
+from ..utils.manifest_cache import get_manifest
+from ..utils.job_metrics import metrics_stage
 from ..utils.filename import parse_filename
 from ..utils.parse_filename_fields import parse_filename_fields
-from ..utils.files import insert_subtitle
 from ..models.dl_request_platform import DLRequestPlatform
 from ..models.dl_request import DLRequest
 from ..models.download_result import DownloadResult
@@ -36,15 +39,23 @@ def extract_goplay_bearer_token() -> str:
   '''
   Get bearer token from a headless browser performing a real login
   '''
+  # no browser needed while the stored token is still valid
+  token_cookie = get_valid_token_cookie(
+    DLRequestPlatform.GOPLAY,
+    lambda c: c['domain'] == 'www.play.tv' and c['name'].endswith('idToken'),
+  )
+  if token_cookie is not None:
+    return token_cookie['value']
+
   bearer_token = ''
   state_file = get_storage_state_location(DLRequestPlatform.GOPLAY)
 
-  browser = None
+  lease = None
 
   try:
     assert os.getenv('AUTH_GOPLAY_EMAIL'), 'AUTH_GOPLAY_EMAIL not set'
     assert os.getenv('AUTH_GOPLAY_PASSWORD'), 'AUTH_GOPLAY_PASSWORD not set'
-    browser, page = create_playwright_page(DLRequestPlatform.GOPLAY)
+    lease, page = create_playwright_page(DLRequestPlatform.GOPLAY)
 
     page.goto("https://www.play.tv/profiel", wait_until='networkidle')
     handle_goplay_consent_popup(page)
@@ -73,8 +84,9 @@ def extract_goplay_bearer_token() -> str:
       page.context.storage_state(path=state_file)
 
   finally:
-    if browser is not None:
-      browser.close()
+    if lease is not None:
+      # closes the page, the browser stays warm for the next job
+      lease.close()
 
   # read idToken from state file
   with open(state_file, 'r') as f:
@@ -124,22 +136,29 @@ def get_stream_manifest_and_drm_xml(type_form: str, video_uuid: str) -> tuple:
     return stream_manifest, drm_xml
 
 def get_drm_keys(drm_xml: str, stream_manifest: str) -> dict:
-  manifest_response = requests.get(stream_manifest)
-  pssh = re.findall(r'<cenc:pssh[^>]*>(.{,120})</cenc:pssh>', manifest_response.text)[0]
+  # the same copy is parsed and handed to n-m3u8dl-re later on
+  manifest = get_manifest(MPD.get_fetch_url(stream_manifest))
+  pssh = re.findall(r'<cenc:pssh[^>]*>(.{,120})</cenc:pssh>', manifest)[0]
   logger.debug(f'PSSH: {pssh}')
-  cdm = Local_CDM()
-  challenge = cdm.generate_challenge(pssh)
-  headers = { 'Customdata': drm_xml }
-  lic_res = requests.post('https://widevine.keyos.com/api/v4/getLicense', data=challenge, headers=headers)
-  lic_res.raise_for_status()
-  keys = cdm.decrypt_response(lic_res.content)
+  cached_keys = get_cached_keys(pssh)
+  if cached_keys is not None:
+    return cached_keys
+  with metrics_stage('license'), Local_CDM() as cdm:
+    challenge = cdm.generate_challenge(pssh)
+    headers = { 'Customdata': drm_xml }
+    lic_res = requests.post('https://widevine.keyos.com/api/v4/getLicense', data=challenge, headers=headers)
+    lic_res.raise_for_status()
+    keys = cdm.decrypt_response(lic_res.content)
+  store_keys(pssh, keys)
   return keys
 
 def get_stream_manifest_and_keys(type_form: str, video_uuid: str, is_drm: bool) -> tuple:
   stream_manifest = ''
   keys = {}
 
-  stream_manifest, drm_xml = get_stream_manifest_and_drm_xml(type_form, video_uuid)
+  # includes the login when the stored token expired
+  with metrics_stage('metadata'):
+    stream_manifest, drm_xml = get_stream_manifest_and_drm_xml(type_form, video_uuid)
   logger.debug(f'Stream manifest: {stream_manifest}')
   logger.debug(f'DRM XML: {drm_xml}')
   if is_drm:
@@ -193,22 +212,32 @@ def GOPLAY_DL(dl_request: DLRequest) -> DownloadResult:
   # merge the files per format
   merge_method = os.getenv('DL_GOPLAY_MERGE_METHOD', 'format')
   download_options.merge_method = merge_method
-  # download the mpd
-  final_file = mpd.download('./tmp', download_options)
+  # keep progress per request, so a retried or restarted request resumes where it stopped
+  if dl_request.id != '-':
+    download_options.resume_dir = os.path.join('./tmp', 'resume', str(dl_request.id))
+  # Download the subtitles while the tracks are downloading,
+  # they are added in the same pass as the tracks
+  with ThreadPoolExecutor(max_workers=1) as executor:
+    subs_future = executor.submit(
+      download_subs_nre,
+      mpd_url=MPD.get_fetch_url(stream_manifest),
+      filename=title,
+      platform=DLRequestPlatform.GOPLAY,
+      keys=keys,
+    )
+    download_options.subtitles = subs_future.result
+    # download the mpd
+    try:
+      final_file = mpd.download('./tmp', download_options)
+    finally:
+      # also when the download failed, the subtitles are still written.
+      # When fetching them failed there is nothing to remove, and raising
+      # that error here would hide the error of the download
+      if subs_future.exception() is None:
+        for sub in subs_future.result():
+          os.remove(sub)
   extension = os.path.splitext(final_file)[1][1:]
 
-  # Download and insert subtitles while still in tmp location
-  downloaded_subs = download_subs_nre(
-    mpd_url=stream_manifest,
-    filename=title,
-    platform=DLRequestPlatform.GOPLAY,
-    keys=keys,
-  )
-  # if downloaded subs, insert them into the video file and remove them
-  for sub in downloaded_subs:
-    insert_subtitle(input_file=final_file, subtitle_file=sub)
-    os.remove(sub)
-
   parsed = parse_filename_fields(title)
 
   return DownloadResult(
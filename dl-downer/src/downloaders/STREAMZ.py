@@ -7,6 +7,8 @@ from ..models.dl_request import DLRequest
 from ..models.dl_request_platform import DLRequestPlatform
 from ..utils.browser import create_playwright_page, get_storage_state_location
 from ..utils.browser_diagnostics import export_browser_diagnostics
+from ..utils.play_config import resolve_play_config, save_play_config_request
+from ..utils.job_metrics import metrics_stage
 from .VTMGO import process_dpg_media_download
 
 
@@ -25,11 +27,15 @@ def handle_streamz_consent_popup(page):
   logger.debug("Cookies accepted")
 
 def get_streamz_data(video_page_url: str):
-  browser = None
-  config = None
+  # the browser is only needed when the stored session is refused
+  config = resolve_play_config(DLRequestPlatform.STREAMZ, video_page_url)
+  if config is not None:
+    return config
+
+  lease = None
 
   try:
-    browser, page = create_playwright_page(DLRequestPlatform.STREAMZ)
+    lease, page = create_playwright_page(DLRequestPlatform.STREAMZ)
 
     page.goto("https://www.streamz.be/", wait_until="networkidle")
     handle_streamz_consent_popup(page)
@@ -74,6 +80,8 @@ def get_streamz_data(video_page_url: str):
       if config is None:
         try:
           config = response.json()
+          if response.ok:
+            save_play_config_request(DLRequestPlatform.STREAMZ, video_page_url, route.request)
         except Exception as e:
           logger.warning(f'Failed to read play-config response body: {e}')
       # Always fulfill so the page receives the response normally.
@@ -98,14 +106,17 @@ def get_streamz_data(video_page_url: str):
     logger.debug('Got config response')
 
   finally:
-    if browser is not None:
-      browser.close()
+    if lease is not None:
+      # closes the page, the browser stays warm for the next job
+      lease.close()
 
   return config
 
 
 def STREAMZ_DL(dl_request: DLRequest):
-  config = get_streamz_data(dl_request.video_page_or_manifest_url)
+  # the play config is resolved from the stored request, the browser is only the fallback
+  with metrics_stage('metadata'):
+    config = get_streamz_data(dl_request.video_page_or_manifest_url)
   logger.debug(f"Config: {config}")
 
   return process_dpg_media_download(
@@ -12,8 +12,10 @@ from ..models.dl_request import DLRequest
 from ..models.download_result import DownloadResult
 from ..utils.filename import parse_filename
 from ..utils.local_cdm import Local_CDM
+from ..utils.key_cache import get_cached_keys, store_keys
+from ..utils.job_metrics import metrics_stage
 from ..utils.download_video_nre import download_video_nre
-from ..utils.browser import create_playwright_page, get_storage_state_location, user_agent
+from ..utils.browser import create_playwright_page, get_storage_state_location, get_storage_state_cookies, get_valid_token_cookie, user_agent
 from .const.VRTMAX_graphql_query import VRTMAX_graphql_query
 
 headers = {
@@ -44,11 +46,15 @@ def extract_vrt_cookies():
 
   :returns: cookies List[Cookies], vrt_token: str
   '''
+  # no browser needed while the stored token is still valid
+  token_cookie = get_valid_token_cookie(DLRequestPlatform.VRTMAX, lambda c: c['name'] == 'vrtnu-site_profile_vt')
+  if token_cookie is not None:
+    return (get_storage_state_cookies(DLRequestPlatform.VRTMAX), token_cookie['value'])
 
-  browser = None
+  lease = None
 
   try:
-    browser, page = create_playwright_page(DLRequestPlatform.VRTMAX)
+    lease, page = create_playwright_page(DLRequestPlatform.VRTMAX)
 
     page.goto("https://www.vrt.be/vrtmax/", wait_until='networkidle')
     handle_vrt_consent_popup(page)
@@ -80,8 +86,9 @@ def extract_vrt_cookies():
       page.context.storage_state(path=get_storage_state_location(DLRequestPlatform.VRTMAX))
 
   finally:
-    if browser is not None:
-      browser.close()
+    if lease is not None:
+      # closes the page, the browser stays warm for the next job
+      lease.close()
 
   # get cookie named 'vrtnu-site_profile_vt'
   vrt_token = next(c['value'] for c in cookies if c['name'] == 'vrtnu-site_profile_vt')
@@ -262,9 +269,10 @@ def VRTMAX_DL(dl_request: DLRequest) -> DownloadResult:
   # Transform List[Cookies] into RequestsCookieJar
   cookies = requests.utils.cookiejar_from_dict({c['name']:c['value'] for c in cookies})
 
-  program_title, season, episode, stream_id = get_graphql_metadata(url_path, cookies)
-  video_token = get_video_token(vrt_token, '')
-  drm_token, mpd_url = get_video_metadata(stream_id, video_token)
+  with metrics_stage('metadata'):
+    program_title, season, episode, stream_id = get_graphql_metadata(url_path, cookies)
+    video_token = get_video_token(vrt_token, '')
+    drm_token, mpd_url = get_video_metadata(stream_id, video_token)
 
   title = dl_request.output_filename if dl_request.output_filename else program_title
   # Build intermediate filename for the download tool
@@ -279,11 +287,14 @@ def VRTMAX_DL(dl_request: DLRequest) -> DownloadResult:
     pssh = get_pssh_box(mpd_url)
     logger.debug(f'PSSH: {pssh}')
 
-    myCDM = Local_CDM()
-    challenge = myCDM.generate_challenge(pssh)
-    response = get_license_response(challenge, drm_token)
-    keys = myCDM.decrypt_response(response)
-    myCDM.close()
+    # retries and re-downloads of the same content don't need a new license
+    keys = get_cached_keys(pssh)
+    if keys is None:
+      with metrics_stage('license'), Local_CDM() as myCDM:
+        challenge = myCDM.generate_challenge(pssh)
+        response = get_license_response(challenge, drm_token)
+        keys = myCDM.decrypt_response(response)
+      store_keys(pssh, keys)
 
   # download the video
   downloaded_file = download_video_nre(
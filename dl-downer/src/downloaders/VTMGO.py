@@ -11,10 +11,14 @@ from ..models.dl_request_platform import DLRequestPlatform
 from ..models.download_result import DownloadResult
 from ..utils.download_video_nre import download_video_nre
 from ..utils.local_cdm import Local_CDM
+from ..utils.key_cache import get_cached_keys, store_keys
+from ..utils.manifest_cache import get_manifest
+from ..utils.job_metrics import metrics_stage
 from ..utils.filename import parse_filename
-from ..utils.files import insert_subtitle
-from ..utils.browser import create_playwright_page, get_storage_state_location, user_agent
+from ..utils.files import insert_subtitles
+from ..utils.browser import create_playwright_page, get_storage_state_location, get_jwt_expiry, get_valid_token_cookie, user_agent
 from ..utils.browser_diagnostics import export_browser_diagnostics
+from ..utils.play_config import resolve_play_config, save_play_config_request
 
 def handle_vtmgo_consent_popup(page):
   '''
@@ -76,21 +80,43 @@ def handle_vtmgo_login(page):
     raise Exception('Login failed, check credentials or try running with "headless=false"?')
   logger.debug('Logged in successfully')
 
+def ensure_vtmgo_logged_in(page):
+  '''
+  Open the home page and log in when needed, then store the session
+  '''
+  page.goto("https://www.vtmgo.be/vtmgo", wait_until='networkidle')
+  handle_vtmgo_consent_popup(page)
+  handle_vtmgo_profile_selection(page)
+  is_logged_in = check_vtmgo_logged_in(page)
+  if not is_logged_in:
+    handle_vtmgo_login(page)
+
+  page.context.storage_state(path=get_storage_state_location(DLRequestPlatform.VTMGO))
+
+def has_valid_vtmgo_session() -> bool:
+  '''Check for a JWT session cookie that is still valid, so the home page login check can be skipped'''
+  token_cookie = get_valid_token_cookie(
+    DLRequestPlatform.VTMGO,
+    lambda c: 'vtmgo.be' in c['domain'] and get_jwt_expiry(c['value']) is not None,
+  )
+  return token_cookie is not None
+
 def get_vtmgo_data(video_page_url: str):
-  browser = None
-  config = None
+  # the browser is only needed when the stored session is refused
+  config = resolve_play_config(DLRequestPlatform.VTMGO, video_page_url)
+  if config is not None:
+    return config
 
-  try:
-    browser, page = create_playwright_page(DLRequestPlatform.VTMGO)
+  lease = None
 
-    page.goto("https://www.vtmgo.be/vtmgo", wait_until='networkidle')
-    handle_vtmgo_consent_popup(page)
-    handle_vtmgo_profile_selection(page)
-    is_logged_in = check_vtmgo_logged_in(page)
-    if not is_logged_in:
-      handle_vtmgo_login(page)
+  try:
+    lease, page = create_playwright_page(DLRequestPlatform.VTMGO)
 
-    page.context.storage_state(path=get_storage_state_location(DLRequestPlatform.VTMGO))
+    skipped_login_check = has_valid_vtmgo_session()
+    if skipped_login_check:
+      logger.debug('Valid session found, skipping the login check')
+    else:
+      ensure_vtmgo_logged_in(page)
 
     config = None
 
@@ -102,6 +128,8 @@ def get_vtmgo_data(video_page_url: str):
       if config is None:
         try:
           config = response.json()
+          if response.ok:
+            save_play_config_request(DLRequestPlatform.VTMGO, video_page_url, route.request)
         except Exception as e:
           logger.warning(f'Failed to read play-config response body: {e}')
       # Always fulfill so the page receives the response normally.
@@ -118,6 +146,11 @@ def get_vtmgo_data(video_page_url: str):
       if max_wait == 0:
         export_browser_diagnostics(page, 'vtmgo-config-failed')
         raise Exception('Failed to get config response, tried 10 times :/')
+      if skipped_login_check and max_wait <= 7:
+        # the stored session might not be accepted after all, do the full login
+        logger.debug('No config response with the stored session, checking the login')
+        skipped_login_check = False
+        ensure_vtmgo_logged_in(page)
       page.goto('about:blank', wait_until='load')
       max_wait -= 1
       page.goto(video_page_url, wait_until='load')
@@ -126,8 +159,9 @@ def get_vtmgo_data(video_page_url: str):
     logger.debug('Got config response')
 
   finally:
-    if browser is not None:
-      browser.close()
+    if lease is not None:
+      # closes the page, the browser stays warm for the next job
+      lease.close()
 
   return config
 
@@ -185,36 +219,38 @@ def generate_filename_from_metadata(config, output_filename=None):
 
 def get_pssh_from_manifest(mpd_url):
   """Extract PSSH from MPD manifest"""
-  manifest_response = requests.get(mpd_url)
-  manifest_response.raise_for_status()
-  logger.debug(f'Manifest response status: {manifest_response.status_code}')
+  # cached for the job, n-m3u8dl-re gets the same copy
+  manifest = get_manifest(mpd_url)
 
   try:
-    pssh = re.findall(r'<cenc:pssh[^>]*>(.{,240})</cenc:pssh>', manifest_response.text)[0]
+    pssh = re.findall(r'<cenc:pssh[^>]*>(.{,240})</cenc:pssh>', manifest)[0]
     assert pssh
     return pssh
   except:
-    raise Exception(f'Failed to find pssh in manifest: {manifest_response.text}')
+    raise Exception(f'Failed to find pssh in manifest: {manifest}')
 
 def get_widevine_keys(pssh, license_url, auth_token, origin_url='https://www.vtmgo.be'):
   """Get Widevine decryption keys"""
-  cdm = Local_CDM()
-  challenge = cdm.generate_challenge(pssh)
-  headers = {
-    'user-agent': user_agent,
-    'origin': origin_url,
-    'connection': 'keep-alive',
-    'accept': '*/*',
-    'accept-encoding': 'gzip, deflate, br',
-    'X-Dt-Auth-Token': auth_token,
-  }
-  license_response = requests.post(license_url, data=challenge, headers=headers)
-  license_response.raise_for_status()
-  license_response_json = license_response.json()
-  license = license_response_json['license']
-  logger.debug(f'License: {license}')
-  keys = cdm.parse_license(license)
-  cdm.close()
+  cached_keys = get_cached_keys(pssh)
+  if cached_keys is not None:
+    return cached_keys
+  with metrics_stage('license'), Local_CDM() as cdm:
+    challenge = cdm.generate_challenge(pssh)
+    headers = {
+      'user-agent': user_agent,
+      'origin': origin_url,
+      'connection': 'keep-alive',
+      'accept': '*/*',
+      'accept-encoding': 'gzip, deflate, br',
+      'X-Dt-Auth-Token': auth_token,
+    }
+    license_response = requests.post(license_url, data=challenge, headers=headers)
+    license_response.raise_for_status()
+    license_response_json = license_response.json()
+    license = license_response_json['license']
+    logger.debug(f'License: {license}')
+    keys = cdm.parse_license(license)
+  store_keys(pssh, keys)
   return keys
 
 def download_and_insert_subtitles(config, downloaded_file, preferred_lang='nl-tt'):
@@ -248,7 +284,8 @@ def download_and_insert_subtitles(config, downloaded_file, preferred_lang='nl-tt
   with open(subtitle_filename, 'wb') as f:
     f.write(subtitle_response.content)
   logger.debug(f'Subtitle saved to {subtitle_filename}')
-  insert_subtitle(downloaded_file, subtitle_filename)
+  # 'nl-tt' is Dutch teletext
+  insert_subtitles(downloaded_file, [(subtitle_filename, subtitle['language'].split('-')[0])])
   os.remove(subtitle_filename)
 
 def process_dpg_media_download(config, dl_request, platform, origin_url='https://www.vtmgo.be') -> DownloadResult:
@@ -306,5 +343,7 @@ def process_dpg_media_download(config, dl_request, platform, origin_url='https:/
   )
 
 def VTMGO_DL(dl_request: DLRequest) -> DownloadResult:
-  config = get_vtmgo_data(dl_request.video_page_or_manifest_url)
+  # the play config is resolved from the stored request, the browser is only the fallback
+  with metrics_stage('metadata'):
+    config = get_vtmgo_data(dl_request.video_page_or_manifest_url)
   return process_dpg_media_download(config, dl_request, DLRequestPlatform.VTMGO)
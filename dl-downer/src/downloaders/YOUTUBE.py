@@ -6,6 +6,7 @@ from loguru import logger
 from ..models.dl_request import DLRequest
 from ..models.download_result import DownloadResult
 from ..models.dl_request_platform import DLRequestPlatform
+from ..utils.job_metrics import metrics_stage, get_file_size
 
 def YOUTUBE_DL(dl_request: DLRequest):
   
@@ -39,13 +40,15 @@ def YOUTUBE_DL(dl_request: DLRequest):
   command.extend(['--print', 'after_move:filepath'])
 
   logger.debug(f'Running command: {command}')
-  proc = subprocess.run(command, capture_output=True, text=True)
-  logger.debug(f'yt-dlp stdout: {proc.stdout}')
-  if proc.stderr:
-    logger.debug(f'yt-dlp stderr: {proc.stderr}')
-
-  # The last non-empty line of stdout is the resolved filepath
-  resolved_path = proc.stdout.strip().splitlines()[-1].strip() if proc.stdout.strip() else file_path
+  with metrics_stage('segments', tool='yt-dlp') as stage:
+    proc = subprocess.run(command, capture_output=True, text=True)
+    logger.debug(f'yt-dlp stdout: {proc.stdout}')
+    if proc.stderr:
+      logger.debug(f'yt-dlp stderr: {proc.stderr}')
+
+    # The last non-empty line of stdout is the resolved filepath
+    resolved_path = proc.stdout.strip().splitlines()[-1].strip() if proc.stdout.strip() else file_path
+    stage.bytes = get_file_size(resolved_path)
   title = os.path.splitext(os.path.basename(resolved_path))[0]
 
   return DownloadResult(
@@ -69,6 +69,79 @@ class DLRequest:
       self.preferred_quality_matcher,
     )
   
+  @classmethod
+  def claim_next_pending(cls, db):
+    '''
+    Atomically claim the oldest pending DLRequest and mark it IN_PROGRESS.
+
+    Rows locked by another worker are skipped, so concurrent workers
+    (threads, processes or containers) never claim the same request.
+
+    :return: the claimed DLRequest, or None if nothing is pending
+    '''
+    db_conn = db.getconn()
+    try:
+      cursor = db_conn.cursor()
+      cursor.execute(
+        '''
+        UPDATE dl.dl_request
+        SET status = %s, updated = NOW()
+        WHERE id = (
+          SELECT id FROM dl.dl_request
+          WHERE status = %s
+          ORDER BY created ASC
+          LIMIT 1
+          FOR UPDATE SKIP LOCKED
+        )
+        RETURNING *
+        ''',
+        (DLRequestStatus.IN_PROGRESS.value, DLRequestStatus.PENDING.value),
+      )
+      row = cursor.fetchone()
+      db_conn.commit()
+      cursor.close()
+    except Exception:
+      db_conn.rollback()
+      raise
+    finally:
+      db.putconn(db_conn)
+
+    if row is None:
+      return None
+    dl_request = cls.from_db_row(row)
+    dl_request.status = DLRequestStatus.IN_PROGRESS
+    return dl_request
+
+  @classmethod
+  def requeue_in_progress(cls, db) -> int:
+    '''
+    Put every IN_PROGRESS DLRequest back to PENDING. Meant for server startup:
+    requests that were being downloaded when the server stopped are never finished otherwise.
+    Only safe when no other server works on the same database.
+
+    :return: the number of requests put back
+    '''
+    db_conn = db.getconn()
+    try:
+      cursor = db_conn.cursor()
+      cursor.execute(
+        '''
+        UPDATE dl.dl_request
+        SET status = %s, updated = NOW()
+        WHERE status = %s
+        ''',
+        (DLRequestStatus.PENDING.value, DLRequestStatus.IN_PROGRESS.value),
+      )
+      count = cursor.rowcount
+      db_conn.commit()
+      cursor.close()
+    except Exception:
+      db_conn.rollback()
+      raise
+    finally:
+      db.putconn(db_conn)
+    return count
+
   def update_status(self, new_status: DLRequestStatus, db):
     ''' Update the status of the DLRequest in the database '''
     db_conn = db.getconn()
@@ -1,3 +1,4 @@
+import contextlib
 import os
 import re
 import shutil
@@ -10,6 +11,7 @@ from loguru import logger
 from .segment_template import SegmentTemplate
 from .representation import Representation
 from .mpd_download_options import MPDDownloadOptions
+from .download_scheduler import DownloadScheduler
 from ..utils.files import decrypt_file, defragment_mp4
 
 class AdaptationSet:
@@ -100,25 +102,18 @@ class AdaptationSet:
       has_content_protections=has_content_protections,
     )
 
-  def download(
+  def select_representation(
     self,
-    tmp_dir: str,
-    base_url: str,
     download_options: MPDDownloadOptions = None,
-  ) -> str:
+  ) -> Representation:
     '''
-    Downloads the adaptation set to the tmp_dir.
+    Select the representation to download based on the download options.
 
-    :return: the path to the downloaded adaptation set mp4 file
+    :return: the selected representation, or None if none matches
     '''
-    logger.debug(f'Downloading adaptation set {self.id}')
-    # Create a temporary folder
-    my_tmp_dir = os.path.join(tmp_dir, f'adaptation-set-{str(uuid.uuid4())[:8]}')
-    os.makedirs(my_tmp_dir, exist_ok=True)
-    # download the first representation
     if len(self.representations) == 0:
       raise Exception('No representations found')
-    
+
     # download the first representation
     representation_to_download = self.representations[0]
     # check download options
@@ -163,29 +158,57 @@ class AdaptationSet:
         # will return None for now
         pass
 
+    return representation_to_download
+
+  def download(
+    self,
+    tmp_dir: str,
+    base_url: str,
+    download_options: MPDDownloadOptions = None,
+    scheduler: DownloadScheduler = None,
+    representation: Representation = None,
+  ) -> str:
+    '''
+    Downloads the adaptation set to the tmp_dir.
+
+    :param representation: the representation to download, when it was already selected
+    :return: the path to the downloaded adaptation set mp4 file
+    '''
+    logger.debug(f'Downloading adaptation set {self.id}')
+    representation_to_download = representation if representation is not None else self.select_representation(download_options)
+
     # no appropriate representation found
     if representation_to_download is None:
       return None
 
+    # Create a temporary folder
+    my_tmp_dir = os.path.join(tmp_dir, f'adaptation-set-{str(uuid.uuid4())[:8]}')
+    os.makedirs(my_tmp_dir, exist_ok=True)
+
     logger.debug(f'Selected representation: {self.mime_type} | {representation_to_download.codecs} | {representation_to_download.width}x{representation_to_download.height} | {representation_to_download.bandwidth}bps')
-    created_file = representation_to_download.download(my_tmp_dir, base_url, self.segment_template)
+    created_file = representation_to_download.download(my_tmp_dir, base_url, self.segment_template, download_options, scheduler)
     
     if self.has_content_protections:
       if download_options is None or len(download_options.decrypt_keys) == 0:
         raise Exception('Content is encrypted, but no decryption keys provided')
 
-    if download_options is not None:
-      if len(download_options.decrypt_keys) > 0:
-        # decrypt the file
-        decrypted_file = decrypt_file(created_file, download_options.decrypt_keys)
-        # replace created_file with decrypted_file
-        created_file = decrypted_file
-
-    if download_options.defragment:
-      # defragment the file, just in case
-      defragmented_file = os.path.join(my_tmp_dir, f'defrag-{os.path.basename(created_file)}')
-      defragment_mp4(created_file, defragmented_file)
-      created_file = defragmented_file
+    # Limit the number of tracks post-processed at the same time
+    postprocess_slot = scheduler.postprocess_slots if scheduler is not None else contextlib.nullcontext()
+    with postprocess_slot:
+      if download_options is not None:
+        # 'inline' decryption already happened while downloading the segments
+        if len(download_options.decrypt_keys) > 0 and download_options.decrypt_method == 'mp4decrypt':
+          # decrypt the file
+          decrypted_file = decrypt_file(created_file, download_options.decrypt_keys)
+          # replace created_file with decrypted_file
+          created_file = decrypted_file
+
+      # the single pass mux rewrites the file anyway
+      if download_options.defragment and not download_options.single_pass_mux:
+        # defragment the file, just in case
+        defragmented_file = os.path.join(my_tmp_dir, f'defrag-{os.path.basename(created_file)}')
+        defragment_mp4(created_file, defragmented_file)
+        created_file = defragmented_file
 
     # Move the file to the parent folder
     mime_type_escaped = re.sub(r'[^a-zA-Z0-9]', '-', self.mime_type)
@@ -0,0 +1,266 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+
+from typing import Callable, List
+from loguru import logger
+
+from .segment_download import SegmentDownloader, get_default_thread_count
+from ..utils.host_concurrency import get_host_concurrency, parse_retry_after
+from ..utils.http_session import get_pool_maxsize
+
+# Segments are requested before their size is known, this is assumed until the first ones are in
+DEFAULT_SEGMENT_SIZE_ESTIMATE = 1024 * 1024
+# How often a coroutine checks again for a free slot of the scheduler or the host
+ACQUIRE_POLL_INTERVAL = 0.01
+
+def get_default_max_bytes_in_flight() -> int:
+  ''' 64 MiB unless configured otherwise '''
+  return int(os.getenv('DL_MAX_BYTES_IN_FLIGHT', str(64 * 1024 * 1024)))
+
+async def acquire_async(acquire: Callable[[bool], bool], abort: threading.Event = None) -> bool:
+  '''
+  Wait for a slot of a limit that is shared with other threads (a threading
+  semaphore, HostConcurrency), without blocking the event loop.
+
+  :param acquire: takes blocking=False and returns whether the slot was taken
+  :param abort: stop waiting when it is set
+  :return: whether the slot was taken
+  '''
+  while not acquire(False):
+    if abort is not None and abort.is_set():
+      return False
+    await asyncio.sleep(ACQUIRE_POLL_INTERVAL)
+  return True
+
+class ByteBudget:
+  '''
+  Limits the number of bytes of segments that are downloading or waiting
+  to be written. Used from one event loop only.
+  '''
+
+  def __init__(self, limit: int):
+    self.limit = limit
+    self.used = 0
+    self.aborted = False
+    self.condition = asyncio.Condition()
+
+  async def acquire(self, size: int):
+    async with self.condition:
+      # always let a request through when nothing is in flight, so a segment
+      # that is larger than the budget can't stall the download
+      await self.condition.wait_for(lambda: self.aborted or self.used == 0 or self.used + size <= self.limit)
+      self.used += size
+
+  async def release(self, size: int):
+    async with self.condition:
+      self.used -= size
+      self.condition.notify_all()
+
+  async def abort(self):
+    async with self.condition:
+      self.aborted = True
+      self.condition.notify_all()
+
+class AsyncSegmentDownloader(SegmentDownloader):
+  '''
+  Streams segments into the output file like SegmentDownloader, but with
+  asyncio and httpx instead of a thread pool. Requests are multiplexed over
+  a few (HTTP/2 when the server supports it) connections.
+
+  The number of requests in flight is bounded like it is for the threads:
+  every request takes one of the `segment_slots` shared by all
+  representations (see DownloadScheduler) and a slot of the HostConcurrency
+  of its host, and segments take a slot of the shared `window` (when given)
+  until they are written. On top of that, a segment is only requested when its
+  estimated size (the average of the segments so far) fits in
+  `max_bytes_in_flight`, together with all segments that are downloading or
+  waiting in the reorder buffer.
+  '''
+
+  def __init__(
+    self,
+    segment_urls: List[str],
+    out_file: str,
+    work_dir: str,
+    max_bytes_in_flight: int = None,
+    max_concurrency: int = None,
+    segment_slots: threading.Semaphore = None,
+    executor: concurrent.futures.Executor = None,
+    max_connections: int = None,
+    http2: bool = True,
+    resume_path: str = None,
+    transform: Callable[[bytes], bytes] = None,
+    segment_ranges: List[str] = None,
+    window: threading.Semaphore = None,
+    abort: threading.Event = None,
+  ):
+    '''
+    :param segment_slots: shared limit on the requests in flight, defaults to max_concurrency for this downloader alone
+    :param executor: runs the transform, off the event loop
+    :param window: shared slots for segments in flight or waiting to be written, on top of max_bytes_in_flight
+    :param abort: shared event that stops the download, set when a segment fails
+    '''
+    super().__init__(
+      segment_urls,
+      out_file,
+      work_dir,
+      stream=True,
+      max_threads=max_concurrency,
+      executor=executor,
+      resume_path=resume_path,
+      transform=transform,
+      segment_ranges=segment_ranges,
+      window=window,
+      abort=abort,
+    )
+    self.max_bytes_in_flight = max_bytes_in_flight or get_default_max_bytes_in_flight()
+    self.segment_slots = segment_slots or threading.BoundedSemaphore(max_concurrency or get_default_thread_count())
+    self.max_connections = max_connections or get_pool_maxsize()
+    self.http2 = http2
+
+  def download(self, init_data: bytes) -> str:
+    ''':return: the path to the combined output file'''
+    try:
+      asyncio.get_running_loop()
+    except RuntimeError:
+      asyncio.run(self._download_async(init_data))
+      return self.out_file
+    # The sync playwright API keeps an event loop running on the thread that started it
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+      executor.submit(asyncio.run, self._download_async(init_data)).result()
+    return self.out_file
+
+  async def _acquire_slots(self, segment_url: str):
+    ''' Take a slot of the scheduler and of the host, like fetch_segment does for threads '''
+    await acquire_async(self.segment_slots.acquire)
+    try:
+      await acquire_async(get_host_concurrency(segment_url).acquire)
+    except BaseException:
+      self.segment_slots.release()
+      raise
+
+  async def _fetch_async(self, client, index: int, segment_url: str) -> bytes:
+    '''
+    Async version of fetch_segment.
+    The slots for the first attempt are taken by the caller.
+    '''
+    retries = 3
+    last_error = None
+    host = get_host_concurrency(segment_url)
+    for attempt in range(1, retries + 1):
+      if attempt > 1:
+        await self._acquire_slots(segment_url)
+      try:
+        byte_range = self.segment_ranges[index] if self.segment_ranges is not None else None
+        headers = { 'Range': f'bytes={byte_range}' } if byte_range is not None else None
+        start = time.perf_counter()
+        async with client.stream('GET', segment_url, headers=headers) as response:
+          latency = time.perf_counter() - start
+          if response.status_code == 429 or response.status_code >= 500:
+            host.on_throttled(response.status_code, parse_retry_after(response.headers.get('Retry-After')))
+          response.raise_for_status()
+          if byte_range is not None and response.status_code != 206:
+            raise Exception(f'Server ignored the byte range {byte_range}')
+          data = bytearray()
+          async for chunk in response.aiter_bytes():
+            data.extend(chunk)
+        if not data:
+          raise Exception('Empty segment response')
+        host.on_success(len(data), latency)
+        return bytes(data)
+      except Exception as error:
+        last_error = error
+        if attempt < retries:
+          logger.warning(f'Segment {index} failed on attempt {attempt}/{retries}: {error}. Retrying...')
+      finally:
+        host.release()
+        self.segment_slots.release()
+      if attempt < retries:
+        # other segments can use the slots while this one waits
+        await asyncio.sleep(0.5 * attempt)
+    raise Exception(f'Failed to download segment {index} after {retries} attempts: {segment_url}') from last_error
+
+  async def _download_async(self, init_data: bytes):
+    import httpx
+
+    http2 = self.http2
+    if http2:
+      try:
+        import h2
+      except ImportError:
+        logger.warning('h2 is not installed, falling back to HTTP/1.1')
+        http2 = False
+
+    loop = asyncio.get_running_loop()
+    budget = ByteBudget(self.max_bytes_in_flight)
+    reorder_buffer = {}
+    failed_segments = []
+    downloaded = { 'bytes': 0, 'count': 0 }
+
+    f, state, target_file, next_index = self._open_output(init_data)
+
+    async with httpx.AsyncClient(
+      http2=http2,
+      limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+      # requests wait for a free connection as long as needed, the slots bound them
+      timeout=httpx.Timeout(20, pool=None),
+      follow_redirects=True,
+    ) as client:
+      with f:
+
+        async def download_and_write(index: int, segment_url: str, reserved: int):
+          nonlocal next_index
+          try:
+            data = await self._fetch_async(client, index, segment_url)
+            if self.transform is not None:
+              # e.g. decryption is CPU work, keep it off the event loop
+              data = await loop.run_in_executor(self.executor, self.transform, data)
+          except Exception as error:
+            failed_segments.append((index, error))
+            self.abort.set()
+            if self.window is not None:
+              self.window.release()
+            await budget.release(reserved)
+            await budget.abort()
+            return
+          downloaded['bytes'] += len(data)
+          downloaded['count'] += 1
+          # hold the real size until the segment is written
+          await budget.release(reserved - len(data))
+          reorder_buffer[index] = data
+          # Write every segment that is next in line
+          while next_index in reorder_buffer:
+            data = reorder_buffer.pop(next_index)
+            f.write(data)
+            if state is not None:
+              # the state may never claim more than what is in the file
+              f.flush()
+              state.record(next_index, data)
+            next_index += 1
+            if self.window is not None:
+              self.window.release()
+            await budget.release(len(data))
+
+        tasks = []
+        for i in range(next_index, len(self.segment_urls)):
+          estimate = downloaded['bytes'] // downloaded['count'] if downloaded['count'] > 0 else DEFAULT_SEGMENT_SIZE_ESTIMATE
+          await budget.acquire(estimate)
+          if budget.aborted or self.abort.is_set() or (self.window is not None and not await acquire_async(self.window.acquire, self.abort)):
+            await budget.release(estimate)
+            break
+          # only this loop waits for slots, not every segment that fits in the budget
+          await self._acquire_slots(self.segment_urls[i])
+          tasks.append(asyncio.create_task(download_and_write(i, self.segment_urls[i], estimate)))
+
+        # Everything must be written before the file is closed
+        await asyncio.gather(*tasks)
+        # give back the slots of segments that will never be written
+        if self.window is not None:
+          for _ in reorder_buffer:
+            self.window.release()
+
+    self._raise_if_aborted(failed_segments, next_index)
+    self._complete_output(failed_segments, state, target_file, next_index)
@@ -0,0 +1,332 @@
+import struct
+
+from typing import Dict, List, Tuple
+from loguru import logger
+from Crypto.Cipher import AES
+
+from .mp4_boxes import Box, iter_boxes, find_box, rename_box, read_full_box_header
+
+# PIFF 1.1 SampleEncryptionBox, used by older (Smooth Streaming based) packagers
+PIFF_SENC_UUID = bytes.fromhex('a2394f525a9b4f14a2446c427c648df4')
+
+SUPPORTED_SCHEMES = ['cenc', 'cbcs']
+
+class TrackEncryption:
+  '''Encryption parameters of one track, read from its tenc box'''
+
+  def __init__(
+    self,
+    scheme: str,
+    kid: str,
+    key: bytes,
+    per_sample_iv_size: int,
+    constant_iv: bytes = None,
+    crypt_byte_block: int = 0,
+    skip_byte_block: int = 0,
+  ):
+    self.scheme = scheme
+    self.kid = kid
+    self.key = key
+    self.per_sample_iv_size = per_sample_iv_size
+    self.constant_iv = constant_iv
+    self.crypt_byte_block = crypt_byte_block
+    self.skip_byte_block = skip_byte_block
+  def __str__(self):
+    return f'<TrackEncryption(scheme={self.scheme}, kid={self.kid}, per_sample_iv_size={self.per_sample_iv_size}, pattern={self.crypt_byte_block}:{self.skip_byte_block})>'
+  def __repr__(self):
+    return self.__str__()
+
+class CencDecryptor:
+  '''
+  Decrypts Common Encryption ('cenc' and 'cbcs') fragmented MP4 streams in
+  process, one fragment at a time, so decryption runs while the rest of the
+  stream is still downloading.
+
+  Call decrypt_init() with the init segment first, then decrypt_segment()
+  for every media segment (thread-safe). Samples are decrypted in place and
+  the encryption boxes are turned into 'free' boxes, so all box sizes and
+  offsets stay valid. The result is what mp4decrypt would produce.
+  '''
+
+  def __init__(self, keys: Dict[str, str]):
+    ''':param keys: dict of {key_id: key}, both in hex'''
+    self.keys = { kid.replace('-', '').lower(): bytes.fromhex(key) for kid, key in keys.items() }
+    # track_ID -> TrackEncryption
+    self.tracks: Dict[int, TrackEncryption] = {}
+    # track_ID -> default sample size from the trex box
+    self.default_sample_sizes: Dict[int, int] = {}
+
+  def decrypt_init(self, data: bytes) -> bytes:
+    '''
+    Read the encryption parameters from the init segment and remove the
+    encryption signalling from it.
+
+    :return: the init segment for the decrypted stream
+    '''
+    buf = bytearray(data)
+    for box in iter_boxes(buf):
+      if box.type != 'moov':
+        continue
+      for child in iter_boxes(buf, box.payload, box.end):
+        if child.type == 'pssh':
+          rename_box(buf, child, 'free')
+        elif child.type == 'trak':
+          self._read_trak(buf, child)
+        elif child.type == 'mvex':
+          for trex in iter_boxes(buf, child.payload, child.end):
+            if trex.type == 'trex':
+              track_id, _, _, default_sample_size = struct.unpack_from('>IIII', buf, trex.payload + 4)
+              self.default_sample_sizes[track_id] = default_sample_size
+    if len(self.tracks) > 0:
+      logger.debug(f'Decrypting tracks in process: {self.tracks}')
+    return bytes(buf)
+
+  def _read_trak(self, buf: bytearray, trak: Box):
+    tkhd = find_box(buf, ['tkhd'], trak.payload, trak.end)
+    version, _ = read_full_box_header(buf, tkhd)
+    track_id = struct.unpack_from('>I', buf, tkhd.payload + (20 if version == 1 else 12))[0]
+
+    stsd = find_box(buf, ['mdia', 'minf', 'stbl', 'stsd'], trak.payload, trak.end)
+    if stsd is None:
+      return
+    # skip version/flags and entry_count
+    for entry in iter_boxes(buf, stsd.payload + 8, stsd.end):
+      if entry.type == 'encv':
+        # SampleEntry (8) + VisualSampleEntry (70)
+        children_start = entry.payload + 78
+      elif entry.type == 'enca':
+        # SampleEntry (8) + AudioSampleEntry (20), QuickTime versions are longer
+        sound_version = struct.unpack_from('>H', buf, entry.payload + 8)[0]
+        children_start = entry.payload + 28 + { 1: 16, 2: 36 }.get(sound_version, 0)
+      else:
+        continue
+
+      sinf = find_box(buf, ['sinf'], children_start, entry.end)
+      if sinf is None:
+        continue
+      frma = find_box(buf, ['frma'], sinf.payload, sinf.end)
+      schm = find_box(buf, ['schm'], sinf.payload, sinf.end)
+      tenc = find_box(buf, ['schi', 'tenc'], sinf.payload, sinf.end)
+      if frma is None or tenc is None:
+        raise Exception(f'Incomplete protection info for track {track_id}')
+
+      scheme = buf[schm.payload + 4:schm.payload + 8].decode('latin-1') if schm is not None else 'cenc'
+      if scheme not in SUPPORTED_SCHEMES:
+        raise Exception(f'Unsupported protection scheme {scheme} for track {track_id}, use the mp4decrypt decrypt method')
+
+      self.tracks[track_id] = self._read_tenc(buf, tenc, scheme)
+      # restore the original sample entry (e.g. encv -> avc1) and hide the protection info
+      buf[entry.start + 4:entry.start + 8] = buf[frma.payload:frma.payload + 4]
+      rename_box(buf, sinf, 'free')
+
+  def _read_tenc(self, buf: bytearray, tenc: Box, scheme: str) -> TrackEncryption:
+    version, _ = read_full_box_header(buf, tenc)
+    offset = tenc.payload + 4
+    # reserved byte, then the pattern (version 1+) or another reserved byte
+    pattern = buf[offset + 1]
+    is_protected, per_sample_iv_size = buf[offset + 2], buf[offset + 3]
+    kid = buf[offset + 4:offset + 20].hex()
+    constant_iv = None
+    if is_protected == 1 and per_sample_iv_size == 0:
+      constant_iv_size = buf[offset + 20]
+      constant_iv = bytes(buf[offset + 21:offset + 21 + constant_iv_size])
+
+    key = self.keys.get(kid)
+    if key is None:
+      if len(self.keys) != 1:
+        raise Exception(f'No decryption key provided for KID {kid}')
+      # a single key is used for everything, even when the KID doesn't match
+      logger.warning(f'No key found for KID {kid}, using the only key provided')
+      key = next(iter(self.keys.values()))
+
+    return TrackEncryption(
+      scheme=scheme,
+      kid=kid,
+      key=key,
+      per_sample_iv_size=per_sample_iv_size,
+      constant_iv=constant_iv,
+      crypt_byte_block=(pattern >> 4) if version > 0 else 0,
+      skip_byte_block=(pattern & 0x0F) if version > 0 else 0,
+    )
+
+  def decrypt_segment(self, data: bytes) -> bytes:
+    ''':return: the decrypted media segment'''
+    if len(self.tracks) == 0:
+      return data
+    buf = bytearray(data)
+    boxes = list(iter_boxes(buf))
+    for i, box in enumerate(boxes):
+      if box.type == 'moof':
+        next_mdat = next((b for b in boxes[i + 1:] if b.type == 'mdat'), None)
+        self._decrypt_moof(buf, box, next_mdat)
+    return bytes(buf)
+
+  def _decrypt_moof(self, buf: bytearray, moof: Box, mdat: Box):
+    for traf in iter_boxes(buf, moof.payload, moof.end):
+      if traf.type != 'traf':
+        continue
+
+      track = None
+      track_id = None
+      base_offset = moof.start
+      default_sample_size = 0
+      runs: List[Tuple[int, List[int]]] = []
+      senc = None
+      senc_is_piff = False
+
+      for box in iter_boxes(buf, traf.payload, traf.end):
+        if box.type == 'tfhd':
+          _, flags = read_full_box_header(buf, box)
+          track_id = struct.unpack_from('>I', buf, box.payload + 4)[0]
+          track = self.tracks.get(track_id)
+          default_sample_size = self.default_sample_sizes.get(track_id, 0)
+          offset = box.payload + 8
+          if flags & 0x01:
+            base_offset = struct.unpack_from('>Q', buf, offset)[0]
+            offset += 8
+          if flags & 0x02:
+            offset += 4
+          if flags & 0x08:
+            offset += 4
+          if flags & 0x10:
+            default_sample_size = struct.unpack_from('>I', buf, offset)[0]
+        elif box.type == 'trun':
+          runs.append(self._read_trun(buf, box, default_sample_size))
+        elif box.type == 'senc':
+          senc = box
+        elif box.type == 'uuid' and buf[box.start + 8:box.start + 24] == PIFF_SENC_UUID:
+          senc = box
+          senc_is_piff = True
+
+      if track is None:
+        continue
+      if senc is None:
+        raise Exception(f'No sample encryption info found for track {track_id}')
+
+      # sample positions
+      samples = []
+      position = None
+      for data_offset, sample_sizes in runs:
+        if data_offset is not None:
+          position = base_offset + data_offset
+        elif position is None:
+          position = mdat.payload if mdat is not None else base_offset
+        for size in sample_sizes:
+          samples.append((position, size))
+          position += size
+
+      sample_infos = self._read_senc(buf, senc, senc_is_piff, track)
+      if len(sample_infos) != len(samples):
+        raise Exception(f'Sample count mismatch for track {track_id}: {len(sample_infos)} encryption entries, {len(samples)} samples')
+
+      for (position, size), (iv, subsamples) in zip(samples, sample_infos):
+        self._decrypt_sample(track, buf, position, size, iv, subsamples)
+
+      # the samples are in the clear now, hide the encryption info
+      for box in iter_boxes(buf, traf.payload, traf.end):
+        if box.type in ('senc', 'saiz', 'saio') or box.start == senc.start:
+          rename_box(buf, box, 'free')
+
+  @staticmethod
+  def _read_trun(buf: bytearray, trun: Box, default_sample_size: int) -> Tuple[int, List[int]]:
+    ''':return: tuple of (data_offset or None, sample sizes)'''
+    _, flags = read_full_box_header(buf, trun)
+    sample_count = struct.unpack_from('>I', buf, trun.payload + 4)[0]
+    offset = trun.payload + 8
+    data_offset = None
+    if flags & 0x001:
+      data_offset = struct.unpack_from('>i', buf, offset)[0]
+      offset += 4
+    if flags & 0x004:
+      offset += 4
+    sample_sizes = []
+    for _ in range(sample_count):
+      if flags & 0x100:
+        offset += 4
+      if flags & 0x200:
+        sample_sizes.append(struct.unpack_from('>I', buf, offset)[0])
+        offset += 4
+      else:
+        sample_sizes.append(default_sample_size)
+      if flags & 0x400:
+        offset += 4
+      if flags & 0x800:
+        offset += 4
+    return data_offset, sample_sizes
+
+  @staticmethod
+  def _read_senc(buf: bytearray, senc: Box, is_piff: bool, track: TrackEncryption) -> List[Tuple[bytes, List[Tuple[int, int]]]]:
+    ''':return: list of (iv, [(clear bytes, protected bytes), ...]) per sample'''
+    _, flags = read_full_box_header(buf, senc)
+    offset = senc.payload + 4
+    iv_size = track.per_sample_iv_size
+    if is_piff and flags & 0x01:
+      # AlgorithmID (3), IV_size (1), KID (16) override the track defaults
+      iv_size = buf[offset + 3]
+      offset += 20
+    sample_count = struct.unpack_from('>I', buf, offset)[0]
+    offset += 4
+
+    samples = []
+    for _ in range(sample_count):
+      iv = bytes(buf[offset:offset + iv_size]) if iv_size > 0 else track.constant_iv
+      offset += iv_size
+      subsamples = []
+      if flags & 0x02:
+        subsample_count = struct.unpack_from('>H', buf, offset)[0]
+        offset += 2
+        for _ in range(subsample_count):
+          subsamples.append(struct.unpack_from('>HI', buf, offset))
+          offset += 6
+      samples.append((iv, subsamples))
+    return samples
+
+  @staticmethod
+  def _decrypt_sample(track: TrackEncryption, buf: bytearray, position: int, size: int, iv: bytes, subsamples: List[Tuple[int, int]]):
+    iv = iv.ljust(16, b'\x00')
+
+    if track.scheme == 'cenc':
+      # AES-CTR, the key stream continues over all protected ranges of a sample
+      cipher = AES.new(track.key, AES.MODE_CTR, nonce=b'', initial_value=iv)
+      if len(subsamples) == 0:
+        buf[position:position + size] = cipher.decrypt(bytes(buf[position:position + size]))
+        return
+      for clear_bytes, protected_bytes in subsamples:
+        position += clear_bytes
+        buf[position:position + protected_bytes] = cipher.decrypt(bytes(buf[position:position + protected_bytes]))
+        position += protected_bytes
+      return
+
+    # cbcs: AES-CBC with the track's pattern, partial blocks at the end stay in the clear
+    if len(subsamples) == 0:
+      CencDecryptor._decrypt_cbcs_pattern(track, buf, position, size, iv)
+      return
+    for clear_bytes, protected_bytes in subsamples:
+      position += clear_bytes
+      CencDecryptor._decrypt_cbcs_pattern(track, buf, position, protected_bytes, iv)
+      position += protected_bytes
+
+  @staticmethod
+  def _decrypt_cbcs_pattern(track: TrackEncryption, buf: bytearray, position: int, length: int, iv: bytes):
+    crypt, skip = track.crypt_byte_block, track.skip_byte_block
+    if crypt == 0:
+      # no pattern: every full block is encrypted
+      crypt, skip = 1, 0
+
+    # collect the encrypted blocks, they form one CBC chain that starts at the IV
+    encrypted_ranges = []
+    offset = 0
+    full_blocks = length // 16
+    block = 0
+    while block < full_blocks:
+      count = min(crypt, full_blocks - block)
+      encrypted_ranges.append((position + block * 16, count * 16))
+      block += crypt + skip
+    if len(encrypted_ranges) == 0:
+      return
+
+    encrypted = b''.join(bytes(buf[start:start + size]) for start, size in encrypted_ranges)
+    decrypted = AES.new(track.key, AES.MODE_CBC, iv).decrypt(encrypted)
+    for start, size in encrypted_ranges:
+      buf[start:start + size] = decrypted[offset:offset + size]
+      offset += size
@@ -0,0 +1,89 @@
+import os
+import threading
+import concurrent.futures
+
+from typing import Callable, List
+from loguru import logger
+
+from .segment_download import DownloadAborted, get_default_thread_count
+from ..utils.host_concurrency import get_initial_host_concurrency
+
+class DownloadScheduler:
+  '''
+  Shares one bounded pool of segment download threads between all periods,
+  adaptation sets and representations of an MPD download.
+
+  Periods and adaptation sets are downloaded at the same time, but the number
+  of segments in flight never exceeds `max_concurrency`. When one
+  representation runs out of segments, the other ones immediately take over
+  the free threads, so the network stays saturated until the very end.
+
+  The segments waiting to be written share one reorder window as well, so
+  the memory of the whole download is bounded, and the first failure
+  stops all other downloads.
+  '''
+
+  def __init__(
+    self,
+    max_concurrency: int = None,
+    reorder_window: int = None,
+  ):
+    '''
+    :param reorder_window: segments in flight or waiting to be written, for all representations together.
+      Defaults to 4 segments per initial host concurrency, at least max_concurrency.
+    '''
+    self.max_concurrency = max_concurrency or get_default_thread_count()
+    self.reorder_window = max(reorder_window or get_initial_host_concurrency() * 4, self.max_concurrency)
+    self.reorder_slots = threading.BoundedSemaphore(self.reorder_window)
+    # Set when a task fails, the segment downloads of the other tasks stop
+    self.abort = threading.Event()
+    self.segment_executor = concurrent.futures.ThreadPoolExecutor(
+      max_workers=self.max_concurrency,
+      thread_name_prefix='segment',
+    )
+    # The async segment engine doesn't use the threads, every segment it has in flight takes a slot instead
+    self.segment_slots = threading.BoundedSemaphore(self.max_concurrency)
+    # decrypting/defragmenting is disk heavy, don't run too many at the same time
+    self.postprocess_slots = threading.BoundedSemaphore(max(1, (os.cpu_count() or 2) // 2))
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.shutdown()
+
+  def shutdown(self):
+    self.segment_executor.shutdown(wait=True, cancel_futures=True)
+
+  def run_all(self, fn: Callable, items: List) -> List:
+    '''
+    Run fn for every item at the same time and wait for all of them.
+    These tasks mostly wait on segment downloads, the actual network
+    concurrency is bounded by the shared segment pool.
+
+    :return: the results, in the same order as items
+    '''
+    if len(items) == 0:
+      return []
+    if len(items) == 1:
+      try:
+        return [fn(items[0])]
+      except BaseException:
+        self.abort.set()
+        raise
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(items), thread_name_prefix='track') as executor:
+      futures = [executor.submit(fn, item) for item in items]
+      done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_EXCEPTION)
+      if any(future.exception() is not None for future in done):
+        # what the other tasks still download is of no use anymore
+        self.abort.set()
+      concurrent.futures.wait(futures)
+
+    errors = [future.exception() for future in futures if future.exception() is not None]
+    if len(errors) > 0:
+      # raise the first error, in order, that isn't just a task that was stopped because of it
+      error = next((e for e in errors if not isinstance(e, DownloadAborted)), errors[0])
+      logger.error(f'Parallel download task failed: {error}')
+      raise error
+    return [future.result() for future in futures]
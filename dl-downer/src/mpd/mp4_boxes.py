@@ -0,0 +1,106 @@
+import struct
+
+from typing import Iterator, List, NamedTuple
+
+class Box(NamedTuple):
+  '''Location of an ISO BMFF box inside a buffer'''
+  type: str
+  start: int
+  # where the box content starts (after the header and the uuid user type)
+  payload: int
+  end: int
+
+def iter_boxes(data, start: int = 0, end: int = None) -> Iterator[Box]:
+  '''
+  Iterate over the boxes between start and end, without descending into them.
+  '''
+  if end is None:
+    end = len(data)
+  offset = start
+  while offset + 8 <= end:
+    size, box_type = struct.unpack_from('>I4s', data, offset)
+    header_size = 8
+    if size == 1:
+      size = struct.unpack_from('>Q', data, offset + 8)[0]
+      header_size = 16
+    elif size == 0:
+      # box extends to the end of the buffer
+      size = end - offset
+    if size < header_size or offset + size > end:
+      raise ValueError(f'Invalid box size {size} at offset {offset}')
+    box_type = box_type.decode('latin-1')
+    payload = offset + header_size
+    if box_type == 'uuid':
+      payload += 16
+    yield Box(box_type, offset, payload, offset + size)
+    offset += size
+
+def find_box(data, path: List[str], start: int = 0, end: int = None) -> Box:
+  '''
+  Find the first box matching the path of box types, e.g. ['moov', 'trak', 'tkhd'].
+
+  :return: the box, or None if not found
+  '''
+  for box in iter_boxes(data, start, end):
+    if box.type == path[0]:
+      if len(path) == 1:
+        return box
+      found = find_box(data, path[1:], box.payload, box.end)
+      if found is not None:
+        return found
+  return None
+
+def rename_box(data: bytearray, box: Box, new_type: str):
+  '''Change the type of a box in place, keeping its size (and all offsets) intact'''
+  data[box.start + 4:box.start + 8] = new_type.encode('latin-1')
+
+def read_full_box_header(data, box: Box) -> tuple:
+  ''':return: tuple of (version, flags) of a full box'''
+  version_and_flags = struct.unpack_from('>I', data, box.payload)[0]
+  return version_and_flags >> 24, version_and_flags & 0xFFFFFF
+
+class SidxReference(NamedTuple):
+  '''One entry of a segment index'''
+  # 1 when the reference points to another sidx, 0 for media
+  reference_type: int
+  # byte offset of the referenced data in the file
+  offset: int
+  size: int
+  duration: int
+
+class Sidx(NamedTuple):
+  timescale: int
+  earliest_presentation_time: int
+  references: List[SidxReference]
+
+def parse_sidx(data, box: Box, box_offset: int) -> Sidx:
+  '''
+  Parse a segment index (sidx) box.
+
+  :param box_offset: position of the start of data in the file, so the
+    references can be returned as absolute file offsets
+  '''
+  version, _ = read_full_box_header(data, box)
+  offset = box.payload + 4
+  _reference_id, timescale = struct.unpack_from('>II', data, offset)
+  offset += 8
+  if version == 0:
+    earliest_presentation_time, first_offset = struct.unpack_from('>II', data, offset)
+    offset += 8
+  else:
+    earliest_presentation_time, first_offset = struct.unpack_from('>QQ', data, offset)
+    offset += 16
+  # 16 bits reserved
+  reference_count = struct.unpack_from('>H', data, offset + 2)[0]
+  offset += 4
+
+  references = []
+  # the first referenced byte follows the sidx box, after first_offset bytes
+  position = box_offset + box.end + first_offset
+  for _ in range(reference_count):
+    type_and_size, duration, _sap = struct.unpack_from('>III', data, offset)
+    offset += 12
+    size = type_and_size & 0x7FFFFFFF
+    references.append(SidxReference(type_and_size >> 31, position, size, duration))
+    position += size
+  return Sidx(timescale, earliest_presentation_time, references)
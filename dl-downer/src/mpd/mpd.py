@@ -1,16 +1,30 @@
 import os
 import shutil
+import time
 import urllib
 import uuid
-import requests
 import re
 from loguru import logger
 from typing import List
 import xml.etree.ElementTree as ET
 
 from .period import Period
+from .mpd_utils import parse_xml_without_namespaces
 from .mpd_download_options import MPDDownloadOptions
-from ..utils.files import concat_files, merge_files, convert_to_mkv
+from .download_scheduler import DownloadScheduler
+from ..utils.files import concat_files, merge_files, convert_to_mkv, insert_subtitles, MuxPlan
+from ..utils.manifest_cache import get_manifest
+
+def remove_stale_resume_dirs(parent_dir: str):
+  '''Removes resume folders of downloads that were never retried'''
+  if not os.path.isdir(parent_dir):
+    return
+  max_age = float(os.getenv('DL_RESUME_MAX_AGE_DAYS', '7')) * 24 * 60 * 60
+  for name in os.listdir(parent_dir):
+    path = os.path.join(parent_dir, name)
+    if os.path.isdir(path) and time.time() - os.path.getmtime(path) > max_age:
+      logger.debug(f'Removing stale resume folder {path}')
+      shutil.rmtree(path, ignore_errors=True)
 
 class MPD:
   def __init__(
@@ -44,18 +58,25 @@ class MPD:
   
   @staticmethod
   def from_string(mpd_string: str) -> 'MPD':
-    mpd_string = re.sub(r'xmlns=".*?"', '', mpd_string)
-    root_xml = ET.fromstring(mpd_string)
-    return MPD.from_element(root_xml)
+    return MPD.from_element(parse_xml_without_namespaces(mpd_string))
   
   @staticmethod
-  def from_url(mpd_url: str) -> 'MPD':
+  def get_fetch_url(mpd_url: str) -> str:
+    ''':return: the url the manifest is fetched from, without query params and fragment'''
     # cut off fragment
     mpd_url = mpd_url.split('#')[0]
     # cut off query params
-    mpd_url = mpd_url.split('?')[0]
-    mpd_response = requests.get(mpd_url)
-    mpd_string = mpd_response.text
+    return mpd_url.split('?')[0]
+
+  @staticmethod
+  def from_url(mpd_url: str) -> 'MPD':
+    mpd_url = MPD.get_fetch_url(mpd_url)
+    # fetched at most once per job, see manifest_cache
+    return MPD.from_text(get_manifest(mpd_url), mpd_url)
+
+  @staticmethod
+  def from_text(mpd_string: str, mpd_url: str) -> 'MPD':
+    '''Parse a manifest that was fetched from mpd_url'''
     mpd = MPD.from_string(mpd_string)
     # set base_url
     if mpd.base_url is None:
@@ -67,7 +88,7 @@ class MPD:
     else:
       logger.debug(f'Base URL is absolute, using as is')
     return mpd
-  
+
   def download(
     self,
     tmp_dir: str,
@@ -80,9 +101,10 @@ class MPD:
     my_uuid = str(uuid.uuid4())[:8]
     my_tmp_dir = os.path.join(tmp_dir, f'mpd-{my_uuid}')
     os.makedirs(my_tmp_dir, exist_ok=True)
-    # download all periods
-    period_download_results = []
-
+    if download_options is not None and download_options.resume_dir is not None:
+      remove_stale_resume_dirs(os.path.dirname(os.path.normpath(download_options.resume_dir)))
+    # download all periods at the same time, sharing one segment download budget
+    periods_to_download = []
     for period in self.periods:
 
       ignore_period = False
@@ -96,8 +118,16 @@ class MPD:
         logger.debug(f'Ignoring period {period.id}')
         continue
 
-      period_download_result = period.download(my_tmp_dir, self.base_url, download_options)
-      period_download_results.append(period_download_result)
+      periods_to_download.append(period)
+
+    max_concurrency = download_options.max_concurrent_segments if download_options is not None else None
+    reorder_window = download_options.segment_reorder_window if download_options is not None else None
+    with DownloadScheduler(max_concurrency, reorder_window) as scheduler:
+      logger.debug(f'Downloading {len(periods_to_download)} periods with up to {scheduler.max_concurrency} segments in flight')
+      period_download_results = scheduler.run_all(
+        lambda period: period.download(my_tmp_dir, self.base_url, download_options, scheduler),
+        periods_to_download,
+      )
 
     if len(period_download_results) == 0:
       raise Exception(f'No periods were downloaded {self.periods}')
@@ -106,11 +136,17 @@ class MPD:
     if not all(isinstance(period_download_result, list) for period_download_result in period_download_results):
       raise Exception(f'Expected period_download_results to be a list of lists, got {period_download_results}')
 
+    if download_options.single_pass_mux:
+      out_file = self.mux_single_pass(period_download_results, tmp_dir, my_tmp_dir, my_uuid, download_options)
+      self.cleanup(my_tmp_dir, download_options)
+      logger.debug(f'Downloaded MPD to {out_file}')
+      return out_file
+
     if download_options.merge_method == 'period':
       # simply concat all periods
 
       # some manifests will have multiple periods, in that case we need to concat them
-      created_file = period_download_results[0]
+      created_file = period_download_results[0][0]
       # concat all files
       if len(period_download_results) > 1:
         created_file = os.path.join(my_tmp_dir, f'combined-periods-{my_uuid}.mp4')
@@ -153,8 +189,66 @@ class MPD:
     if download_options.convert_to_mkv:
       out_file = convert_to_mkv(out_file, delete_original=True)
 
-    # Delete own tmp folder
-    shutil.rmtree(my_tmp_dir)
+    insert_subtitles(out_file, [(subtitle_file, None) for subtitle_file in download_options.get_subtitles()])
 
+    self.cleanup(my_tmp_dir, download_options)
     logger.debug(f'Downloaded MPD to {out_file}')
     return out_file
+
+  def mux_single_pass(
+    self,
+    period_download_results: List[List[str]],
+    tmp_dir: str,
+    my_tmp_dir: str,
+    my_uuid: str,
+    download_options: MPDDownloadOptions,
+  ) -> str:
+    '''
+    Concatenates the periods, merges the tracks, converts and adds the subtitles
+    with one single ffmpeg command.
+
+    :return: the path to the final file in tmp_dir
+    '''
+    plan = MuxPlan(my_tmp_dir)
+    if download_options.merge_method == 'period':
+      name = 'combined-periods'
+      if all(len(result) == len(period_download_results[0]) for result in period_download_results):
+        # every period has the same tracks, concat them track by track
+        for track in range(len(period_download_results[0])):
+          plan.add_track([result[track] for result in period_download_results])
+      else:
+        # periods can't be lined up, merge them one by one first
+        logger.debug(f'Periods have a different number of tracks, merging them per period first')
+        merged_files = []
+        for i, result in enumerate(period_download_results):
+          merged_file = os.path.join(my_tmp_dir, f'merged-period-{i}-{my_uuid}.mp4')
+          merge_files(result, merged_file)
+          merged_files.append(merged_file)
+        plan.add_track(merged_files)
+    elif download_options.merge_method == 'format':
+      name = 'merged-formats'
+      # All elements of the list should be of length 2
+      if not all(len(period_download_result) == 2 for period_download_result in period_download_results):
+        raise Exception(f'Expected period_download_results to be a list of lists with length 2, got {period_download_results}')
+      # audio files first, then video files
+      plan.add_track([result[0] for result in period_download_results])
+      plan.add_track([result[1] for result in period_download_results])
+    else:
+      raise Exception(f'Unknown merge method {download_options.merge_method}')
+
+    for subtitle_file in download_options.get_subtitles():
+      plan.add_subtitle(subtitle_file)
+
+    extension = 'mkv' if download_options.convert_to_mkv else 'mp4'
+    return plan.run(os.path.join(tmp_dir, f'{name}-{my_uuid}.{extension}'))
+
+  @staticmethod
+  def cleanup(
+    my_tmp_dir: str,
+    download_options: MPDDownloadOptions = None,
+  ):
+    # Delete own tmp folder
+    shutil.rmtree(my_tmp_dir)
+    # Nothing left to resume
+    if download_options is not None and download_options.resume_dir is not None:
+      shutil.rmtree(download_options.resume_dir, ignore_errors=True)
@@ -1,4 +1,4 @@
-from typing import List
+from typing import Callable, List, Union
 
 class MPDDownloadOptions():
   '''
@@ -42,6 +42,53 @@ class MPDDownloadOptions():
       Whether to defragment the downloaded MP4 files.
       Default is True.
       This is useful for MP4 files that are fragmented, which can cause playback issues in some players.
+    stream_segments (bool):
+      Whether to write downloaded segments straight into the output file.
+      Default is True.
+      When False, every segment is written to its own temporary file first and
+      the files are combined once all segments are downloaded.
+    segment_reorder_window (int):
+      The maximum number of segments that can be downloading or waiting to be written
+      at the same time when stream_segments is True. Shared by all periods and representations,
+      so it caps the memory used by the whole download.
+      Default is None, which uses 4 segments per download thread, at least max_concurrent_segments.
+    max_concurrent_segments (int):
+      The maximum number of segments downloaded at the same time, shared by all periods
+      and adaptation sets, which are downloaded in parallel.
+      Default is None, which uses DL_HTTP_POOL_MAXSIZE (32).
+      How many of them are actually downloading adapts to the throughput and throttling
+      of each host, starting at 4 or 75% of the CPU threads, whichever is higher.
+    resume_dir (str):
+      Folder to keep the download progress in, so an interrupted download can be resumed.
+      Use a folder that is unique per download request, e.g. './tmp/resume/<id>'.
+      Default is None, which disables resuming.
+    decrypt_method ('inline' | 'mp4decrypt'):
+      How encrypted content is decrypted.
+      Default is 'inline'.
+      'inline' decrypts every segment in process right after it is downloaded ('cenc' and 'cbcs' schemes).
+      'mp4decrypt' decrypts the complete file with mp4decrypt after all segments are downloaded.
+    single_pass_mux (bool):
+      Whether to write the final file with one single ffmpeg command.
+      Default is True.
+      All tracks, periods and subtitles are concatenated, merged and converted at once,
+      so the output is written to disk only once. Defragmenting is not needed in this case.
+      When False, every step (defragment, concat, merge, convert, subtitles) remuxes the file.
+    subtitles (List[str] | Callable[[], List[str]]):
+      Subtitle files to include in the final file.
+      Default is [].
+      Can also be a function returning the files, it is called once all tracks are downloaded.
+      This allows fetching the subtitles while the tracks are downloading.
+    segment_engine ('threads' | 'async'):
+      How segments are downloaded.
+      Default is None, which uses the DL_SEGMENT_ENGINE env variable or 'threads'.
+      'threads' downloads segments with a pool of threads, see max_concurrent_segments.
+      'async' downloads segments with asyncio and httpx over HTTP/2 (when the server supports it).
+        The segments in flight are bounded by max_concurrent_segments and the concurrency of the host,
+        like the threads, and by max_bytes_in_flight. Segments are always streamed into the output file.
+    max_bytes_in_flight (int):
+      The maximum number of bytes of segments that can be downloading or waiting to be written
+      per representation, when segment_engine is 'async'.
+      Default is None, which uses the DL_MAX_BYTES_IN_FLIGHT env variable or 64 MiB.
 
   '''
   def __init__(
@@ -54,6 +101,15 @@ class MPDDownloadOptions():
     merge_method: str = 'period',
     convert_to_mkv: bool = True,
     defragment: bool = True,
+    stream_segments: bool = True,
+    segment_reorder_window: int = None,
+    max_concurrent_segments: int = None,
+    resume_dir: str = None,
+    decrypt_method: str = 'inline',
+    single_pass_mux: bool = True,
+    subtitles: Union[List[str], Callable[[], List[str]]] = None,
+    segment_engine: str = None,
+    max_bytes_in_flight: int = None,
   ):
     self.video_resolution = video_resolution
     self.audio_language = audio_language
@@ -63,6 +119,20 @@ class MPDDownloadOptions():
     self.merge_method = merge_method
     self.convert_to_mkv = convert_to_mkv
     self.defragment = defragment
+    self.stream_segments = stream_segments
+    self.segment_reorder_window = segment_reorder_window
+    self.max_concurrent_segments = max_concurrent_segments
+    self.resume_dir = resume_dir
+    self.decrypt_method = decrypt_method
+    self.single_pass_mux = single_pass_mux
+    self.subtitles = subtitles if subtitles is not None else []
+    self.segment_engine = segment_engine
+    self.max_bytes_in_flight = max_bytes_in_flight
+  def get_subtitles(self) -> List[str]:
+    ''' The subtitle files, waits for them when they are still being fetched '''
+    if callable(self.subtitles):
+      return self.subtitles()
+    return self.subtitles
   def __str__(self):
     return f'<MPDDownloadOptions(video_resolution={self.video_resolution}, audio_language={self.audio_language}, subtitle_language={self.subtitle_language})>'
   def __repr__(self):
@@ -1,4 +1,5 @@
 import re
+import xml.etree.ElementTree as ET
 
 def transform_mpd_time_to_milisecondsseconds(time: str):
   '''
@@ -18,4 +19,18 @@ def transform_mpd_time_to_milisecondsseconds(time: str):
     total_milliseconds += int(minutes.group(1)) * 60 * 1000
   if seconds is not None:
     total_milliseconds += int(float(seconds.group(1)) * 1000)
-  return total_milliseconds
\ No newline at end of file
+  return total_milliseconds
+def parse_xml_without_namespaces(xml_string: str) -> ET.Element:
+  '''
+  Parse XML and drop the namespaces of all elements, so they can be found
+  by their plain names (e.g. 'Period' or 'pssh').
+
+  :return: the root element
+  '''
+  root = ET.fromstring(xml_string)
+  # Renaming while iterating the finished tree is faster than renaming during a pull parse
+  for el in root.iter():
+    tag = el.tag
+    if tag[0] == '{':
+      el.tag = tag[tag.index('}') + 1:]
+  return root
@@ -9,6 +9,7 @@ from loguru import logger
 from .adaptation_set import AdaptationSet
 from .mpd_utils import transform_mpd_time_to_milisecondsseconds
 from .mpd_download_options import MPDDownloadOptions
+from .download_scheduler import DownloadScheduler
 from ..utils.files import merge_files
 
 class Period:
@@ -55,11 +56,13 @@ class Period:
     tmp_dir: str,
     base_url: str,
     download_options: MPDDownloadOptions = None,
+    scheduler: DownloadScheduler = None,
   ) -> List[str]:
     '''
       :return:
         If download_options.merge_method is 'period',
           the path to the downloaded period mp4 file in returned as a single element list.
+          With download_options.single_pass_mux, the unmerged audio and video files are returned instead.
         If download_options.merge_method is 'format',
           the paths to the downloaded audio and video files are returned as a list ([ audio, video ]).
           paths can be None in this case.
@@ -70,37 +73,48 @@ class Period:
     my_tmp_dir = os.path.join(tmp_dir, f'period-{my_uuid}')
     os.makedirs(my_tmp_dir, exist_ok=True)
 
-    # Keep track of all files that need to be merged
-    audio_files_to_merge = []
-    video_files_to_merge = []
-
-    # Find audio adaptation sets
+    # Find audio and video adaptation sets that have a representation to download,
+    # as (adaptation set, selected representation)
     audio_adaptation_sets = list(filter(lambda adaptation_set: adaptation_set.mime_type.startswith('audio/'), self.adaptation_sets))
-    # Download all audio streams
-    for audio_adaptation_set in audio_adaptation_sets:
-      audio_file = audio_adaptation_set.download(my_tmp_dir, base_url, download_options)
-      if audio_file is not None:
-        audio_files_to_merge.append(audio_file)
-        # if merge_method == 'format' we break the for loop, we only want one audio file
-        if download_options.merge_method == 'format':
-          break
-    
-    # Find video adaptation sets
+    audio_adaptation_sets = [(a, a.select_representation(download_options)) for a in audio_adaptation_sets]
+    audio_adaptation_sets = [(a, r) for a, r in audio_adaptation_sets if r is not None]
     video_adaptation_sets = list(filter(lambda adaptation_set: adaptation_set.mime_type.startswith('video/'), self.adaptation_sets))
-    # Download all video streams
-    for video_adaptation_set in video_adaptation_sets:
-      video_file = video_adaptation_set.download(my_tmp_dir, base_url, download_options)
-      if video_file is not None:
-        video_files_to_merge.append(video_file)
-        # if merge_method == 'format' we break the for loop, we only want one video file
-        if download_options.merge_method == 'format':
-          break
-    
+    video_adaptation_sets = [(v, v.select_representation(download_options)) for v in video_adaptation_sets]
+    video_adaptation_sets = [(v, r) for v, r in video_adaptation_sets if r is not None]
+    # if merge_method == 'format' we only want one audio and one video file
+    if download_options.merge_method == 'format':
+      audio_adaptation_sets = audio_adaptation_sets[:1]
+      video_adaptation_sets = video_adaptation_sets[:1]
+
+    # Download all audio and video streams at the same time
+    adaptation_sets_to_download = audio_adaptation_sets + video_adaptation_sets
+    if scheduler is None:
+      downloaded_files = [a.download(my_tmp_dir, base_url, download_options, representation=r) for a, r in adaptation_sets_to_download]
+    else:
+      downloaded_files = scheduler.run_all(
+        lambda to_download: to_download[0].download(my_tmp_dir, base_url, download_options, scheduler, representation=to_download[1]),
+        adaptation_sets_to_download,
+      )
+
+    # Keep track of all files that need to be merged
+    audio_files_to_merge = [f for f in downloaded_files[:len(audio_adaptation_sets)] if f is not None]
+    video_files_to_merge = [f for f in downloaded_files[len(audio_adaptation_sets):] if f is not None]
+
     def cleanUp():
       # Delete own tmp folder
       shutil.rmtree(my_tmp_dir)
 
-    if download_options.merge_method == 'period':
+    if download_options.merge_method == 'period' and download_options.single_pass_mux:
+      # leave merging to the single pass mux, move all files to the tmp_dir
+      out_files = []
+      for f in audio_files_to_merge + video_files_to_merge:
+        out_file = os.path.join(tmp_dir, os.path.basename(f))
+        shutil.move(f, out_file)
+        out_files.append(out_file)
+      cleanUp()
+      logger.debug(f'Downloaded period {self.id} to {out_files}')
+      return out_files
+    elif download_options.merge_method == 'period':
       # merge audio and video files
       merged_file = os.path.join(my_tmp_dir, f'merged-{my_uuid}.mp4')
       all_files_to_merge = audio_files_to_merge + video_files_to_merge
@@ -1,11 +1,15 @@
 import os
 import shutil
 import uuid
+import urllib
 import xml.etree.ElementTree as ET
 
 from loguru import logger
 
+from .segment_base import SegmentBase, SegmentList
 from .segment_template import SegmentTemplate
+from .mpd_download_options import MPDDownloadOptions
+from .download_scheduler import DownloadScheduler
 
 class Representation:
   def __init__(
@@ -19,6 +23,9 @@ class Representation:
     scan_type: str = None,
     segment_template: SegmentTemplate = None,
     audio_sampling_rate: int = None,
+    base_url: str = None,
+    segment_base: SegmentBase = None,
+    segment_list: SegmentList = None,
   ):
     self.id = id
     self.bandwidth = bandwidth
@@ -29,6 +36,9 @@ class Representation:
     self.scan_type = scan_type
     self.segment_template = segment_template
     self.audio_sampling_rate = audio_sampling_rate
+    self.base_url = base_url
+    self.segment_base = segment_base
+    self.segment_list = segment_list
   def __str__(self):
     return f'<Representation(id={self.id}, width={self.width}, height={self.height}, frame_rate={self.frame_rate}, bandwidth={self.bandwidth}, codecs={self.codecs})>'
   def __repr__(self):
@@ -40,7 +50,16 @@ class Representation:
     seg_temp_el = el.find('SegmentTemplate')
     if seg_temp_el is not None:
       segment_template = SegmentTemplate.from_element(seg_temp_el)
-    
+    segment_base = None
+    seg_base_el = el.find('SegmentBase')
+    if seg_base_el is not None:
+      segment_base = SegmentBase.from_element(seg_base_el)
+    segment_list = None
+    seg_list_el = el.find('SegmentList')
+    if seg_list_el is not None:
+      segment_list = SegmentList.from_element(seg_list_el)
+    base_url_el = el.find('BaseURL')
+
     return Representation(
       id=el.get('id'),
       width=int(el.get('width')) if el.get('width') is not None else None,
@@ -51,6 +70,9 @@ class Representation:
       scan_type=el.get('scanType'),
       segment_template=segment_template,
       audio_sampling_rate=int(el.get('audioSamplingRate')) if el.get('audioSamplingRate') is not None else None,
+      base_url=base_url_el.text.strip() if base_url_el is not None and base_url_el.text else None,
+      segment_base=segment_base,
+      segment_list=segment_list,
     )
   
   def download(
@@ -58,20 +80,27 @@ class Representation:
     tmp_dir: str,
     base_url: str,
     segment_template: SegmentTemplate = None,
+    download_options: MPDDownloadOptions = None,
+    scheduler: DownloadScheduler = None,
   ) -> str:
     ''':return: the path to the downloaded representation mp4 file'''
     logger.debug(f'Downloading {self}')
 
-    use_template = self.segment_template
+    # the BaseURL of a representation is relative to the one of the MPD
+    if self.base_url is not None:
+      base_url = urllib.parse.urljoin(base_url, self.base_url)
+
+    # SegmentList and SegmentBase describe (parts of) a single file, downloaded with parallel byte ranges
+    use_template = self.segment_template or self.segment_list or self.segment_base
     if use_template is None:
       use_template = segment_template
-      if use_template is None:
-        raise Exception('No segment template found')
+    if use_template is None:
+      raise Exception('No segment template, list or base found')
 
     # Create a temporary folder
     my_tmp_dir = os.path.join(tmp_dir, f'representation-{str(uuid.uuid4())[:8]}')
     os.makedirs(my_tmp_dir, exist_ok=True)
-    created_file = use_template.download(my_tmp_dir, base_url, self.id)
+    created_file = use_template.download(my_tmp_dir, base_url, self.id, download_options, scheduler)
 
     # Move the file to the parent folder
     out_file = os.path.join(tmp_dir, os.path.basename(created_file))
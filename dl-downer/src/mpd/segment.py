@@ -1,3 +1,6 @@
+from array import array
+from bisect import bisect_right
+from typing import Iterator
 
 class Segment:
   def __init__(self, start: int, duration: int):
@@ -7,3 +10,55 @@ class Segment:
     return f'<Segment(start={self.start}, duration={self.duration})>'
   def __repr__(self):
     return self.__str__()
+
+class SegmentTimeline:
+  '''
+  The segments of a SegmentTimeline, kept run-length encoded like in the
+  manifest: one (start, duration, repeat) entry per <S> element, in a flat
+  array('q') instead of a Segment object per segment. Segments are only
+  created when they are accessed.
+  '''
+  def __init__(self):
+    # start, duration, repeat of every entry, one after another
+    self.entries = array('q')
+    # number of segments up to and including every entry
+    self.counts = array('q')
+    self.count = 0
+    # where the next segment starts when it continues the last entry
+    self.end = None
+
+  def __len__(self) -> int:
+    return self.count
+
+  def __str__(self):
+    return f'<SegmentTimeline(entries={len(self.counts)}, segments={len(self)})>'
+  def __repr__(self):
+    return self.__str__()
+
+  def append(self, start: int, duration: int, repeat: int = 0):
+    '''Add repeat + 1 segments of duration, starting at start'''
+    self.count += repeat + 1
+    if start == self.end and duration == self.entries[-2]:
+      # same duration and no gap: extend the last entry, like an r attribute would
+      self.entries[-1] += repeat + 1
+      self.counts[-1] = self.count
+    else:
+      self.entries.extend((start, duration, repeat))
+      self.counts.append(self.count)
+    self.end = start + duration * (repeat + 1)
+
+  def __getitem__(self, index: int) -> Segment:
+    if index < 0:
+      index += len(self)
+    if index < 0 or index >= len(self):
+      raise IndexError('segment index out of range')
+    entry = bisect_right(self.counts, index)
+    first_index = self.counts[entry - 1] if entry > 0 else 0
+    start, duration, _ = self.entries[entry * 3:entry * 3 + 3]
+    return Segment(start + (index - first_index) * duration, duration)
+
+  def __iter__(self) -> Iterator[Segment]:
+    for i in range(0, len(self.entries), 3):
+      start, duration, repeat = self.entries[i:i + 3]
+      for n in range(repeat + 1):
+        yield Segment(start + n * duration, duration)
@@ -0,0 +1,244 @@
+import os
+import shutil
+import time
+import uuid
+import urllib
+import xml.etree.ElementTree as ET
+
+from typing import List
+from loguru import logger
+
+from .mp4_boxes import find_box, parse_sidx
+from .segment_download import download_segments
+from .download_scheduler import DownloadScheduler
+from .mpd_download_options import MPDDownloadOptions
+from ..utils.http_session import get_session, get_connection_stats
+
+def parse_byte_range(byte_range: str) -> tuple:
+  ''':return: tuple of (first, last) byte of a range like '0-1023' '''
+  first, last = byte_range.split('-')
+  return int(first), int(last)
+
+def fetch_byte_range(url: str, first: int, last: int) -> bytes:
+  response = get_session().get(url, headers={ 'Range': f'bytes={first}-{last}' }, timeout=20)
+  response.raise_for_status()
+  if response.status_code != 206:
+    raise Exception(f'Server does not support byte ranges: {url}')
+  return response.content
+
+class SegmentBase:
+  '''
+  A representation that is one single file, with a segment index (sidx) at
+  indexRange describing where every segment (subsegment) is in the file.
+  The segments are downloaded in parallel with ranged requests.
+  '''
+  def __init__(
+    self,
+    index_range: str,
+    initialization_range: str = None,
+    timescale: int = None,
+  ):
+    self.index_range = index_range
+    self.initialization_range = initialization_range
+    self.timescale = timescale
+
+  def __str__(self):
+    return f'<SegmentBase(index_range={self.index_range}, initialization_range={self.initialization_range}, timescale={self.timescale})>'
+  def __repr__(self):
+    return self.__str__()
+
+  @staticmethod
+  def from_element(element: ET.Element) -> 'SegmentBase':
+    logger.debug(f'Parsing SegmentBase with indexRange: {element.get("indexRange")}')
+    initialization_el = element.find('Initialization')
+    timescale = element.get('timescale')
+    return SegmentBase(
+      index_range=element.get('indexRange'),
+      initialization_range=initialization_el.get('range') if initialization_el is not None else None,
+      timescale=int(timescale) if timescale is not None else None,
+    )
+
+  def get_segment_ranges(self, media_url: str) -> tuple:
+    '''
+    Download the init segment and the segment index.
+
+    :return: tuple of (init data, list of segment byte ranges)
+    '''
+    if self.index_range is None:
+      raise Exception('SegmentBase without indexRange is not supported')
+    index_first, index_last = parse_byte_range(self.index_range)
+    init_first, init_last = parse_byte_range(self.initialization_range) if self.initialization_range is not None else (0, index_first - 1)
+
+    # usually the index directly follows the init segment, get both at once
+    if init_last + 1 == index_first:
+      data = fetch_byte_range(media_url, init_first, index_last)
+      init_data = data[:index_first - init_first]
+      index_data = data[index_first - init_first:]
+    else:
+      init_data = fetch_byte_range(media_url, init_first, init_last)
+      index_data = fetch_byte_range(media_url, index_first, index_last)
+
+    segment_ranges = []
+    self._add_segment_ranges(media_url, index_data, index_first, segment_ranges)
+    return init_data, segment_ranges
+
+  def _add_segment_ranges(
+    self,
+    media_url: str,
+    data: bytes,
+    data_offset: int,
+    segment_ranges: List[str],
+  ):
+    '''
+    Add the byte ranges of the media the sidx in data refers to.
+    A sidx can point to other sidx boxes instead of media (hierarchical index),
+    those are expanded in place so the segments stay in presentation order.
+    '''
+    sidx_box = find_box(data, ['sidx'])
+    if sidx_box is None:
+      raise Exception(f'No sidx box found at {data_offset} in {media_url}')
+    for reference in parse_sidx(data, sidx_box, data_offset).references:
+      if reference.reference_type == 1:
+        nested = fetch_byte_range(media_url, reference.offset, reference.offset + reference.size - 1)
+        self._add_segment_ranges(media_url, nested, reference.offset, segment_ranges)
+      else:
+        segment_ranges.append(f'{reference.offset}-{reference.offset + reference.size - 1}')
+
+  def download(
+    self,
+    tmp_dir: str,
+    base_url: str,
+    representation_id: str,
+    download_options: MPDDownloadOptions = None,
+    scheduler: DownloadScheduler = None,
+  ) -> str:
+    '''
+    :param base_url: the url of the media file
+    :return: the path to the downloaded mp4 file
+    '''
+    logger.debug(f'Downloading segment base {base_url}')
+
+    timer_start = time.time()
+
+    # Create a temporary folder
+    my_uuid = str(uuid.uuid4())[:8]
+    my_tmp_dir = os.path.join(tmp_dir, f'segment-base-{my_uuid}')
+    os.makedirs(my_tmp_dir, exist_ok=True)
+
+    try:
+      init_data, segment_ranges = self.get_segment_ranges(base_url)
+
+      logger.info(f'Downloading {len(segment_ranges)} byte ranges of {base_url} ...')
+      out_file = os.path.join(tmp_dir, f'output-{my_uuid}.mp4')
+      download_segments(
+        init_data,
+        [base_url] * len(segment_ranges),
+        out_file,
+        my_tmp_dir,
+        representation_id,
+        # Stable across runs: query strings often hold short-lived tokens
+        resume_id=f'{len(segment_ranges)}:{urllib.parse.urlparse(base_url).path}',
+        download_options=download_options,
+        scheduler=scheduler,
+        segment_ranges=segment_ranges,
+      )
+
+      logger.info(f'Downloaded segment base {base_url} to {out_file} in {time.time() - timer_start:.2f}s')
+      stats = get_connection_stats()
+      logger.debug(f'HTTP connections: {stats["connections"]} opened, {stats["reused"]}/{stats["requests"]} requests reused a connection')
+      return out_file
+    finally:
+      # Delete own tmp folder even when a download/merge error occurs.
+      shutil.rmtree(my_tmp_dir, ignore_errors=True)
+
+class SegmentList:
+  '''
+  A representation with an explicit list of segments, each a url and/or a
+  byte range within the representation's file.
+  '''
+  def __init__(
+    self,
+    initialization: str = None,
+    initialization_range: str = None,
+    segments: List[tuple] = None,
+    timescale: int = None,
+    duration: int = None,
+  ):
+    self.initialization = initialization
+    self.initialization_range = initialization_range
+    # list of (media url or None, media range or None)
+    self.segments = segments or []
+    self.timescale = timescale
+    self.duration = duration
+
+  def __str__(self):
+    return f'<SegmentList(initialization={self.initialization}, timescale={self.timescale}, duration={self.duration}, segments={len(self.segments)})>'
+  def __repr__(self):
+    return self.__str__()
+
+  @staticmethod
+  def from_element(element: ET.Element) -> 'SegmentList':
+    logger.debug('Parsing SegmentList')
+    initialization_el = element.find('Initialization')
+    timescale = element.get('timescale')
+    duration = element.get('duration')
+    return SegmentList(
+      initialization=initialization_el.get('sourceURL') if initialization_el is not None else None,
+      initialization_range=initialization_el.get('range') if initialization_el is not None else None,
+      segments=[(s.get('media'), s.get('mediaRange')) for s in element.findall('SegmentURL')],
+      timescale=int(timescale) if timescale is not None else None,
+      duration=int(duration) if duration is not None else None,
+    )
+
+  def download(
+    self,
+    tmp_dir: str,
+    base_url: str,
+    representation_id: str,
+    download_options: MPDDownloadOptions = None,
+    scheduler: DownloadScheduler = None,
+  ) -> str:
+    ''':return: the path to the downloaded mp4 file'''
+    logger.debug(f'Downloading segment list of {base_url}')
+
+    timer_start = time.time()
+
+    # Create a temporary folder
+    my_uuid = str(uuid.uuid4())[:8]
+    my_tmp_dir = os.path.join(tmp_dir, f'segment-list-{my_uuid}')
+    os.makedirs(my_tmp_dir, exist_ok=True)
+
+    try:
+      init_data = b''
+      init_url = urllib.parse.urljoin(base_url, self.initialization) if self.initialization is not None else base_url
+      if self.initialization_range is not None:
+        init_data = fetch_byte_range(init_url, *parse_byte_range(self.initialization_range))
+      elif self.initialization is not None:
+        logger.debug(f'Downloading init segment {init_url}')
+        init_response = get_session().get(init_url, timeout=20)
+        init_response.raise_for_status()
+        init_data = init_response.content
+
+      segment_urls = [urllib.parse.urljoin(base_url, media) if media is not None else base_url for media, _ in self.segments]
+      segment_ranges = [media_range for _, media_range in self.segments]
+
+      logger.info(f'Downloading {len(segment_urls)} segments ...')
+      out_file = os.path.join(tmp_dir, f'output-{my_uuid}.mp4')
+      download_segments(
+        init_data,
+        segment_urls,
+        out_file,
+        my_tmp_dir,
+        representation_id,
+        # Stable across runs: query strings often hold short-lived tokens
+        resume_id=f'{len(segment_urls)}:{urllib.parse.urlparse(init_url).path}',
+        download_options=download_options,
+        scheduler=scheduler,
+        segment_ranges=segment_ranges if any(r is not None for r in segment_ranges) else None,
+      )
+
+      logger.info(f'Downloaded segment list to {out_file} in {time.time() - timer_start:.2f}s')
+      return out_file
+    finally:
+      # Delete own tmp folder even when a download/merge error occurs.
+      shutil.rmtree(my_tmp_dir, ignore_errors=True)
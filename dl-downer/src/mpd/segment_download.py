@@ -0,0 +1,450 @@
+import os
+import hashlib
+import shutil
+import threading
+import time
+import concurrent.futures
+
+from typing import Callable, List
+from loguru import logger
+
+from .cenc import CencDecryptor
+from .mpd_download_options import MPDDownloadOptions
+from .segment_state import SegmentState
+from ..utils.host_concurrency import get_host_concurrency, get_initial_host_concurrency, get_max_host_concurrency, parse_retry_after
+from ..utils.http_session import get_session
+from ..utils.job_metrics import metrics_stage, record_stage, get_file_size
+
+# Size of the chunks read from the network and written to disk
+CHUNK_SIZE = 64 * 1024
+
+def get_default_thread_count() -> int:
+  '''
+  Enough threads for the highest concurrency a host can reach, how many of
+  them are actually downloading is decided per host by HostConcurrency
+  '''
+  return get_max_host_concurrency()
+
+class DownloadAborted(Exception):
+  ''' The download was stopped because another download of the same job failed '''
+  pass
+
+def get_default_segment_engine() -> str:
+  ''' 'threads' unless DL_SEGMENT_ENGINE says 'async' '''
+  return os.getenv('DL_SEGMENT_ENGINE', 'threads')
+
+def fetch_segment(index: int, segment_url: str, byte_range: str = None) -> bytes:
+  '''
+  Download a single segment, retrying a couple of times on failure.
+
+  :param byte_range: only download these bytes of segment_url, e.g. '0-1023'
+  :return: the segment content
+  '''
+  retries = 3
+  last_error = None
+  host = get_host_concurrency(segment_url)
+  for attempt in range(1, retries + 1):
+    host.acquire()
+    try:
+      headers = { 'Range': f'bytes={byte_range}' } if byte_range is not None else None
+      with get_session().get(segment_url, timeout=20, stream=True, headers=headers) as response:
+        if response.status_code == 429 or response.status_code >= 500:
+          host.on_throttled(response.status_code, parse_retry_after(response.headers.get('Retry-After')))
+        response.raise_for_status()
+        if byte_range is not None and response.status_code != 206:
+          # don't download the complete file for every segment
+          raise Exception(f'Server ignored the byte range {byte_range}')
+        data = bytearray()
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+          data.extend(chunk)
+      if not data:
+        raise Exception('Empty segment response')
+      host.on_success(len(data), response.elapsed.total_seconds())
+      return bytes(data)
+    except Exception as error:
+      last_error = error
+      if attempt < retries:
+        logger.warning(f'Segment {index} failed on attempt {attempt}/{retries}: {error}. Retrying...')
+    finally:
+      host.release()
+    if attempt < retries:
+      # other segments of the host can use the slot while this one waits
+      time.sleep(0.5 * attempt)
+  raise Exception(f'Failed to download segment {index} after {retries} attempts: {segment_url}') from last_error
+
+class SegmentDownloader:
+  '''
+  Downloads a list of segments in parallel and combines them, in order,
+  into one output file that starts with the init segment.
+
+  In streaming mode finished segments are written straight into the output
+  file at their place in the sequence. Segments that finish early wait in a
+  bounded reorder buffer, so memory use is capped at roughly
+  `reorder_window` segments, no matter how many segments there are.
+  Otherwise every segment is written to its own file in `work_dir` first
+  and the files are combined afterwards.
+
+  A `window` and `abort` event shared with other downloads (see
+  DownloadScheduler) bound the memory of all of them together and stop
+  all of them as soon as one fails.
+  '''
+
+  def __init__(
+    self,
+    segment_urls: List[str],
+    out_file: str,
+    work_dir: str,
+    stream: bool = True,
+    max_threads: int = None,
+    reorder_window: int = None,
+    executor: concurrent.futures.Executor = None,
+    resume_path: str = None,
+    transform: Callable[[bytes], bytes] = None,
+    segment_ranges: List[str] = None,
+    window: threading.Semaphore = None,
+    abort: threading.Event = None,
+  ):
+    '''
+    :param window: shared slots for segments in flight or waiting to be written, used instead of reorder_window
+    :param abort: shared event that stops the download, set when a segment fails
+    '''
+    self.segment_urls = segment_urls
+    # Byte range per segment, for segments that are parts of one file (SegmentBase/SegmentList)
+    self.segment_ranges = segment_ranges
+    self.out_file = out_file
+    self.work_dir = work_dir
+    self.stream = stream
+    # A shared executor (see DownloadScheduler) bounds concurrency across representations
+    self.executor = executor
+    self.max_threads = max_threads or get_default_thread_count()
+    # Allow a few segments per downloading thread to be buffered so threads never
+    # idle while waiting for a slow segment that blocks the write position
+    self.reorder_window = max(reorder_window or get_initial_host_concurrency() * 4, self.max_threads)
+    self.window = window
+    self.abort = abort or threading.Event()
+    # When set, progress is kept at this (stable) path so an interrupted download can resume
+    self.resume_path = resume_path
+    # Applied to every segment in the download threads, e.g. CencDecryptor.decrypt_segment
+    self.transform = transform
+
+  def _fetch(self, index: int, segment_url: str) -> bytes:
+    data = fetch_segment(index, segment_url, self.segment_ranges[index] if self.segment_ranges is not None else None)
+    if self.transform is not None:
+      data = self.transform(data)
+    return data
+
+  def download(self, init_data: bytes) -> str:
+    ''':return: the path to the combined output file'''
+    if self.executor is not None:
+      self._download(self.executor, init_data)
+    else:
+      logger.debug(f'Using {self.max_threads} threads to download segments')
+      with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_threads) as executor:
+        self._download(executor, init_data)
+    return self.out_file
+
+  def _download(self, executor: concurrent.futures.Executor, init_data: bytes):
+    if self.stream:
+      self._download_streaming(executor, init_data)
+    else:
+      self._download_to_files(executor, init_data)
+
+  def _download_streaming(self, executor: concurrent.futures.Executor, init_data: bytes):
+    lock = threading.Lock()
+    # Limits the number of segments that are in flight or waiting to be written
+    window = self.window or threading.BoundedSemaphore(self.reorder_window)
+    abort = self.abort
+    reorder_buffer = {}
+    failed_segments = []
+    futures = []
+
+    f, state, target_file, next_index = self._open_output(init_data)
+
+    with f:
+
+      def download_and_write(index: int, segment_url: str):
+        nonlocal next_index
+        if abort.is_set():
+          window.release()
+          return
+        try:
+          data = self._fetch(index, segment_url)
+        except Exception as error:
+          with lock:
+            failed_segments.append((index, error))
+          abort.set()
+          # Free the slot so the submitting loop notices the abort
+          window.release()
+          return
+        with lock:
+          reorder_buffer[index] = data
+          # Write every segment that is next in line
+          while next_index in reorder_buffer:
+            data = reorder_buffer.pop(next_index)
+            f.write(data)
+            if state is not None:
+              # the state may never claim more than what is in the file
+              f.flush()
+              state.record(next_index, data)
+            next_index += 1
+            window.release()
+
+      for i in range(next_index, len(self.segment_urls)):
+        # Wait for room in the reorder buffer
+        acquired = window.acquire(timeout=0.5)
+        while not acquired and not abort.is_set():
+          acquired = window.acquire(timeout=0.5)
+        if abort.is_set():
+          if acquired:
+            window.release()
+          break
+        futures.append(executor.submit(download_and_write, i, self.segment_urls[i]))
+
+      # Everything must be written before the file is closed
+      concurrent.futures.wait(futures)
+      # give back the slots of segments that will never be written
+      for _ in reorder_buffer:
+        window.release()
+
+    self._raise_if_aborted(failed_segments, next_index)
+    self._complete_output(failed_segments, state, target_file, next_index)
+
+  def _raise_if_aborted(self, failed_segments: list, next_index: int):
+    '''Stopped by the failure of another download, that one reports the error'''
+    if not failed_segments and self.abort.is_set() and next_index != len(self.segment_urls):
+      raise DownloadAborted(f'Stopped downloading {self.out_file} at segment {next_index}/{len(self.segment_urls)}')
+
+  def _open_output(self, init_data: bytes) -> tuple:
+    '''
+    Open the file the segments are streamed into, continuing a partial
+    download when there is one.
+
+    :return: tuple of (file, SegmentState or None, path of the file, index of the first segment to download)
+    '''
+    state = None
+    target_file = self.out_file
+    next_index, offset = 0, 0
+    if self.resume_path is not None:
+      state = SegmentState(f'{self.resume_path}.state', len(self.segment_urls), init_data)
+      target_file = f'{self.resume_path}.part'
+      next_index, offset = self._verify_partial_file(target_file, state)
+
+    if next_index > 0:
+      logger.info(f'Resuming download at segment {next_index}/{len(self.segment_urls)}')
+      f = open(target_file, 'r+b')
+      f.truncate(offset)
+      f.seek(offset)
+    else:
+      f = open(target_file, 'wb')
+      f.write(init_data)
+      if state is not None:
+        state.reset()
+    return f, state, target_file, next_index
+
+  def _complete_output(self, failed_segments: list, state: SegmentState, target_file: str, next_index: int):
+    '''Check that every segment was streamed into the (closed) file and put it in place'''
+    if failed_segments:
+      self._raise_failed(failed_segments)
+    if next_index != len(self.segment_urls):
+      raise Exception(f'Only {next_index}/{len(self.segment_urls)} segments were written to {target_file}')
+
+    if state is not None:
+      shutil.move(target_file, self.out_file)
+      state.remove()
+
+  def _verify_partial_file(self, part_file: str, state: SegmentState) -> tuple:
+    '''
+    Check which segments at the start of a partially downloaded file are intact.
+
+    :return: tuple of (index of the first segment to download, byte offset to continue writing at)
+    '''
+    done = state.load()
+    if len(done) == 0 or not os.path.isfile(part_file):
+      return 0, 0
+
+    verified = {}
+    with open(part_file, 'rb') as f:
+      init_data = f.read(state.header['init_size'])
+      if hashlib.sha256(init_data).hexdigest() != state.header['init_sha256']:
+        return 0, 0
+      offset = len(init_data)
+      index = 0
+      while index in done:
+        data = f.read(done[index]['size'])
+        if len(data) != done[index]['size'] or hashlib.sha256(data).hexdigest() != done[index]['sha256']:
+          break
+        verified[index] = done[index]
+        offset += len(data)
+        index += 1
+
+    # forget about everything that could not be verified
+    state.reset(verified)
+    return index, offset
+
+  def _download_to_files(self, executor: concurrent.futures.Executor, init_data: bytes):
+    work_dir = self.work_dir
+    state = None
+    done = {}
+    if self.resume_path is not None:
+      work_dir = f'{self.resume_path}-segments'
+      os.makedirs(work_dir, exist_ok=True)
+      state = SegmentState(f'{self.resume_path}.state', len(self.segment_urls), init_data)
+      done = state.load()
+      state.reset(done)
+
+    segment_files = [
+      os.path.join(work_dir, f'segment_{str(i).zfill(6)}.m4s')
+      for i in range(len(self.segment_urls))
+    ]
+
+    def download_to_file(index: int, segment_url: str):
+      if self.abort.is_set():
+        return
+      try:
+        data = self._fetch(index, segment_url)
+      except Exception:
+        self.abort.set()
+        raise
+      # write to a temporary name first so a segment file is always complete
+      with open(f'{segment_files[index]}.tmp', 'wb') as f:
+        f.write(data)
+      os.replace(f'{segment_files[index]}.tmp', segment_files[index])
+      if state is not None:
+        state.record(index, data)
+
+    future_to_segment = {}
+    failed_segments = []
+    for i, segment_url in enumerate(self.segment_urls):
+      # skip segments that are already downloaded
+      if i in done and os.path.isfile(segment_files[i]) and os.path.getsize(segment_files[i]) == done[i]['size']:
+        continue
+      future = executor.submit(download_to_file, i, segment_url)
+      future_to_segment[future] = i
+    if len(future_to_segment) < len(self.segment_urls):
+      logger.info(f'Resuming download, {len(self.segment_urls) - len(future_to_segment)}/{len(self.segment_urls)} segments already downloaded')
+
+    for future in concurrent.futures.as_completed(future_to_segment):
+      try:
+        future.result()
+      except Exception as error:
+        failed_segments.append((future_to_segment[future], error))
+
+    if failed_segments:
+      self._raise_failed(failed_segments)
+    if self.abort.is_set():
+      raise DownloadAborted(f'Stopped downloading {self.out_file}')
+
+    # Combine init and segments into one file
+    with open(self.out_file, 'wb') as f:
+      f.write(init_data)
+      missing_files = []
+      for segment_file in segment_files:
+        if not os.path.exists(segment_file):
+          missing_files.append(segment_file)
+          continue
+        with open(segment_file, 'rb') as segment_f:
+          shutil.copyfileobj(segment_f, f, CHUNK_SIZE * 16)
+
+      if missing_files:
+        raise FileNotFoundError(
+          f'{len(missing_files)} segment file(s) are missing before merge. First missing: {missing_files[0]}'
+        )
+
+    if state is not None:
+      shutil.rmtree(work_dir, ignore_errors=True)
+      state.remove()
+
+  @staticmethod
+  def _raise_failed(failed_segments: list):
+    failed_segments = sorted(failed_segments, key=lambda item: item[0])
+    first_segment, first_error = failed_segments[0]
+    raise Exception(
+      f'{len(failed_segments)} segment(s) failed to download. First failed segment index: '
+      f'{first_segment}. Error: {first_error}'
+    ) from first_error
+
+def download_segments(
+  init_data: bytes,
+  segment_urls: List[str],
+  out_file: str,
+  work_dir: str,
+  representation_id: str,
+  resume_id: str,
+  download_options: MPDDownloadOptions = None,
+  scheduler = None,
+  segment_ranges: List[str] = None,
+) -> str:
+  '''
+  Download the segments of a representation into out_file, after init_data,
+  with the engine and decryption method chosen in the download options.
+
+  :param resume_id: identifies the representation across runs, used to resume an interrupted download
+  :param scheduler: DownloadScheduler shared by all representations, if any
+  :param segment_ranges: byte range of every segment in its url, if segments are parts of a file
+  :return: out_file
+  '''
+  # Decrypt while downloading instead of running mp4decrypt on the complete file afterwards
+  decryptor = None
+  if download_options is not None and download_options.decrypt_method == 'inline' and len(download_options.decrypt_keys) > 0:
+    decryptor = CencDecryptor(download_options.decrypt_keys)
+    init_data = decryptor.decrypt_init(init_data)
+
+  resume_path = None
+  if download_options is not None and download_options.resume_dir is not None:
+    resume_path = os.path.join(
+      download_options.resume_dir,
+      f'{representation_id}-{hashlib.sha1(resume_id.encode()).hexdigest()[:10]}',
+    )
+
+  transform = None
+  # time spent decrypting, per segment (a list: appending is thread safe)
+  decrypt_times = []
+  if decryptor is not None:
+    def transform(data: bytes) -> bytes:
+      start = time.perf_counter()
+      data = decryptor.decrypt_segment(data)
+      decrypt_times.append(time.perf_counter() - start)
+      return data
+  segment_engine = download_options.segment_engine if download_options is not None else None
+  segment_engine = segment_engine or get_default_segment_engine()
+  if segment_engine == 'async':
+    # Imported here, httpx is only needed for this engine
+    from .async_segment_download import AsyncSegmentDownloader
+    downloader = AsyncSegmentDownloader(
+      segment_urls,
+      out_file,
+      work_dir,
+      max_bytes_in_flight=download_options.max_bytes_in_flight if download_options is not None else None,
+      max_concurrency=scheduler.max_concurrency if scheduler is not None else None,
+      segment_slots=scheduler.segment_slots if scheduler is not None else None,
+      executor=scheduler.segment_executor if scheduler is not None else None,
+      resume_path=resume_path,
+      transform=transform,
+      segment_ranges=segment_ranges,
+      window=scheduler.reorder_slots if scheduler is not None else None,
+      abort=scheduler.abort if scheduler is not None else None,
+    )
+  elif segment_engine == 'threads':
+    downloader = SegmentDownloader(
+      segment_urls,
+      out_file,
+      work_dir,
+      stream=download_options.stream_segments if download_options is not None else True,
+      reorder_window=download_options.segment_reorder_window if download_options is not None else None,
+      max_threads=scheduler.max_concurrency if scheduler is not None else None,
+      executor=scheduler.segment_executor if scheduler is not None else None,
+      resume_path=resume_path,
+      transform=transform,
+      segment_ranges=segment_ranges,
+      window=scheduler.reorder_slots if scheduler is not None else None,
+      abort=scheduler.abort if scheduler is not None else None,
+    )
+  else:
+    raise Exception(f'Unknown segment engine: {segment_engine}')
+  with metrics_stage('segments', representation=representation_id, segments=len(segment_urls)) as stage:
+    out_file = downloader.download(init_data)
+    stage.bytes = get_file_size(out_file)
+  if decryptor is not None:
+    # overlaps with the download, summed over the download threads
+    record_stage('decrypt', sum(decrypt_times), stage.bytes, tool='inline', representation=representation_id)
+  return out_file
@@ -0,0 +1,72 @@
+import os
+import json
+import hashlib
+import threading
+
+from loguru import logger
+
+class SegmentState:
+  '''
+  On-disk record of the segments of one representation that are already
+  downloaded, used to resume an interrupted download.
+
+  The file is a JSON lines file. The first line describes the download
+  (segment count and init segment checksum), every next line records one
+  finished segment with its size and sha256 checksum. Lines are only
+  appended, so an interrupted write can at most lose the last line.
+  '''
+
+  def __init__(self, path: str, segment_count: int, init_data: bytes):
+    self.path = path
+    self.header = {
+      'segments': segment_count,
+      'init_size': len(init_data),
+      'init_sha256': hashlib.sha256(init_data).hexdigest(),
+    }
+    self.lock = threading.Lock()
+
+  def load(self) -> dict:
+    '''
+    :return: dict of segment index -> { 'size': int, 'sha256': str }
+      Empty when there is no usable state for this download.
+    '''
+    if not os.path.isfile(self.path):
+      return {}
+    done = {}
+    with open(self.path, 'r') as f:
+      lines = f.read().splitlines()
+    try:
+      if len(lines) == 0 or json.loads(lines[0]) != self.header:
+        logger.debug(f'Resume state {self.path} belongs to a different download, ignoring it')
+        return {}
+    except ValueError:
+      return {}
+    for line in lines[1:]:
+      try:
+        record = json.loads(line)
+        done[int(record['index'])] = { 'size': int(record['size']), 'sha256': record['sha256'] }
+      except (ValueError, KeyError, TypeError):
+        # partially written line
+        continue
+    return done
+
+  def reset(self, done: dict = None):
+    ''' Rewrite the state file, keeping only the given records '''
+    done = done or {}
+    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+    with self.lock:
+      with open(self.path, 'w') as f:
+        f.write(json.dumps(self.header) + '\n')
+        for index in sorted(done):
+          f.write(json.dumps({ 'index': index, **done[index] }) + '\n')
+
+  def record(self, index: int, data: bytes):
+    ''' Mark a segment as done, call only after its data is written '''
+    line = json.dumps({ 'index': index, 'size': len(data), 'sha256': hashlib.sha256(data).hexdigest() })
+    with self.lock:
+      with open(self.path, 'a') as f:
+        f.write(line + '\n')
+
+  def remove(self):
+    if os.path.isfile(self.path):
+      os.remove(self.path)
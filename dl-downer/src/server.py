@@ -1,4 +1,8 @@
+import os
+import signal
+import sys
 import traceback
+import multiprocessing
 from loguru import logger
 import time
 
@@ -7,6 +11,95 @@ from .models.dl_request import DLRequest
 from .utils.download_dl_request import download_dl_request
 from .utils.validate_server_structure import validate_server_structure
 
+def get_worker_count() -> int:
+  ''' Number of worker slots to run, read from DL_WORKERS (default 1) '''
+  try:
+    workers = int(os.getenv('DL_WORKERS', '1'))
+  except ValueError:
+    logger.warning(f'Invalid DL_WORKERS value {os.getenv("DL_WORKERS")}, using 1')
+    return 1
+  return max(1, workers)
+
+# Seconds the workers get to stop after SIGTERM, docker stop kills everything after 10 seconds
+WORKER_STOP_TIMEOUT = 8
+
+def exit_on_sigterm():
+  '''
+  Turn SIGTERM into SystemExit, so the `finally` blocks run when the process
+  is stopped. By default the process is killed on the spot.
+  '''
+  def handle_sigterm(signum, frame):
+    raise SystemExit(128 + signum)
+  signal.signal(signal.SIGTERM, handle_sigterm)
+
+def run_worker(slot: int = 0):
+  ''' Claim and handle download requests until the process is stopped '''
+
+  exit_on_sigterm()
+  from .utils.setup_db_pool import setup_db_pool
+  from .utils.pending_request_listener import PendingRequestListener
+  # Every worker process needs its own connections, they can't be shared across processes
+  db = setup_db_pool()
+  logger.info(f'[worker {slot}] Database connection successful')
+
+  listener = PendingRequestListener()
+  listener.listen()
+
+  try:
+    while True:
+      # Atomically claim the oldest pending download request
+      dl_request = DLRequest.claim_next_pending(db)
+
+      if dl_request:
+        logger.info(f'[worker {slot}] Claimed {dl_request}')
+
+        try:
+          download_dl_request(dl_request, db)
+          dl_request.update_status(DLRequestStatus.COMPLETED, db)
+
+        except Exception as e:
+          dl_request.update_status(DLRequestStatus.FAILED, db)
+          # log error and its stacktrace
+          logger.error(f'[worker {slot}] An error occurred: {e}')
+          logger.error(traceback.format_exc())
+
+
+      else:
+        logger.info(f'[worker {slot}] No pending requests found! Waiting for new requests ...')
+        # Blocks until a new request is inserted (or the fallback poll interval passes)
+        listener.wait()
+  finally:
+    # worker processes exit without running atexit handlers,
+    # stop the playwright driver if a job started it
+    browser = sys.modules.get(f'{__package__}.utils.browser')
+    if browser is not None:
+      browser.stop_playwright()
+
+def requeue_interrupted_requests():
+  ''' Put requests that were in progress when the server stopped back to pending '''
+  from .utils.setup_db_pool import setup_db_pool
+  db = setup_db_pool()
+  try:
+    count = DLRequest.requeue_in_progress(db)
+  finally:
+    # workers open their own connections, don't share these with them
+    db.closeall()
+  if count > 0:
+    logger.info(f'Put {count} interrupted request(s) back to pending')
+
+def stop_workers(workers: dict, timeout: float = WORKER_STOP_TIMEOUT):
+  ''' Send SIGTERM to every worker and wait for them, kill the ones that don't stop in time '''
+  for worker in workers.values():
+    if worker.is_alive():
+      worker.terminate()
+  deadline = time.time() + timeout
+  for slot, worker in workers.items():
+    worker.join(max(0, deadline - time.time()))
+    if worker.is_alive():
+      logger.warning(f'[worker {slot}] Did not stop in {timeout}s, killing it')
+      worker.kill()
+      worker.join()
+
 def start_server():
   ''' Start the server '''
 
@@ -16,46 +109,34 @@ def start_server():
   logger.info('Loaded environment variables')
 
   validate_server_structure()
+  requeue_interrupted_requests()
 
-  from .utils.setup_db_pool import setup_db_pool
-  db = setup_db_pool()
-  logger.info('Database connection successful')
-
-  while True:
-    # Check database for pending download request
-    db_conn = db.getconn()
-    cursor = db_conn.cursor()
-    cursor.execute(
-      '''
-      SELECT * FROM dl.dl_request
-      WHERE status = %s
-      ORDER BY created ASC
-      LIMIT 1
-      ''',
-      (DLRequestStatus.PENDING.value,),
-    )
-    pending_request = cursor.fetchone()
-    cursor.close()
-    db.putconn(db_conn)
-
-    if pending_request:
-
-      # Create a DLRequest object from the database row
-      dl_request = DLRequest.from_db_row(pending_request)
-      dl_request.update_status(DLRequestStatus.IN_PROGRESS, db)
-
-      try:
-        download_dl_request(dl_request)
-        dl_request.update_status(DLRequestStatus.COMPLETED, db)
-
-      except Exception as e:
-        dl_request.update_status(DLRequestStatus.FAILED, db)
-        # log error and its stacktrace
-        logger.error(f'An error occurred: {e}')
-        logger.error(traceback.format_exc())
-
-
-    else:
-      logger.info('No pending requests found! Sleeping for 1 minute ...')
-      # Sleep for 1 minute
-      time.sleep(60)
+  worker_count = get_worker_count()
+  if worker_count == 1:
+    run_worker()
+    return
+
+  # Use processes instead of threads: the playwright sync API and the CDM
+  # are bound to the thread that created them, processes keep every job isolated.
+  logger.info(f'Starting {worker_count} workers ...')
+  # As PID 1 in a container SIGTERM is ignored unless handled
+  exit_on_sigterm()
+  workers = {}
+  try:
+    for slot in range(worker_count):
+      workers[slot] = multiprocessing.Process(target=run_worker, args=(slot,), name=f'dl-worker-{slot}')
+      workers[slot].start()
+
+    # Restart workers that died unexpectedly
+    while True:
+      for slot, worker in workers.items():
+        if not worker.is_alive():
+          logger.warning(f'[worker {slot}] Exited with code {worker.exitcode}, restarting ...')
+          workers[slot] = multiprocessing.Process(target=run_worker, args=(slot,), name=f'dl-worker-{slot}')
+          workers[slot].start()
+      time.sleep(5)
+  except (SystemExit, KeyboardInterrupt):
+    logger.info('Stopping workers ...')
+    raise
+  finally:
+    stop_workers(workers)
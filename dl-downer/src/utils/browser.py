@@ -1,14 +1,19 @@
+import atexit
+import base64
+import json
 import os
+import time
+from typing import Callable, List
 from loguru import logger
 
 from playwright.sync_api import sync_playwright
-from playwright.sync_api import Browser, Page
+from playwright.sync_api import Browser, BrowserContext, Page, Playwright
 
 from ..models.dl_request_platform import DLRequestPlatform
 from .browser_diagnostics import attach_diagnostics_listeners
+from .job_metrics import record_stage
 
 user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/136.0.0.0 Safari/537.36'
-playwright = sync_playwright().start()
 
 def get_storage_state_location(platform: DLRequestPlatform) -> str:
   '''
@@ -31,22 +36,110 @@ def get_storage_state_location(platform: DLRequestPlatform) -> str:
 
   return p
 
-def create_playwright_page(platform: DLRequestPlatform) -> tuple[Browser, Page]:
+def get_token_expiry_margin() -> int:
+  ''' Tokens that expire within this many seconds are considered expired '''
+  return int(os.getenv('DL_TOKEN_EXPIRY_MARGIN', '300'))
+
+def get_jwt_expiry(token: str) -> float:
   '''
-  Create a playwright browser and page with the correct state for the given platform.
-  
-  :return: a tuple containing the browser and page objects
+  :return: the `exp` claim of a JWT, or None if the token isn't a JWT with an expiry
+  '''
+  parts = token.split('.')
+  if len(parts) != 3:
+    return None
+  try:
+    payload = parts[1] + '=' * (-len(parts[1]) % 4)
+    exp = json.loads(base64.urlsafe_b64decode(payload)).get('exp')
+    return float(exp) if exp is not None else None
+  except Exception:
+    return None
+
+def get_cookie_expiry(cookie: dict) -> float:
+  '''
+  :return: the earliest of the cookie's own expiry and the expiry of the JWT in it,
+    None if neither is known
   '''
+  expiries = []
+  if cookie.get('expires', -1) > 0:
+    expiries.append(cookie['expires'])
+  jwt_expiry = get_jwt_expiry(cookie.get('value', ''))
+  if jwt_expiry is not None:
+    expiries.append(jwt_expiry)
+  return min(expiries) if len(expiries) > 0 else None
 
-  # playerwright.stop() cleans up the full /tmp folder
-  # if it doesnt exist, create it
-  if not os.path.exists('/tmp'):
-    logger.debug('/tmp does not exist, creating it')
-    os.makedirs('/tmp', exist_ok=True)
+def get_storage_state_cookies(platform: DLRequestPlatform) -> List[dict]:
+  '''
+  :return: the cookies of the stored storage state of the platform that haven't expired
+  '''
+  try:
+    with open(get_storage_state_location(platform), 'r') as f:
+      state = json.load(f)
+  except (OSError, ValueError) as e:
+    logger.debug(f'Could not read storage state of {platform.value}: {e}')
+    return []
+  now = time.time()
+  return [c for c in state.get('cookies', []) if c.get('expires', -1) <= 0 or c['expires'] > now]
+
+def get_valid_token_cookie(
+  platform: DLRequestPlatform,
+  matcher: Callable[[dict], bool],
+) -> dict:
+  '''
+  Find a token cookie in the stored storage state that is still valid for a while,
+  so the browser login can be skipped.
 
-  browser = playwright.chromium.launch(
+  :param matcher: selects the token cookie(s)
+  :return: the cookie, or None if there is no token that is valid beyond the margin
+  '''
+  deadline = time.time() + get_token_expiry_margin()
+  for cookie in get_storage_state_cookies(platform):
+    if not matcher(cookie):
+      continue
+    expiry = get_cookie_expiry(cookie)
+    # don't trust tokens without a known expiry
+    if expiry is not None and expiry > deadline:
+      logger.debug(f'Valid {cookie["name"]} token found for {platform.value}, expires in {int(expiry - time.time())}s')
+      return cookie
+  return None
+
+# The playwright driver is a separate process, only started once a browser is needed
+_playwright: Playwright = None
+# The browser and one context per platform are kept alive between jobs,
+# launching Chromium and loading a platform's home page is slow
+_browser: Browser = None
+# platform -> [context, number of jobs that used it]
+_contexts: dict = {}
+
+def get_context_max_jobs() -> int:
+  ''' Number of jobs after which a context is replaced, to cap its memory use '''
+  return max(1, int(os.getenv('DL_BROWSER_CONTEXT_MAX_JOBS', '20')))
+
+def get_playwright() -> Playwright:
+  ''' Get the playwright driver, starting it the first time '''
+  global _playwright
+  if _playwright is None:
+    logger.debug('Starting playwright')
+    _playwright = sync_playwright().start()
+    atexit.register(stop_playwright)
+  return _playwright
+
+def stop_playwright():
+  ''' Close the browser and stop the playwright driver, it is started again when needed '''
+  global _playwright
+  close_browser()
+  if _playwright is not None:
+    try:
+      _playwright.stop()
+    except Exception as e:
+      logger.debug(f'Failed to stop playwright: {e}')
+    _playwright = None
+    atexit.unregister(stop_playwright)
+
+def _launch_browser() -> Browser:
+  return get_playwright().chromium.launch(
     headless=os.getenv('HEADLESS', 'true') == 'true',
-    slow_mo=200,
+    # slows down every action, only useful to watch the browser while debugging
+    slow_mo=int(os.getenv('DL_BROWSER_SLOW_MO', '0')),
     args=[
       # Suppresses the "Chrome is being controlled by automated software" banner
       # and removes the most commonly checked automation flag from the browser internals.
@@ -61,7 +154,9 @@ def create_playwright_page(platform: DLRequestPlatform) -> tuple[Browser, Page]:
       '--disable-extensions',
     ],
   )
-  custom_context = browser.new_context(
+
+def _create_context(browser: Browser, platform: DLRequestPlatform) -> BrowserContext:
+  context = browser.new_context(
     user_agent=user_agent,
     locale='nl-BE',
     storage_state=get_storage_state_location(platform),
@@ -82,15 +177,13 @@ def create_playwright_page(platform: DLRequestPlatform) -> tuple[Browser, Page]:
       'Accept-Language': 'nl-BE,nl;q=0.9,en-US;q=0.8,en;q=0.7',
     },
   )
-  page = custom_context.new_page()
-  attach_diagnostics_listeners(page)
 
   # Self-contained stealth script injected before every page load.
   # We intentionally avoid playwright_stealth (last release 1.0.6, unmaintained):
   # its navigator.vendor getter references an `opts` closure variable that leaks
   # out of scope, causing a ReferenceError when video players (e.g. shaka-player)
   # read navigator.vendor — crashing the page before any network requests fire.
-  page.add_init_script("""
+  context.add_init_script("""
     // Hide the automation flag — the most commonly checked bot signal.
     Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
 
@@ -172,4 +265,103 @@ def create_playwright_page(platform: DLRequestPlatform) -> tuple[Browser, Page]:
     }
   """)
 
-  return (browser, page)
+  return context
+
+def get_browser() -> Browser:
+  '''
+  Get the shared browser, (re)launching it when it isn't running (anymore).
+  '''
+  global _browser
+  if _browser is not None and not _browser.is_connected():
+    logger.warning('Browser is no longer running, restarting it')
+    _browser = None
+    _contexts.clear()
+  if _browser is None:
+    # playerwright.stop() cleans up the full /tmp folder
+    # if it doesnt exist, create it
+    if not os.path.exists('/tmp'):
+      logger.debug('/tmp does not exist, creating it')
+      os.makedirs('/tmp', exist_ok=True)
+    logger.debug('Launching browser')
+    _browser = _launch_browser()
+  return _browser
+
+def _get_context(platform: DLRequestPlatform) -> BrowserContext:
+  ''' Get the context of the platform, replacing it when it served too many jobs '''
+  browser = get_browser()
+  entry = _contexts.get(platform)
+  if entry is not None and entry[1] >= get_context_max_jobs():
+    logger.debug(f'Recycling browser context of {platform.value} after {entry[1]} jobs')
+    _close_context(platform)
+    entry = None
+  if entry is None:
+    entry = [_create_context(browser, platform), 0]
+    _contexts[platform] = entry
+  entry[1] += 1
+  return entry[0]
+
+def _close_context(platform: DLRequestPlatform):
+  entry = _contexts.pop(platform, None)
+  if entry is None:
+    return
+  try:
+    entry[0].close()
+  except Exception as e:
+    logger.debug(f'Failed to close browser context of {platform.value}: {e}')
+
+def close_browser():
+  ''' Close the shared browser and all its contexts '''
+  global _browser
+  for platform in list(_contexts.keys()):
+    _close_context(platform)
+  if _browser is not None:
+    try:
+      _browser.close()
+    except Exception as e:
+      logger.debug(f'Failed to close browser: {e}')
+    _browser = None
+
+class BrowserLease:
+  '''
+  A page of the shared browser, borrowed for one job.
+  close() only closes the page, the browser and the platform's context stay warm.
+  '''
+
+  def __init__(self, platform: DLRequestPlatform, page: Page, started: float = None):
+    self.platform = platform
+    self.page = page
+    # perf_counter() when the page was requested, the lease's lifetime is the browser stage of the job
+    self.started = started
+  def __str__(self):
+    return f'<BrowserLease(platform={self.platform.value})>'
+  def __repr__(self):
+    return self.__str__()
+
+  def close(self):
+    try:
+      self.page.close()
+    except Exception as e:
+      # a crashed page or browser: start from a fresh context next time
+      logger.warning(f'Failed to close page of {self.platform.value}, dropping its context: {e}')
+      _close_context(self.platform)
+    if self.started is not None:
+      record_stage('browser', time.perf_counter() - self.started)
+      self.started = None
+
+def create_playwright_page(platform: DLRequestPlatform) -> tuple[BrowserLease, Page]:
+  '''
+  Create a page with the correct state for the given platform, in the shared browser.
+
+  :return: a tuple containing the lease (close it when done) and page objects
+  '''
+  started = time.perf_counter()
+  try:
+    page = _get_context(platform).new_page()
+  except Exception as e:
+    # the browser or context is in a bad state, start over once
+    logger.warning(f'Failed to open a page for {platform.value}, restarting the browser: {e}')
+    close_browser()
+    page = _get_context(platform).new_page()
+  attach_diagnostics_listeners(page)
+
+  return (BrowserLease(platform, page, started), page)
@@ -4,6 +4,20 @@ from typing import List
 from loguru import logger
 
 from ..models.dl_request_platform import DLRequestPlatform
+from .manifest_cache import get_manifest_file
+from .job_metrics import metrics_stage, get_file_size
+
+def get_manifest_args(mpd_url: str) -> List[str]:
+  '''
+  The manifest arguments for n-m3u8dl-re: the local copy when the manifest
+  was already fetched in this job, so it isn't fetched again.
+  '''
+  manifest_file = get_manifest_file(mpd_url)
+  if manifest_file is None:
+    return [mpd_url]
+  logger.debug(f'Passing local copy {manifest_file} of {mpd_url}')
+  # relative urls in the manifest are resolved against the original location
+  return [manifest_file, '--base-url', mpd_url]
 
 def download_video_nre(
   mpd_url: str,
@@ -50,12 +64,15 @@ def download_video_nre(
     '--mux-after-done', 'format=mkv:muxer=ffmpeg',
     '--save-dir', save_dir,
     '--save-name', filename,
-    mpd_url])
+    *get_manifest_args(mpd_url)])
   
   command.extend(extra_args)
 
   logger.debug(f'Calling binary ... {command}')
-  subprocess.run(command)
+  # downloads, decrypts and muxes
+  with metrics_stage('segments', tool='n-m3u8dl-re') as stage:
+    subprocess.run(command)
+    stage.bytes = get_file_size(f'{save_dir}/{filename}.mkv')
 
   logger.info(f'Finished downloading {filename}')
 
@@ -93,13 +110,14 @@ def download_subs_nre(
     '--tmp-dir', f'./tmp/{platform.value}',
     '--save-dir', save_dir,
     '--save-name', filename,
-    mpd_url
+    *get_manifest_args(mpd_url),
   ])
   
   command.extend(extra_args)
 
   logger.debug(f'Calling binary for subtitles ... {command}')
-  subprocess.run(command)
+  with metrics_stage('subtitles', tool='n-m3u8dl-re'):
+    subprocess.run(command)
 
   logger.info(f'Finished downloading subtitles for {filename}')
 
@@ -0,0 +1,106 @@
+import importlib
+import importlib.metadata
+import threading
+from typing import Callable, List
+
+from loguru import logger
+
+from ..models.dl_request_platform import DLRequestPlatform
+
+# Entry point group other packages can register downloaders in,
+# every entry point refers to a DownloaderPlugin
+ENTRY_POINT_GROUP = 'dl_downer.downloaders'
+
+class DownloaderPlugin:
+  '''
+  A downloader for one platform: the urls it handles and where its download
+  function is. The module of the download function is only imported when
+  the platform is actually downloaded from, so workers don't pay for the
+  dependencies (playwright, pywidevine, ...) of platforms they never use.
+  '''
+
+  def __init__(
+    self,
+    platform: str,
+    target: str,
+    url_patterns: List[str] = None,
+  ):
+    '''
+    :param platform: the platform value of the download requests it handles
+    :param target: 'module:function', the function takes a DLRequest and returns a DownloadResult.
+      Modules starting with a dot are relative to this package (e.g. '..downloaders.VRTMAX').
+    :param url_patterns: the platform is picked for urls containing any of these
+    '''
+    self.platform = platform
+    self.target = target
+    self.url_patterns = url_patterns if url_patterns is not None else []
+    self.download_function = None
+
+  def __str__(self):
+    return f'<DownloaderPlugin(platform={self.platform}, target={self.target})>'
+  def __repr__(self):
+    return self.__str__()
+
+  def matches(self, url: str) -> bool:
+    return any(pattern in url for pattern in self.url_patterns)
+
+  def load(self) -> Callable:
+    ''':return: the download function, importing its module the first time'''
+    if self.download_function is None:
+      module_name, function_name = self.target.split(':')
+      module = importlib.import_module(module_name, __package__)
+      self.download_function = getattr(module, function_name)
+    return self.download_function
+
+BUILTIN_DOWNLOADERS = [
+  DownloaderPlugin(DLRequestPlatform.VRTMAX.value, '..downloaders.VRTMAX:VRTMAX_DL', ['vrt.be']),
+  DownloaderPlugin(DLRequestPlatform.GOPLAY.value, '..downloaders.GOPLAY:GOPLAY_DL', ['goplay.be', 'play.tv']),
+  DownloaderPlugin(DLRequestPlatform.VTMGO.value, '..downloaders.VTMGO:VTMGO_DL', ['vtmgo.be']),
+  DownloaderPlugin(DLRequestPlatform.STREAMZ.value, '..downloaders.STREAMZ:STREAMZ_DL', ['streamz.be']),
+  # only picked explicitly, not by url
+  DownloaderPlugin(DLRequestPlatform.GENERIC_MANIFEST.value, '..downloaders.GENERIC_MANIFEST:GENERIC_MANIFEST_DL'),
+  DownloaderPlugin(DLRequestPlatform.YOUTUBE.value, '..downloaders.YOUTUBE:YOUTUBE_DL'),
+]
+
+_lock = threading.Lock()
+_installed_downloaders: List[DownloaderPlugin] = None
+
+def load_installed_downloaders() -> List[DownloaderPlugin]:
+  ''':return: the downloaders other packages registered in the ENTRY_POINT_GROUP entry point group'''
+  global _installed_downloaders
+  with _lock:
+    if _installed_downloaders is None:
+      _installed_downloaders = []
+      for entry_point in importlib.metadata.entry_points(group=ENTRY_POINT_GROUP):
+        try:
+          plugin = entry_point.load()
+        except Exception as e:
+          logger.error(f'Could not load downloader {entry_point.name} ({entry_point.value}): {e}')
+          continue
+        if not isinstance(plugin, DownloaderPlugin):
+          logger.error(f'Downloader {entry_point.name} ({entry_point.value}) is not a DownloaderPlugin')
+          continue
+        logger.debug(f'Found installed downloader {plugin}')
+        _installed_downloaders.append(plugin)
+    return _installed_downloaders
+
+def get_downloader(platform: str) -> DownloaderPlugin:
+  ''':return: the downloader of the platform, or None'''
+  # built-in platforms don't need the installed packages to be scanned
+  for plugin in BUILTIN_DOWNLOADERS:
+    if plugin.platform == platform:
+      return plugin
+  for plugin in load_installed_downloaders():
+    if plugin.platform == platform:
+      return plugin
+  return None
+
+def get_downloader_for_url(url: str) -> DownloaderPlugin:
+  ''':return: the first downloader that handles the url, or None'''
+  for plugin in BUILTIN_DOWNLOADERS:
+    if plugin.matches(url):
+      return plugin
+  for plugin in load_installed_downloaders():
+    if plugin.matches(url):
+      return plugin
+  return None
@@ -1,3 +1,4 @@
+import errno
 import os
 import shutil
 import subprocess
@@ -5,6 +6,9 @@ from typing import List
 import uuid
 from loguru import logger
 
+from .webvtt import convert_webvtt_file
+from .job_metrics import metrics_stage, get_file_size
+
 def decrypt_file(
   filename: str,
   keys: dict[str, str],
@@ -23,38 +27,43 @@ def decrypt_file(
   command.extend([ filename, decrypted_filename ])
 
   logger.debug(f'Running command: {" ".join(command)}')
-  subprocess.run(command, check=True)
+  with metrics_stage('decrypt', tool='mp4decrypt') as stage:
+    subprocess.run(command, check=True)
+    stage.bytes = get_file_size(decrypted_filename)
 
   logger.debug(f'Decrypted file into {decrypted_filename}')
   return decrypted_filename
 
+def write_concat_list(
+  files: List[str],
+  list_file: str,
+) -> str:
+  '''Writes an ffmpeg concat demuxer list referencing the files by absolute path'''
+  with open(list_file, 'w') as f_write:
+    for f in files:
+      # escape single quotes the way the concat demuxer expects them
+      escaped = os.path.abspath(f).replace("'", "'\\''")
+      f_write.write(f"file '{escaped}'\n")
+  return list_file
+
 def concat_files(
   files: List[str],
   out_file: str,
 ) -> str:
-  '''Concatenates all files into one file using ffmpeg'''
+  '''Concatenates all files into one file using ffmpeg, without copying the inputs'''
 
   logger.debug(f'Concatenating files {files} into {out_file}')
 
-  # Create a temporary folder
-  my_uuid = str(uuid.uuid4())[:8]
-  my_tmp_dir = os.path.join(os.path.dirname(files[0]), f'concat-{my_uuid}')
-  os.makedirs(my_tmp_dir, exist_ok=True)
-
-  # copy all files to temporary folder
-  for f in files:
-    shutil.copy(f, my_tmp_dir)
-
-  # add all files to concat list txt
-  concat_list_file = f'{my_tmp_dir}/concat_list.txt'
-  with open(concat_list_file, 'w') as f_write:
-    for f in files:
-      f_write.write(f"file '{os.path.basename(f)}'\n")
+  concat_list_file = write_concat_list(
+    files,
+    os.path.join(os.path.dirname(os.path.abspath(out_file)), f'concat-list-{str(uuid.uuid4())[:8]}.txt'),
+  )
 
   command = [ 'ffmpeg',
     '-f', 'concat',
-    '-i', concat_list_file,
+    # absolute paths are considered unsafe, -safe has to come before -i to apply
     '-safe', '0',
+    '-i', concat_list_file,
     '-c:a', 'copy',
     '-c:v', 'copy',
     '-y',
@@ -63,10 +72,12 @@ def concat_files(
   ]
 
   logger.debug(f'Running command: {" ".join(command)}')
-  subprocess.run(command, check=True)
-
-  # Delete own tmp folder
-  shutil.rmtree(my_tmp_dir)
+  try:
+    with metrics_stage('ffmpeg', step='concat') as stage:
+      subprocess.run(command, check=True)
+      stage.bytes = get_file_size(out_file)
+  finally:
+    os.remove(concat_list_file)
 
   logger.debug(f'Concatenated files into {out_file}')
   return out_file
@@ -90,50 +101,56 @@ def merge_files(
   ])
 
   logger.info(f'Merging {input_files} into {output_file}...')
-  subprocess.run(command, check=True)
+  with metrics_stage('ffmpeg', step='merge') as stage:
+    subprocess.run(command, check=True)
+    stage.bytes = get_file_size(output_file)
   logger.info(f'Merged successfully!')
 
-def insert_subtitle(
+def insert_subtitles(
   input_file: str,
-  subtitle_file: str,
+  subtitles: List[tuple],
 ):
-  did_convert = False
-  # convert to srt if subtitle if needed
-  if subtitle_file.endswith('.vtt'):
-    converted_subtitle_file = os.path.join(
-      os.path.dirname(subtitle_file),
-      f'{os.path.basename(subtitle_file)[:-4]}.srt',
-    )
-    command = [ 'ffmpeg',
-      '-i', subtitle_file,
-      converted_subtitle_file,
-    ]
-    logger.info(f'Converting {subtitle_file} to srt...')
-    subprocess.run(command, check=True)
-    subtitle_file = converted_subtitle_file
-    did_convert = True
-    logger.info(f'Converted successfully!')
+  '''
+  Adds all subtitles to the file with one single ffmpeg command.
+  WebVTT subtitles are converted to SRT in process first.
 
+  :param subtitles: list of (subtitle file, language or None)
+  '''
+  if len(subtitles) == 0:
+    return
   temp_output_file = os.path.join(
     os.path.dirname(input_file),
     f'subbed_{os.path.basename(input_file)}',
   )
-  command = [ 'ffmpeg',
-    '-i', input_file,
-    '-i', subtitle_file,
-    '-c', 'copy',
-    '-y',
-    temp_output_file,
-  ]
+  converted_files = []
+  try:
+    plan = MuxPlan(os.path.dirname(input_file))
+    # keep the subtitles the file already has
+    plan.add_track([input_file], subtitle_streams=True)
+    for subtitle_file, language in subtitles:
+      if subtitle_file.lower().endswith('.vtt'):
+        logger.debug(f'Converting {subtitle_file} to srt...')
+        subtitle_file = convert_webvtt_file(subtitle_file)
+        converted_files.append(subtitle_file)
+      plan.add_subtitle(subtitle_file, language)
 
-  logger.info(f'Inserting subtitle {subtitle_file} into {input_file}...')
-  subprocess.run(command, check=True)
-  # Move the temp file to the original file + overwrite
-  shutil.move(temp_output_file, input_file)
-  # if subs were converted, remove the converted file
-  if did_convert:
-    os.remove(subtitle_file)
-  logger.info(f'Subtitle inserted successfully!')
+    logger.info(f'Inserting {len(subtitles)} subtitles into {input_file}...')
+    plan.run(temp_output_file)
+    # Move the temp file to the original file + overwrite
+    shutil.move(temp_output_file, input_file)
+    logger.info(f'Subtitles inserted successfully!')
+  finally:
+    for converted_file in converted_files:
+      os.remove(converted_file)
+    if os.path.exists(temp_output_file):
+      os.remove(temp_output_file)
+
+def insert_subtitle(
+  input_file: str,
+  subtitle_file: str,
+  language: str = None,
+):
+  insert_subtitles(input_file, [(subtitle_file, language)])
 
 def convert_to_mkv(
   input_file: str,
@@ -151,7 +168,9 @@ def convert_to_mkv(
   ]
 
   logger.info(f'Converting {input_file} to mkv...')
-  subprocess.run(command, check=True)
+  with metrics_stage('ffmpeg', step='convert') as stage:
+    subprocess.run(command, check=True)
+    stage.bytes = get_file_size(output_file)
   logger.info(f'Converted successfully!')
 
   if delete_original:
@@ -171,5 +190,206 @@ def defragment_mp4(
   ]
 
   logger.info(f'Defragmenting {input_file}...')
-  subprocess.run(command, check=True)
+  with metrics_stage('ffmpeg', step='defragment') as stage:
+    subprocess.run(command, check=True)
+    stage.bytes = get_file_size(output_file)
   logger.info(f'Defragmented successfully!')
+
+
+class MuxPlan:
+  '''
+  Collects all inputs of the final file (tracks, tracks made of multiple
+  files that need to be concatenated and subtitles) and writes the final
+  file with one single ffmpeg command, instead of remuxing the complete
+  file once for every step.
+
+  Fragmented MP4 input does not need to be defragmented first, ffmpeg
+  writes a regular file anyway.
+  '''
+
+  def __init__(
+    self,
+    work_dir: str,
+  ):
+    ''':param work_dir: folder to write the concat lists to'''
+    self.work_dir = work_dir
+    # list of (input arguments, is_subtitle, language)
+    self.inputs = []
+    # indexes of the inputs that contain subtitle streams themselves
+    self.inputs_with_subtitles = []
+
+  def __str__(self):
+    return f'<MuxPlan(inputs={len(self.inputs)})>'
+  def __repr__(self):
+    return self.__str__()
+
+  def add_track(
+    self,
+    files: List[str],
+    subtitle_streams: bool = False,
+  ):
+    '''
+    Add all streams of the files, concatenated in the given order.
+
+    :param subtitle_streams: whether the files can contain subtitle streams,
+      those are placed after the added subtitles so the languages line up
+    '''
+    files = [f for f in files if f is not None]
+    if len(files) == 0:
+      return
+    if subtitle_streams:
+      self.inputs_with_subtitles.append(len(self.inputs))
+    if len(files) == 1:
+      self.inputs.append(([ '-i', files[0] ], False, None))
+      return
+    list_file = write_concat_list(
+      files,
+      os.path.join(self.work_dir, f'concat-list-{str(uuid.uuid4())[:8]}.txt'),
+    )
+    self.inputs.append(([ '-f', 'concat', '-safe', '0', '-i', list_file ], False, None))
+
+  def add_subtitle(
+    self,
+    subtitle_file: str,
+    language: str = None,
+  ):
+    self.inputs.append(([ '-i', subtitle_file ], True, language))
+
+  def build_command(
+    self,
+    out_file: str,
+  ) -> List[str]:
+    if not any(not is_subtitle for _, is_subtitle, _ in self.inputs):
+      raise Exception('Nothing to mux, no tracks were added')
+
+    command = [ 'ffmpeg', '-loglevel', 'warning' ]
+    for input_args, _, _ in self.inputs:
+      command.extend(input_args)
+    # keep every stream of every input, not only ffmpeg's default selection
+    for i in range(len(self.inputs)):
+      command.extend([ '-map', str(i) ])
+      if i in self.inputs_with_subtitles:
+        command.extend([ '-map', f'-{i}:s' ])
+    for i in self.inputs_with_subtitles:
+      command.extend([ '-map', f'{i}:s?' ])
+    command.extend([ '-c', 'copy' ])
+
+    subtitle_languages = [language for _, is_subtitle, language in self.inputs if is_subtitle]
+    if len(subtitle_languages) > 0:
+      # the added subtitles come first, they are converted to the format of the container,
+      # the subtitles the inputs already have are copied
+      subtitle_codec = 'mov_text' if out_file.endswith('.mp4') else 'srt'
+      for i, language in enumerate(subtitle_languages):
+        command.extend([ f'-c:s:{i}', subtitle_codec ])
+        if language is not None:
+          command.extend([ f'-metadata:s:s:{i}', f'language={language}' ])
+
+    command.extend([ '-y', out_file ])
+    return command
+
+  def run(
+    self,
+    out_file: str,
+  ) -> str:
+    ''':return: the path to the output file'''
+    command = self.build_command(out_file)
+    logger.info(f'Muxing {len(self.inputs)} inputs into {out_file}...')
+    logger.debug(f'Running command: {" ".join(command)}')
+    with metrics_stage('ffmpeg', step='mux', inputs=len(self.inputs)) as stage:
+      subprocess.run(command, check=True)
+      stage.bytes = get_file_size(out_file)
+    logger.info(f'Muxed successfully!')
+    return out_file
+
+
+# Size of the chunks copied by the kernel when moving across filesystems
+MOVE_CHUNK_SIZE = 64 * 1024 * 1024
+
+def is_same_filesystem(
+  path: str,
+  other_dir: str,
+) -> bool:
+  return os.stat(path).st_dev == os.stat(other_dir).st_dev
+
+def copy_file_data(
+  src_fd: int,
+  dst_fd: int,
+  size: int,
+):
+  '''Copies size bytes between two file descriptors, in kernel space when possible'''
+  copied = 0
+  # copy_file_range can clone/offload the copy, sendfile at least avoids user space
+  for copy_fn in [getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None)]:
+    if copy_fn is None:
+      continue
+    try:
+      # sendfile writes at the current position of dst
+      os.lseek(dst_fd, copied, os.SEEK_SET)
+      while copied < size:
+        if copy_fn is os.sendfile:
+          sent = os.sendfile(dst_fd, src_fd, copied, min(MOVE_CHUNK_SIZE, size - copied))
+        else:
+          sent = copy_fn(src_fd, dst_fd, min(MOVE_CHUNK_SIZE, size - copied), copied, copied)
+        if sent == 0:
+          break
+        copied += sent
+      if copied >= size:
+        return
+    except OSError as error:
+      # not supported for these files, try the next method from where this one stopped
+      logger.debug(f'{copy_fn.__name__} failed after {copied} bytes ({error}), falling back')
+
+  # plain read/write for whatever is left
+  os.lseek(src_fd, copied, os.SEEK_SET)
+  os.lseek(dst_fd, copied, os.SEEK_SET)
+  while True:
+    chunk = os.read(src_fd, 1024 * 1024)
+    if not chunk:
+      break
+    os.write(dst_fd, chunk)
+
+def move_file(
+  src: str,
+  dst: str,
+) -> str:
+  '''
+  Moves a file, replacing dst if it exists.
+
+  On the same filesystem this is a rename. Otherwise the file is copied to
+  a temporary name next to dst, synced to disk and then renamed to dst, so
+  dst is never a half written file, even when the process crashes.
+  '''
+  dst_dir = os.path.dirname(os.path.abspath(dst))
+  os.makedirs(dst_dir, exist_ok=True)
+
+  if is_same_filesystem(src, dst_dir):
+    try:
+      os.replace(src, dst)
+      return dst
+    except OSError as error:
+      # e.g. bind mounts of the same device
+      if error.errno != errno.EXDEV:
+        raise
+
+  logger.debug(f'Copying {src} to another filesystem ...')
+  tmp_dst = os.path.join(dst_dir, f'.{os.path.basename(dst)}.{str(uuid.uuid4())[:8]}.part')
+  try:
+    with open(src, 'rb') as f_src, open(tmp_dst, 'wb') as f_dst:
+      copy_file_data(f_src.fileno(), f_dst.fileno(), os.fstat(f_src.fileno()).st_size)
+      f_dst.flush()
+      os.fsync(f_dst.fileno())
+    shutil.copystat(src, tmp_dst)
+    os.replace(tmp_dst, dst)
+  except BaseException:
+    if os.path.exists(tmp_dst):
+      os.remove(tmp_dst)
+    raise
+
+  # make the rename itself durable before the source is gone
+  dir_fd = os.open(dst_dir, os.O_RDONLY)
+  try:
+    os.fsync(dir_fd)
+  finally:
+    os.close(dir_fd)
+  os.remove(src)
+  return dst
@@ -1,14 +1,8 @@
 from ..models.dl_request_platform import DLRequestPlatform
+from .downloader_registry import get_downloader_for_url
 
 def get_platform_for_url(url: str) -> DLRequestPlatform:
-  if 'vrt.be' in url:
-    return DLRequestPlatform.VRTMAX.value
-  if 'goplay.be' in url:
-    return DLRequestPlatform.GOPLAY.value
-  if 'play.tv' in url:
-    return DLRequestPlatform.GOPLAY.value
-  if 'vtmgo.be' in url:
-    return DLRequestPlatform.VTMGO.value
-  if 'streamz.be' in url:
-    return DLRequestPlatform.STREAMZ.value
+  plugin = get_downloader_for_url(url)
+  if plugin is not None:
+    return plugin.platform
   return DLRequestPlatform.UNKNOWN
@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+import urllib.parse
+
+from email.utils import parsedate_to_datetime
+from loguru import logger
+
+from .http_session import get_pool_maxsize
+
+# How often the limit is reconsidered
+ADJUST_INTERVAL = 1.0
+# Throughput has to grow by this factor before another request is allowed in flight
+THROUGHPUT_GAIN = 1.05
+# Latency counts as rising when it is this many times (and LATENCY_SLACK seconds) above the best seen
+LATENCY_TOLERANCE = 2.0
+LATENCY_SLACK = 0.05
+# Weight of a new sample in the latency average
+LATENCY_SMOOTHING = 0.2
+# Never wait longer than this for a Retry-After
+MAX_RETRY_AFTER = 60
+
+_lock = threading.Lock()
+_hosts: dict[str, 'HostConcurrency'] = {}
+
+def get_initial_host_concurrency() -> int:
+  ''' Use 4 or 75% of CPU threads, whichever is higher '''
+  cpu_count = os.cpu_count() or 4
+  return max(4, int(cpu_count * 0.75))
+
+def get_max_host_concurrency() -> int:
+  ''' No more requests than there are pooled connections per host '''
+  return get_pool_maxsize()
+
+def parse_retry_after(value: str) -> float:
+  '''
+  :param value: a Retry-After header, in seconds or as an HTTP date
+  :return: the number of seconds to wait, or None
+  '''
+  if not value:
+    return None
+  try:
+    seconds = float(value)
+  except ValueError:
+    try:
+      seconds = parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+      return None
+  return min(max(0.0, seconds), MAX_RETRY_AFTER)
+
+class HostConcurrency:
+  '''
+  AIMD limit on the number of requests in flight to one host.
+
+  Every ADJUST_INTERVAL the throughput of the last interval is compared to
+  the one before: one more request is allowed while throughput keeps
+  improving (additive increase), and the limit shrinks by a quarter when the
+  time to the response headers rises well above the best seen so far.
+  A 429 or 5xx response halves the limit, and a Retry-After pauses all
+  requests to the host until it has passed (multiplicative decrease).
+  '''
+
+  def __init__(self, host: str, initial_limit: int = None, max_limit: int = None):
+    self.host = host
+    self.max_limit = max_limit or get_max_host_concurrency()
+    self.limit = float(min(initial_limit or get_initial_host_concurrency(), self.max_limit))
+    self.in_flight = 0
+    self.paused_until = 0.0
+    self.clock = time.monotonic
+    self.condition = threading.Condition()
+    self.latency = None
+    self.best_latency = None
+    self.interval_start = self.clock()
+    self.interval_bytes = 0
+    self.interval_peak = 0
+    self.last_throughput = None
+    self.last_decrease = float('-inf')
+
+  def acquire(self, blocking: bool = True) -> bool:
+    '''
+    Wait for a free slot, and for any Retry-After to pass
+
+    :param blocking: when False, don't wait but return False when no slot is free
+    :return: whether a slot was taken
+    '''
+    with self.condition:
+      while True:
+        wait = self.paused_until - self.clock()
+        if wait > 0:
+          if not blocking:
+            return False
+          self.condition.wait(wait)
+        elif self.in_flight >= int(self.limit):
+          if not blocking:
+            return False
+          self.condition.wait()
+        else:
+          break
+      self.in_flight += 1
+      self.interval_peak = max(self.interval_peak, self.in_flight)
+      return True
+
+  def release(self):
+    with self.condition:
+      self.in_flight -= 1
+      self.condition.notify()
+
+  def on_success(self, size: int, latency: float):
+    '''
+    :param size: bytes received
+    :param latency: seconds until the response headers were received
+    '''
+    with self.condition:
+      self.interval_bytes += size
+      if self.latency is None:
+        self.latency = latency
+      else:
+        self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+      if self.best_latency is None or self.latency < self.best_latency:
+        self.best_latency = self.latency
+
+      now = self.clock()
+      elapsed = now - self.interval_start
+      if elapsed < ADJUST_INTERVAL:
+        return
+      throughput = self.interval_bytes / elapsed
+      if self.latency > self.best_latency * LATENCY_TOLERANCE + LATENCY_SLACK:
+        self._decrease(0.75, f'latency rose to {self.latency * 1000:.0f}ms')
+      elif self.last_throughput is None or throughput > self.last_throughput * THROUGHPUT_GAIN:
+        # only grow when the limit was actually reached, otherwise it isn't what holds us back
+        if self.interval_peak >= int(self.limit) and self.limit < self.max_limit:
+          self.limit = min(self.max_limit, self.limit + 1)
+          logger.debug(f'Raised concurrency for {self.host} to {int(self.limit)} ({throughput / 1024 / 1024:.1f} MB/s)')
+          self.condition.notify_all()
+      self.last_throughput = throughput
+      self.interval_start = now
+      self.interval_bytes = 0
+      self.interval_peak = self.in_flight
+
+  def on_throttled(self, status_code: int, retry_after: float = None):
+    '''Called for 429 and 5xx responses'''
+    with self.condition:
+      if retry_after is not None:
+        self.paused_until = max(self.paused_until, self.clock() + retry_after)
+      self._decrease(0.5, f'server responded {status_code}')
+
+  def _decrease(self, factor: float, reason: str):
+    now = self.clock()
+    # a burst of errors caused by the same overload only counts once
+    if now - self.last_decrease < ADJUST_INTERVAL:
+      return
+    self.last_decrease = now
+    self.limit = max(1.0, self.limit * factor)
+    # what was measured with the old limit says nothing about the new one
+    self.last_throughput = None
+    logger.debug(f'Lowered concurrency for {self.host} to {int(self.limit)}: {reason}')
+
+def get_host_concurrency(url: str) -> HostConcurrency:
+  '''
+  Get the concurrency limit of the host of url. Limits are kept for the
+  whole process, so what is learned about a CDN carries over to the next
+  representation and job.
+  '''
+  host = urllib.parse.urlparse(url).netloc
+  with _lock:
+    limiter = _hosts.get(host)
+    if limiter is None:
+      limiter = HostConcurrency(host)
+      _hosts[host] = limiter
+    return limiter
@@ -0,0 +1,69 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+_lock = threading.Lock()
+_adapter: HTTPAdapter = None
+_local = threading.local()
+
+def get_pool_maxsize() -> int:
+  ''' Number of keep-alive connections kept open per host '''
+  try:
+    return max(1, int(os.getenv('DL_HTTP_POOL_MAXSIZE', '32')))
+  except ValueError:
+    return 32
+
+def _get_adapter() -> HTTPAdapter:
+  global _adapter
+  with _lock:
+    if _adapter is None:
+      _adapter = HTTPAdapter(
+        # number of hosts to keep a connection pool for
+        pool_connections=int(os.getenv('DL_HTTP_POOL_HOSTS', '16')),
+        # number of connections kept per host
+        pool_maxsize=get_pool_maxsize(),
+        # wait for a free connection instead of opening throwaway ones
+        pool_block=True,
+      )
+    return _adapter
+
+def get_session() -> requests.Session:
+  '''
+  Get a requests session that reuses keep-alive connections.
+
+  Every thread gets its own Session (Session objects aren't thread-safe), but
+  all of them share one connection pool per host, so connections opened by
+  one thread are reused by the others.
+  '''
+  session = getattr(_local, 'session', None)
+  if session is None:
+    session = requests.Session()
+    adapter = _get_adapter()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    _local.session = session
+  return session
+
+def get_connection_stats() -> dict:
+  '''
+  Count how many requests were sent over pooled connections.
+
+  :return: dict with 'requests', 'connections' and 'reused' totals
+  '''
+  total_requests = 0
+  total_connections = 0
+  with _lock:
+    if _adapter is not None:
+      pools = _adapter.poolmanager.pools
+      for key in list(pools.keys()):
+        pool = pools.get(key)
+        if pool is None:
+          continue
+        total_requests += pool.num_requests
+        total_connections += pool.num_connections
+  return {
+    'requests': total_requests,
+    'connections': total_connections,
+    'reused': max(0, total_requests - total_connections),
+  }
@@ -0,0 +1,214 @@
+import contextlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from loguru import logger
+
+def get_metrics_store() -> str:
+  ''' Where job metrics are stored: 'jsonl' (default), 'db' or 'off' '''
+  return os.getenv('DL_METRICS', 'jsonl')
+
+def get_metrics_file() -> str:
+  return os.getenv('DL_METRICS_FILE', './metrics/dl_request_metrics.jsonl')
+
+class JobMetrics:
+  '''
+  Timings of the stages of one download job (browser, metadata, license,
+  manifest, segments, decrypt, ffmpeg, move, ...), with the number of bytes
+  for the stages that transfer or write data.
+
+  Stages are recorded from any thread and can overlap: representations are
+  downloaded in parallel and a login can be part of fetching the metadata.
+  '''
+
+  def __init__(
+    self,
+    dl_request_id,
+    platform: str,
+  ):
+    self.dl_request_id = dl_request_id
+    self.platform = platform
+    self.started = time.time()
+    self.seconds = None
+    self.status = None
+    self.lock = threading.Lock()
+    # list of { stage, started, seconds, bytes, detail }
+    self.stages = []
+
+  def __str__(self):
+    return f'<JobMetrics(dl_request_id={self.dl_request_id}, stages={len(self.stages)})>'
+  def __repr__(self):
+    return self.__str__()
+
+  def add(
+    self,
+    stage: str,
+    started: float,
+    seconds: float,
+    size: int = None,
+    detail: dict = None,
+  ):
+    with self.lock:
+      self.stages.append({
+        'stage': stage,
+        'started': started,
+        'seconds': seconds,
+        'bytes': size,
+        'detail': detail or {},
+      })
+
+  def to_dict(self) -> dict:
+    with self.lock:
+      stages = [dict(s) for s in self.stages]
+    for s in stages:
+      s['mb_per_s'] = s['bytes'] / s['seconds'] / 1000000 if s['bytes'] is not None and s['seconds'] > 0 else None
+    return {
+      'dl_request_id': self.dl_request_id,
+      'platform': self.platform,
+      'status': self.status,
+      'started': self.started,
+      'seconds': self.seconds,
+      'stages': stages,
+    }
+
+  def summary(self) -> str:
+    ''':return: the total time and bytes per stage, in the order the stages first occurred'''
+    totals = {}
+    with self.lock:
+      for s in self.stages:
+        total = totals.setdefault(s['stage'], [0.0, None])
+        total[0] += s['seconds']
+        if s['bytes'] is not None:
+          total[1] = (total[1] or 0) + s['bytes']
+    parts = []
+    for stage, (seconds, size) in totals.items():
+      if size is None:
+        parts.append(f'{stage} {seconds:.2f}s')
+      else:
+        rate = f', {size / seconds / 1000000:.1f} MB/s' if seconds > 0 else ''
+        parts.append(f'{stage} {seconds:.2f}s ({size / 1000000:.1f} MB{rate})')
+    return ', '.join(parts)
+
+  def store_jsonl(self, path: str):
+    ''' Appends the job as one line to the file '''
+    if os.path.dirname(path) != '':
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+      f.write(json.dumps(self.to_dict()) + '\n')
+
+  def store_db(self, db):
+    ''' Inserts a row per stage and a 'total' row in dl.dl_request_metrics '''
+    metrics = self.to_dict()
+    rows = [(
+      self.dl_request_id,
+      'total',
+      datetime.fromtimestamp(self.started, timezone.utc),
+      self.seconds,
+      None,
+      json.dumps({ 'platform': self.platform, 'status': self.status }),
+    )]
+    for s in metrics['stages']:
+      rows.append((
+        self.dl_request_id,
+        s['stage'],
+        datetime.fromtimestamp(s['started'], timezone.utc),
+        s['seconds'],
+        s['bytes'],
+        json.dumps(s['detail']),
+      ))
+    db_conn = db.getconn()
+    try:
+      cursor = db_conn.cursor()
+      cursor.executemany(
+        '''
+        INSERT INTO dl.dl_request_metrics (dl_request_id, stage, started, seconds, bytes, detail)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ''',
+        rows,
+      )
+      db_conn.commit()
+      cursor.close()
+    except Exception:
+      db_conn.rollback()
+      raise
+    finally:
+      db.putconn(db_conn)
+
+  def store(self, db = None):
+    ''' Stores the metrics where DL_METRICS says, a failure is only logged '''
+    store = get_metrics_store()
+    try:
+      if store == 'db' and db is not None:
+        self.store_db(db)
+      elif store in ['db', 'jsonl']:
+        # no database outside of the server (cli)
+        self.store_jsonl(get_metrics_file())
+    except Exception as e:
+      logger.warning(f'Failed to store metrics of {self.dl_request_id}: {e}')
+
+class StageTimer:
+  ''' Set bytes and detail while the stage runs, they are recorded when it ends '''
+  def __init__(self, detail: dict):
+    self.bytes = None
+    self.detail = detail
+
+# The metrics of the job this process is working on, shared by all its threads
+_current: JobMetrics = None
+
+@contextlib.contextmanager
+def job_metrics(dl_request, db = None):
+  '''Collect the stage metrics of a job, they are logged and stored when it ends'''
+  global _current
+  _current = JobMetrics(dl_request.id, dl_request.platform)
+  try:
+    yield _current
+    _current.status = 'COMPLETED'
+  except BaseException:
+    _current.status = 'FAILED'
+    raise
+  finally:
+    metrics = _current
+    _current = None
+    metrics.seconds = time.time() - metrics.started
+    logger.info(f'Stages of {dl_request.id}: {metrics.summary()}')
+    metrics.store(db)
+
+@contextlib.contextmanager
+def metrics_stage(stage: str, **detail):
+  '''
+  Time a stage of the current job, does nothing outside of a job.
+  A stage that raises is recorded with failed=True.
+  '''
+  timer = StageTimer(detail)
+  started = time.time()
+  start = time.perf_counter()
+  try:
+    yield timer
+  except BaseException:
+    timer.detail['failed'] = True
+    raise
+  finally:
+    record_stage(stage, time.perf_counter() - start, timer.bytes, started=started, **timer.detail)
+
+def record_stage(
+  stage: str,
+  seconds: float,
+  size: int = None,
+  started: float = None,
+  **detail,
+):
+  ''' Record a stage that was timed elsewhere, does nothing outside of a job '''
+  metrics = _current
+  if metrics is None:
+    return
+  metrics.add(stage, started if started is not None else time.time() - seconds, seconds, size, detail)
+
+def get_file_size(path: str) -> int:
+  ''':return: the size of the file, or None when it doesn't exist'''
+  try:
+    return os.path.getsize(path)
+  except OSError:
+    return None
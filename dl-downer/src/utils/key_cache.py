@@ -0,0 +1,80 @@
+import contextlib
+import os
+import sqlite3
+import time
+
+from typing import Dict, List
+from loguru import logger
+
+def get_key_cache_location() -> str:
+  ''' The key cache lives next to the storage states, so it survives restarts '''
+  folder = os.getenv('STORAGE_STATES_FOLDER', './storage_states')
+  os.makedirs(folder, exist_ok=True)
+  return os.path.join(folder, 'key_cache.sqlite')
+
+def _connect() -> sqlite3.Connection:
+  # workers are separate processes, wait for each other's writes
+  connection = sqlite3.connect(get_key_cache_location(), timeout=30)
+  connection.execute('''
+    CREATE TABLE IF NOT EXISTS content_key (
+      pssh TEXT NOT NULL,
+      kid TEXT NOT NULL,
+      key TEXT NOT NULL,
+      created REAL NOT NULL,
+      PRIMARY KEY (pssh, kid)
+    )
+  ''')
+  connection.execute('CREATE INDEX IF NOT EXISTS content_key_kid ON content_key (kid)')
+  return connection
+
+def _get_pssh_kids(pssh: str) -> List[str]:
+  ''' :return: the KIDs listed in the PSSH, empty when they can't be read '''
+  try:
+    from pywidevine.pssh import PSSH
+    return [kid.hex for kid in PSSH(pssh).key_ids]
+  except Exception as error:
+    logger.debug(f'Could not read KIDs from PSSH: {error}')
+    return []
+
+def get_cached_keys(pssh: str) -> Dict[str, str]:
+  '''
+  Look up content keys obtained earlier for this PSSH, or for all KIDs in it.
+
+  :return: dict of {kid: key}, or None when the keys are not cached
+  '''
+  try:
+    with contextlib.closing(_connect()) as connection, connection:
+      rows = connection.execute('SELECT kid, key FROM content_key WHERE pssh = ?', (pssh,)).fetchall()
+      if len(rows) == 0:
+        # the same content can be signalled with a different PSSH
+        kids = _get_pssh_kids(pssh)
+        if len(kids) > 0:
+          rows = connection.execute(
+            f'SELECT DISTINCT kid, key FROM content_key WHERE kid IN ({",".join("?" * len(kids))})',
+            kids,
+          ).fetchall()
+          if len(set(kid for kid, _ in rows)) < len(set(kids)):
+            rows = []
+  except sqlite3.Error as error:
+    logger.warning(f'Could not read the key cache: {error}')
+    return None
+
+  if len(rows) == 0:
+    return None
+  keys = {kid: key for kid, key in rows}
+  logger.debug(f'Found {len(keys)} cached key(s) for PSSH {pssh}')
+  return keys
+
+def store_keys(pssh: str, keys: Dict[str, str]):
+  ''' Remember the content keys for this PSSH '''
+  if not keys:
+    return
+  try:
+    with contextlib.closing(_connect()) as connection, connection:
+      connection.executemany(
+        'INSERT OR REPLACE INTO content_key (pssh, kid, key, created) VALUES (?, ?, ?, ?)',
+        [(pssh, kid, key, time.time()) for kid, key in keys.items()],
+      )
+  except sqlite3.Error as error:
+    # the cache is only an optimization
+    logger.warning(f'Could not write to the key cache: {error}')
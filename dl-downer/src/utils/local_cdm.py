@@ -1,21 +1,89 @@
 import base64
 import os
+import threading
 from loguru import logger
 from pywidevine.cdm import Cdm
 from pywidevine.device import Device
 from pywidevine.pssh import PSSH
 
+class CdmManager():
+  '''
+  Process-wide owner of a CDM device: the .wvd file is parsed once and a
+  bounded pool of sessions is shared by every job in the process.
+
+  Sessions are handed out with acquire() and must be given back with
+  release(). They stay open and are reused, a new license simply
+  replaces the keys of the previous one.
+  '''
+
+  # the pywidevine Cdm refuses more sessions than this
+  MAX_SESSIONS = Cdm.MAX_NUM_OF_SESSIONS
+
+  def __init__(self, wvd_file: str, max_sessions: int = None):
+    logger.debug(f'Loading CDM device {wvd_file}')
+    self.device = Device.load(wvd_file)
+    self.cdm = Cdm.from_device(self.device)
+    if max_sessions is None:
+      max_sessions = int(os.getenv('DL_CDM_SESSIONS', '4'))
+    self.max_sessions = max(1, min(max_sessions, self.MAX_SESSIONS))
+    self.slots = threading.BoundedSemaphore(self.max_sessions)
+    self.lock = threading.Lock()
+    self.idle_sessions = []
+
+  def acquire(self, timeout: float = 120) -> bytes:
+    ''':return: the id of a session that is reserved for the caller'''
+    if not self.slots.acquire(timeout=timeout):
+      raise Exception(f'No CDM session became available within {timeout}s')
+    try:
+      with self.lock:
+        if len(self.idle_sessions) > 0:
+          return self.idle_sessions.pop()
+        return self.cdm.open()
+    except:
+      self.slots.release()
+      raise
+
+  def release(self, session_id: bytes, reusable: bool = True):
+    '''Give a session back, close it when it can't be reused (e.g. after an error)'''
+    with self.lock:
+      if reusable:
+        self.idle_sessions.append(session_id)
+      else:
+        self.cdm.close(session_id)
+    self.slots.release()
+
+_managers: dict[str, CdmManager] = {}
+_managers_lock = threading.Lock()
+
+def get_cdm_manager(wvd_file: str = None) -> CdmManager:
+  '''Get the CdmManager of the process for this device, loading the device on first use'''
+  if wvd_file is None:
+    wvd_file = os.getenv('CDM_FILE_PATH', './cdm/cdm.wvd')
+  with _managers_lock:
+    if wvd_file not in _managers:
+      _managers[wvd_file] = CdmManager(wvd_file)
+    return _managers[wvd_file]
+
 class Local_CDM():
   def __init__(self, wvd_file=None):
     '''
-    Create a cdm instance using pywidevine and a local .wvd file
+    Borrow a cdm session from the shared pool of the local .wvd device.
+    Always close() it, or use it as a context manager.
     '''
-    if wvd_file is None:
-      self.device = Device.load(os.getenv('CDM_FILE_PATH', './cdm/cdm.wvd'))
-    else:
-      self.device = Device.load(wvd_file)
-    self.cdm = Cdm.from_device(self.device)
-    self.session_id = self.cdm.open()
+    self.manager = get_cdm_manager(wvd_file)
+    self.device = self.manager.device
+    self.cdm = self.manager.cdm
+    self.session_id = self.manager.acquire()
+    self.failed = False
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is not None:
+      # don't hand out a session in an unknown state
+      self.failed = True
+    self.close()
 
   def generate_challenge(self, pssh_b64):
     '''
@@ -44,6 +112,9 @@ class Local_CDM():
 
   def close(self):
     '''
-    Close the cdm
+    Give the session back to the pool
     '''
-    self.cdm.close(self.session_id)
+    if self.session_id is None:
+      return
+    self.manager.release(self.session_id, reusable=not self.failed)
+    self.session_id = None
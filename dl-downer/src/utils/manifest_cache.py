@@ -0,0 +1,113 @@
+import contextlib
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from loguru import logger
+
+from .http_session import get_session
+from .job_metrics import metrics_stage, record_stage
+
+def get_manifest_max_age() -> float:
+  ''' Seconds a fetched manifest is used without asking the server whether it changed '''
+  return float(os.getenv('DL_MANIFEST_MAX_AGE', '60'))
+
+class ManifestCache:
+  '''
+  Manifests fetched during one job, so PSSH extraction, parsing and the
+  external tools all use the same copy instead of fetching it again.
+
+  A manifest older than DL_MANIFEST_MAX_AGE is revalidated with a
+  conditional request (ETag / Last-Modified), an unchanged manifest is not
+  transferred again.
+  '''
+
+  def __init__(self, folder: str):
+    self.folder = folder
+    self.lock = threading.Lock()
+    # url -> { text, etag, last_modified, fetched, file }
+    self.entries = {}
+
+  def get_text(self, url: str) -> str:
+    with self.lock:
+      entry = self.entries.get(url)
+      if entry is not None and time.time() - entry['fetched'] < get_manifest_max_age():
+        logger.debug(f'Using cached manifest {url}')
+        record_stage('manifest', 0, result='cached')
+        return entry['text']
+
+      headers = {}
+      if entry is not None:
+        if entry['etag'] is not None:
+          headers['If-None-Match'] = entry['etag']
+        if entry['last_modified'] is not None:
+          headers['If-Modified-Since'] = entry['last_modified']
+      with metrics_stage('manifest') as stage:
+        response = get_session().get(url, headers=headers, timeout=20)
+        stage.bytes = len(response.content)
+        stage.detail['result'] = 'not_modified' if response.status_code == 304 else 'fetched'
+      if entry is not None and response.status_code == 304:
+        logger.debug(f'Manifest not modified {url}')
+        entry['fetched'] = time.time()
+        return entry['text']
+      response.raise_for_status()
+
+      if entry is not None and entry['text'] != response.text:
+        # the local copy no longer matches
+        entry['file'] = None
+      self.entries[url] = {
+        'text': response.text,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'fetched': time.time(),
+        'file': entry['file'] if entry is not None else None,
+      }
+      return response.text
+
+  def get_file(self, url: str) -> str:
+    ''':return: path to a local copy of the manifest, or None when it wasn't fetched in this job'''
+    with self.lock:
+      entry = self.entries.get(url)
+      if entry is None:
+        return None
+      if entry['file'] is None:
+        os.makedirs(self.folder, exist_ok=True)
+        entry['file'] = os.path.join(self.folder, f'manifest-{str(uuid.uuid4())[:8]}.mpd')
+        with open(entry['file'], 'w', encoding='utf-8') as f:
+          f.write(entry['text'])
+      return entry['file']
+
+  def close(self):
+    shutil.rmtree(self.folder, ignore_errors=True)
+
+# The cache of the job this process is working on, shared by all its threads
+_current: ManifestCache = None
+
+@contextlib.contextmanager
+def job_manifest_cache():
+  '''Cache manifests for the duration of a job, local copies are removed afterwards'''
+  global _current
+  _current = ManifestCache(os.path.join('./tmp', 'manifests', str(uuid.uuid4())[:8]))
+  try:
+    yield _current
+  finally:
+    _current.close()
+    _current = None
+
+def get_manifest(url: str) -> str:
+  ''':return: the manifest text, fetched at most once per job'''
+  if _current is None:
+    with metrics_stage('manifest', result='fetched') as stage:
+      response = get_session().get(url, timeout=20)
+      stage.bytes = len(response.content)
+    response.raise_for_status()
+    return response.text
+  return _current.get_text(url)
+
+def get_manifest_file(url: str) -> str:
+  ''':return: path to a local copy of a manifest fetched in this job, or None'''
+  if _current is None:
+    return None
+  return _current.get_file(url)
@@ -0,0 +1,78 @@
+import os
+import select
+import time
+import psycopg2.extensions
+from loguru import logger
+
+from .setup_db_pool import create_db_connection
+
+# Must match the channel used by the dl.notify_dl_request_pending() trigger
+DL_REQUEST_PENDING_CHANNEL = 'dl_request_pending'
+
+class PendingRequestListener:
+  '''
+  Blocks until Postgres signals a new pending download request.
+
+  Uses LISTEN/NOTIFY on a dedicated connection, waiting on the connection
+  socket instead of querying the table. When the connection can't be set up
+  (or breaks), it falls back to plain polling.
+  '''
+
+  def __init__(self):
+    self.conn = None
+    # Wake up every so often anyway, so a missed notification never stalls the queue
+    self.fallback_interval = int(os.getenv('DL_NOTIFY_FALLBACK_INTERVAL', '900'))
+    self.poll_interval = int(os.getenv('DL_POLL_INTERVAL', '60'))
+
+  def listen(self):
+    ''' Start listening, must happen before checking the queue to not miss notifications '''
+    try:
+      conn = create_db_connection()
+      conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+      cursor = conn.cursor()
+      cursor.execute(f'LISTEN {DL_REQUEST_PENDING_CHANNEL}')
+      cursor.close()
+      self.conn = conn
+      logger.debug(f'Listening for notifications on {DL_REQUEST_PENDING_CHANNEL}')
+    except Exception as e:
+      logger.warning(f'Could not listen for notifications, falling back to polling: {e}')
+      self.close()
+
+  def wait(self) -> bool:
+    '''
+    Wait for a notification or until the fallback interval expires.
+
+    :return: True if woken up by a notification
+    '''
+    if self.conn is None:
+      self.listen()
+      # (Re)connected: check the queue first, requests may have arrived in the meantime
+      if self.conn is not None:
+        return False
+      time.sleep(self.poll_interval)
+      return False
+
+    try:
+      # Notifications that arrived while we were busy are already queued
+      self.conn.poll()
+      if not self.conn.notifies:
+        readable, _, _ = select.select([self.conn], [], [], self.fallback_interval)
+        if not readable:
+          return False
+        self.conn.poll()
+      notified = len(self.conn.notifies) > 0
+      self.conn.notifies.clear()
+      return notified
+    except Exception as e:
+      logger.warning(f'Notification connection lost, reconnecting: {e}')
+      self.close()
+      time.sleep(self.poll_interval)
+      return False
+
+  def close(self):
+    if self.conn is not None:
+      try:
+        self.conn.close()
+      except Exception:
+        pass
+    self.conn = None
@@ -0,0 +1,125 @@
+import json
+import os
+import time
+import urllib.parse
+
+import requests
+from loguru import logger
+
+from ..models.dl_request_platform import DLRequestPlatform
+from .browser import get_jwt_expiry, get_storage_state_cookies, get_token_expiry_margin
+from .http_session import get_session
+
+PLAY_CONFIG_URL_PART = 'videoplayer-service.dpgmedia.net/play-config/'
+
+# headers that belong to one specific request or are rebuilt when replaying
+SKIPPED_HEADERS = ['cookie', 'content-length', 'host', 'connection', 'accept-encoding']
+
+def get_play_config_request_location(platform: DLRequestPlatform) -> str:
+  p = os.getenv('STORAGE_STATES_FOLDER', './storage_states')
+  os.makedirs(p, exist_ok=True)
+  return os.path.join(p, f'{platform.value}-play-config.json')
+
+def get_page_asset_id(video_page_url: str) -> str:
+  ''' The asset id is the last part of the video page path, e.g. .../afspelen/e1234-abcd '''
+  return urllib.parse.urlparse(video_page_url).path.rstrip('/').split('/')[-1]
+
+def save_play_config_request(
+  platform: DLRequestPlatform,
+  video_page_url: str,
+  request,
+):
+  '''
+  Remember how the browser requested the play-config, so it can be replayed
+  for other assets without a browser.
+
+  :param request: the playwright Request of the play-config call
+  '''
+  try:
+    headers = request.all_headers()
+  except Exception:
+    headers = request.headers
+  play_config_request = {
+    'url': request.url,
+    'method': request.method,
+    'headers': headers,
+    'post_data': request.post_data,
+    'page_asset_id': get_page_asset_id(video_page_url),
+  }
+  with open(get_play_config_request_location(platform), 'w') as f:
+    json.dump(play_config_request, f)
+  logger.debug(f'Saved play-config request of {platform.value}')
+
+def _cookie_matches_host(cookie: dict, host: str) -> bool:
+  domain = cookie.get('domain', '').lstrip('.')
+  return host == domain or host.endswith(f'.{domain}')
+
+def resolve_play_config(
+  platform: DLRequestPlatform,
+  video_page_url: str,
+) -> dict:
+  '''
+  Get the play-config of a video straight from the API, by replaying the
+  request the browser made last time with the new asset id and the stored
+  session.
+
+  :return: the play-config, or None when the browser is needed
+    (nothing captured yet, the session is no longer accepted or the request failed)
+  '''
+  location = get_play_config_request_location(platform)
+  if not os.path.isfile(location):
+    return None
+  with open(location, 'r') as f:
+    play_config_request = json.load(f)
+
+  # only replay when the asset id of the page is visibly part of the play-config url
+  url = urllib.parse.urlparse(play_config_request['url'])
+  previous_asset_id = play_config_request['page_asset_id']
+  if not previous_asset_id or previous_asset_id not in url.path:
+    logger.debug('Play-config url does not contain the page asset id, using the browser')
+    return None
+  url = url._replace(path=url.path.replace(previous_asset_id, get_page_asset_id(video_page_url)))
+
+  headers = {}
+  deadline = time.time() + get_token_expiry_margin()
+  for name, value in play_config_request['headers'].items():
+    if name.startswith(':') or name.lower() in SKIPPED_HEADERS:
+      continue
+    # don't bother sending a token that is (almost) expired
+    expiry = get_jwt_expiry(value.split(' ')[-1])
+    if expiry is not None and expiry < deadline:
+      logger.debug(f'Stored {name} token is expired, using the browser')
+      return None
+    headers[name] = value
+  cookies = [c for c in get_storage_state_cookies(platform) if _cookie_matches_host(c, url.hostname)]
+  if len(cookies) > 0:
+    headers['cookie'] = '; '.join(f'{c["name"]}={c["value"]}' for c in cookies)
+
+  logger.debug(f'Requesting play-config without browser: {url.geturl()}')
+  try:
+    response = get_session().request(
+      play_config_request['method'],
+      url.geturl(),
+      headers=headers,
+      data=play_config_request['post_data'],
+      timeout=20,
+    )
+  except requests.RequestException as e:
+    logger.warning(f'Play-config request failed, using the browser: {e}')
+    return None
+  if 400 <= response.status_code < 500:
+    logger.info(f'Play-config request was refused ({response.status_code}), using the browser')
+    return None
+  if response.status_code >= 500:
+    logger.warning(f'Play-config request failed ({response.status_code}), using the browser')
+    return None
+
+  try:
+    config = response.json()
+  except ValueError:
+    logger.warning(f'Play-config response is not JSON, using the browser: {response.text[:200]}')
+    return None
+  if not isinstance(config, dict) or 'video' not in config:
+    logger.warning(f'Unexpected play-config response, using the browser: {config}')
+    return None
+  return config
@@ -1,9 +1,10 @@
-import psycopg2.pool 
+import psycopg2
+import psycopg2.pool
 import os
 from loguru import logger
 
-def setup_db_pool() -> psycopg2.pool.SimpleConnectionPool:
-  ''' Set up a connection pool for the database '''
+def get_db_connection_kwargs() -> dict:
+  ''' Connection parameters for the database, read from the environment '''
 
   # Make sure all env variables are set
   assert os.getenv('POSTGRES_USERNAME') is not None
@@ -12,15 +13,20 @@ def setup_db_pool() -> psycopg2.pool.SimpleConnectionPool:
   assert os.getenv('POSTGRES_PORT') is not None
   assert os.getenv('POSTGRES_DATABASE') is not None
 
-  # Create a connection pool with a minimum of 2 connections and 
-  #a maximum of 3 connections 
-  pool = psycopg2.pool.SimpleConnectionPool(0, 2,
-    user=os.getenv('POSTGRES_USERNAME'),
-    password=os.getenv('POSTGRES_PASSWORD'), 
-    host=os.getenv('POSTGRES_HOST'),
-    port=os.getenv('POSTGRES_PORT'),
-    database=os.getenv('POSTGRES_DATABASE')
-  )
+  return {
+    'user': os.getenv('POSTGRES_USERNAME'),
+    'password': os.getenv('POSTGRES_PASSWORD'),
+    'host': os.getenv('POSTGRES_HOST'),
+    'port': os.getenv('POSTGRES_PORT'),
+    'database': os.getenv('POSTGRES_DATABASE'),
+  }
+
+def setup_db_pool() -> psycopg2.pool.SimpleConnectionPool:
+  ''' Set up a connection pool for the database '''
+
+  # Create a connection pool with a minimum of 0 connections and
+  # a maximum of 2 connections
+  pool = psycopg2.pool.SimpleConnectionPool(0, 2, **get_db_connection_kwargs())
 
   # Test the connection pool
   conn = pool.getconn()
@@ -31,6 +37,9 @@ def setup_db_pool() -> psycopg2.pool.SimpleConnectionPool:
   pool.putconn(conn)
 
   logger.info('Database connection pool created')
-  
+
   return pool
-  
\ No newline at end of file
+
+def create_db_connection():
+  ''' Open a standalone database connection, outside of any pool '''
+  return psycopg2.connect(**get_db_connection_kwargs())
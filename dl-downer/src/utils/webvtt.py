@@ -0,0 +1,69 @@
+import html
+import re
+
+# Optional hours, like 01:02:03.456 or 02:03.456
+TIMESTAMP_RE = re.compile(r'^(?:(\d+):)?(\d{2}):(\d{2})[.,](\d{3})$')
+# Tags SRT players understand, all other WebVTT tags (<c.class>, <v name>, <lang>, <ruby>, <00:00:01.000>, ...) are dropped
+KEPT_TAGS_RE = re.compile(r'^</?[biu]>$')
+TAG_RE = re.compile(r'<[^>]*>')
+
+def parse_timestamp(timestamp: str) -> int:
+  ''':return: the timestamp in milliseconds'''
+  match = TIMESTAMP_RE.match(timestamp.strip())
+  if match is None:
+    raise Exception(f'Invalid WebVTT timestamp: {timestamp}')
+  hours, minutes, seconds, millis = match.groups()
+  return ((int(hours or 0) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + int(millis)
+
+def format_srt_timestamp(millis: int) -> str:
+  hours, millis = divmod(millis, 3600000)
+  minutes, millis = divmod(millis, 60000)
+  seconds, millis = divmod(millis, 1000)
+  return f'{hours:02d}:{minutes:02d}:{seconds:02d},{millis:03d}'
+
+def convert_cue_text(line: str) -> str:
+  line = TAG_RE.sub(lambda m: m.group(0) if KEPT_TAGS_RE.match(m.group(0)) else '', line)
+  return html.unescape(line)
+
+def webvtt_to_srt(vtt: str) -> str:
+  '''
+  Converts WebVTT subtitles to SRT.
+  Cue settings, styling and metadata blocks are dropped, <b>, <i> and <u> are kept.
+  '''
+  blocks = re.split(r'\n[ \t]*\n', vtt.lstrip('\ufeff').replace('\r\n', '\n').replace('\r', '\n'))
+  cues = []
+  for block in blocks:
+    lines = block.strip('\n').split('\n')
+    # the header, NOTE, STYLE and REGION blocks don't have a timing line
+    timing_index = next((i for i, line in enumerate(lines[:2]) if '-->' in line), None)
+    if timing_index is None:
+      continue
+    start, end = lines[timing_index].split('-->', 1)
+    # end time is followed by the cue settings
+    end = end.strip().split()[0]
+    text = [convert_cue_text(line) for line in lines[timing_index + 1:]]
+    text = [line for line in text if line.strip() != '']
+    if len(text) == 0:
+      continue
+    cues.append(
+      f'{len(cues) + 1}\n'
+      f'{format_srt_timestamp(parse_timestamp(start))} --> {format_srt_timestamp(parse_timestamp(end))}\n'
+      + '\n'.join(text) + '\n'
+    )
+  return '\n'.join(cues)
+
+def convert_webvtt_file(
+  vtt_file: str,
+  srt_file: str = None,
+) -> str:
+  '''
+  :param srt_file: defaults to the vtt file with the extension replaced
+  :return: the path to the srt file
+  '''
+  if srt_file is None:
+    srt_file = f'{vtt_file[:-4]}.srt'
+  with open(vtt_file, 'r', encoding='utf-8-sig') as f:
+    srt = webvtt_to_srt(f.read())
+  with open(srt_file, 'w', encoding='utf-8') as f:
+    f.write(srt)
+  return srt_file
@@ -1,2 +1,4 @@
 from src.server import start_server
-start_server()
+
+if __name__ == '__main__':
+  start_server()
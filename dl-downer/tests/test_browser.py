@@ -0,0 +1,179 @@
+import base64
+import json
+import time
+import pytest
+
+from src.models.dl_request_platform import DLRequestPlatform
+from src.utils import browser
+
+
+class FakePage:
+  def __init__(self, context):
+    self.context = context
+    self.closed = False
+
+  def close(self):
+    if not self.context.browser.connected:
+      raise Exception('Target closed')
+    self.closed = True
+
+
+class FakeContext:
+  def __init__(self, browser, platform):
+    self.browser = browser
+    self.platform = platform
+    self.closed = False
+
+  def new_page(self):
+    if not self.browser.connected:
+      raise Exception('Browser has been closed')
+    return FakePage(self)
+
+  def close(self):
+    self.closed = True
+
+
+class FakeBrowser:
+  def __init__(self):
+    self.connected = True
+
+  def is_connected(self):
+    return self.connected
+
+  def close(self):
+    self.connected = False
+
+
+@pytest.fixture(autouse=True)
+def fake_browser(monkeypatch):
+  launched = []
+  def launch():
+    launched.append(FakeBrowser())
+    return launched[-1]
+  monkeypatch.setattr(browser, '_launch_browser', launch)
+  monkeypatch.setattr(browser, '_create_context', lambda b, platform: FakeContext(b, platform))
+  monkeypatch.setattr(browser, 'attach_diagnostics_listeners', lambda page: None)
+  yield launched
+  browser.close_browser()
+
+
+class FakePlaywright:
+  def __init__(self):
+    self.stopped = False
+
+  def stop(self):
+    self.stopped = True
+
+
+class TestPlaywrightDriver:
+
+  def test_started_on_first_use_and_stopped(self, monkeypatch):
+    started = []
+    class FakeContextManager:
+      def start(self):
+        started.append(FakePlaywright())
+        return started[-1]
+    monkeypatch.setattr(browser, 'sync_playwright', FakeContextManager)
+    # importing the module doesn't start the driver
+    assert browser._playwright is None
+
+    driver = browser.get_playwright()
+    assert browser.get_playwright() is driver
+    assert len(started) == 1
+
+    browser.stop_playwright()
+    assert driver.stopped
+    assert browser._playwright is None
+    # started again when needed
+    assert browser.get_playwright() is not driver
+    browser.stop_playwright()
+
+
+class TestSharedBrowser:
+
+  def test_browser_and_context_are_reused(self, fake_browser):
+    lease, page = browser.create_playwright_page(DLRequestPlatform.VRTMAX)
+    lease.close()
+    assert page.closed
+    _, second_page = browser.create_playwright_page(DLRequestPlatform.VRTMAX)
+    assert len(fake_browser) == 1
+    assert second_page.context is page.context
+
+  def test_context_per_platform(self, fake_browser):
+    _, vrt_page = browser.create_playwright_page(DLRequestPlatform.VRTMAX)
+    _, goplay_page = browser.create_playwright_page(DLRequestPlatform.GOPLAY)
+    assert len(fake_browser) == 1
+    assert vrt_page.context is not goplay_page.context
+    assert goplay_page.context.platform == DLRequestPlatform.GOPLAY
+
+  def test_context_recycled_after_max_jobs(self, monkeypatch):
+    monkeypatch.setenv('DL_BROWSER_CONTEXT_MAX_JOBS', '2')
+    pages = []
+    for _ in range(3):
+      lease, page = browser.create_playwright_page(DLRequestPlatform.VTMGO)
+      lease.close()
+      pages.append(page)
+    assert pages[0].context is pages[1].context
+    assert pages[2].context is not pages[1].context
+    assert pages[1].context.closed
+
+  def test_crashed_browser_is_restarted(self, fake_browser):
+    lease, page = browser.create_playwright_page(DLRequestPlatform.STREAMZ)
+    fake_browser[0].connected = False
+    # closing a page of a crashed browser doesn't raise
+    lease.close()
+    _, page = browser.create_playwright_page(DLRequestPlatform.STREAMZ)
+    assert len(fake_browser) == 2
+    assert page.context.browser is fake_browser[1]
+
+
+def jwt(payload):
+  encode = lambda data: base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip('=')
+  return f'{encode({"alg": "none"})}.{encode(payload)}.signature'
+
+
+class TestTokenCache:
+
+  @pytest.fixture(autouse=True)
+  def storage_states_folder(self, tmp_path, monkeypatch):
+    monkeypatch.setenv('STORAGE_STATES_FOLDER', str(tmp_path))
+    return tmp_path
+
+  def write_cookies(self, folder, cookies):
+    (folder / f'{DLRequestPlatform.VRTMAX.value}.json').write_text(json.dumps({ 'cookies': cookies }))
+
+  def test_jwt_expiry(self):
+    assert browser.get_jwt_expiry(jwt({ 'exp': 1700000000 })) == 1700000000
+    assert browser.get_jwt_expiry(jwt({ 'sub': 'no expiry' })) is None
+    assert browser.get_jwt_expiry('not-a-jwt') is None
+
+  def test_cookie_expiry_is_earliest_of_cookie_and_jwt(self):
+    assert browser.get_cookie_expiry({ 'value': jwt({ 'exp': 2000 }), 'expires': 3000 }) == 2000
+    assert browser.get_cookie_expiry({ 'value': jwt({ 'exp': 2000 }), 'expires': 1000 }) == 1000
+    assert browser.get_cookie_expiry({ 'value': 'opaque', 'expires': -1 }) is None
+
+  def test_valid_token_returned(self, storage_states_folder):
+    token = jwt({ 'exp': time.time() + 3600 })
+    self.write_cookies(storage_states_folder, [
+      { 'name': 'other', 'value': 'x', 'expires': -1 },
+      { 'name': 'vrtnu-site_profile_vt', 'value': token, 'expires': -1 },
+    ])
+    cookie = browser.get_valid_token_cookie(DLRequestPlatform.VRTMAX, lambda c: c['name'] == 'vrtnu-site_profile_vt')
+    assert cookie['value'] == token
+
+  @pytest.mark.parametrize('cookie', [
+    # expires within the margin
+    { 'name': 'vrtnu-site_profile_vt', 'value': jwt({ 'exp': time.time() + 60 }), 'expires': -1 },
+    # cookie itself expired
+    { 'name': 'vrtnu-site_profile_vt', 'value': jwt({ 'exp': time.time() + 3600 }), 'expires': time.time() - 1 },
+    # unknown expiry
+    { 'name': 'vrtnu-site_profile_vt', 'value': 'opaque', 'expires': -1 },
+  ])
+  def test_invalid_token_needs_browser(self, storage_states_folder, cookie):
+    self.write_cookies(storage_states_folder, [cookie])
+    assert browser.get_valid_token_cookie(DLRequestPlatform.VRTMAX, lambda c: c['name'] == 'vrtnu-site_profile_vt') is None
+
+  def test_margin_is_configurable(self, storage_states_folder, monkeypatch):
+    monkeypatch.setenv('DL_TOKEN_EXPIRY_MARGIN', '30')
+    self.write_cookies(storage_states_folder, [{ 'name': 'vrtnu-site_profile_vt', 'value': jwt({ 'exp': time.time() + 60 }), 'expires': -1 }])
+    assert browser.get_valid_token_cookie(DLRequestPlatform.VRTMAX, lambda c: c['name'] == 'vrtnu-site_profile_vt') is not None
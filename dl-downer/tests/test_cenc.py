@@ -0,0 +1,149 @@
+import os
+import struct
+import pytest
+from Crypto.Cipher import AES
+
+from src.mpd.cenc import CencDecryptor
+from src.mpd.mp4_boxes import iter_boxes, find_box
+
+
+KID = '0123456789abcdef0123456789abcdef'
+KEY = 'fedcba9876543210fedcba9876543210'
+TRACK_ID = 1
+SAMPLE_SIZES = [100, 250, 37, 16]
+CONSTANT_IV = bytes(range(16))
+
+
+def box(box_type, payload):
+  return struct.pack('>I4s', 8 + len(payload), box_type.encode()) + payload
+
+
+def full_box(box_type, version, flags, payload):
+  return box(box_type, struct.pack('>I', (version << 24) | flags) + payload)
+
+
+def build_init(scheme):
+  if scheme == 'cenc':
+    tenc = full_box('tenc', 0, 0, bytes([0, 0, 1, 8]) + bytes.fromhex(KID))
+  else:
+    # 1:9 pattern, constant IV
+    tenc = full_box('tenc', 1, 0, bytes([0, 0x19, 1, 0]) + bytes.fromhex(KID) + bytes([16]) + CONSTANT_IV)
+  sinf = box('sinf',
+    box('frma', b'avc1')
+    + full_box('schm', 0, 0, scheme.encode() + struct.pack('>I', 0x10000))
+    + box('schi', tenc)
+  )
+  encv = box('encv', bytes(78) + sinf)
+  stsd = full_box('stsd', 0, 0, struct.pack('>I', 1) + encv)
+  trak = box('trak',
+    full_box('tkhd', 0, 0, struct.pack('>III', 0, 0, TRACK_ID) + bytes(68))
+    + box('mdia', box('minf', box('stbl', stsd)))
+  )
+  mvex = box('mvex', full_box('trex', 0, 0, struct.pack('>IIIII', TRACK_ID, 1, 0, 0, 0)))
+  pssh = full_box('pssh', 0, 0, bytes(16) + struct.pack('>I', 0))
+  return box('ftyp', b'isom' + bytes(4)) + box('moov', full_box('mvhd', 0, 0, bytes(96)) + trak + mvex + pssh)
+
+
+def encrypt_sample(scheme, key, sample, iv, subsamples):
+  data = bytearray(sample)
+  position = 0
+  if scheme == 'cenc':
+    cipher = AES.new(key, AES.MODE_CTR, nonce=b'', initial_value=iv.ljust(16, b'\x00'))
+    for clear_bytes, protected_bytes in subsamples:
+      position += clear_bytes
+      data[position:position + protected_bytes] = cipher.encrypt(bytes(data[position:position + protected_bytes]))
+      position += protected_bytes
+    return bytes(data)
+
+  # cbcs 1:9, the chain restarts at the IV for every subsample
+  for clear_bytes, protected_bytes in subsamples:
+    position += clear_bytes
+    previous = iv
+    for block in range(0, protected_bytes // 16, 10):
+      start = position + block * 16
+      encrypted = AES.new(key, AES.MODE_CBC, previous).encrypt(bytes(data[start:start + 16]))
+      data[start:start + 16] = encrypted
+      previous = encrypted
+    position += protected_bytes
+  return bytes(data)
+
+
+def build_segment(scheme, samples, with_subsamples=True):
+  '''
+  :param with_subsamples: when False, the senc has no subsample entries and complete samples are protected
+  '''
+  key = bytes.fromhex(KEY)
+  encrypted_samples = []
+  senc_entries = b''
+  for i, sample in enumerate(samples):
+    clear_bytes = min(len(sample), 5 if scheme == 'cbcs' else 10) if with_subsamples else 0
+    subsamples = [(clear_bytes, len(sample) - clear_bytes)]
+    iv = struct.pack('>Q', i + 1) if scheme == 'cenc' else CONSTANT_IV
+    encrypted_samples.append(encrypt_sample(scheme, key, sample, iv, subsamples))
+    if scheme == 'cenc':
+      senc_entries += iv
+    if with_subsamples:
+      senc_entries += struct.pack('>H', len(subsamples))
+      for clear, protected in subsamples:
+        senc_entries += struct.pack('>HI', clear, protected)
+
+  def moof(data_offset):
+    trun = full_box('trun', 0, 0x201, struct.pack('>Ii', len(samples), data_offset) + b''.join(struct.pack('>I', len(s)) for s in samples))
+    senc = full_box('senc', 0, 0x2 if with_subsamples else 0, struct.pack('>I', len(samples)) + senc_entries)
+    traf = box('traf', full_box('tfhd', 0, 0x20000, struct.pack('>I', TRACK_ID)) + trun + senc)
+    return box('moof', full_box('mfhd', 0, 0, struct.pack('>I', 1)) + traf)
+
+  moof_size = len(moof(0))
+  return moof(moof_size + 8) + box('mdat', b''.join(encrypted_samples))
+
+
+def mdat_payload(data):
+  mdat = find_box(data, ['mdat'])
+  return data[mdat.payload:mdat.end]
+
+
+class TestCencDecryptor:
+
+  @pytest.mark.parametrize('scheme', ['cenc', 'cbcs'])
+  def test_decrypts_segment(self, scheme):
+    samples = [os.urandom(size) for size in SAMPLE_SIZES]
+    segment = build_segment(scheme, samples)
+    assert mdat_payload(segment) != b''.join(samples)
+
+    decryptor = CencDecryptor({ KID: KEY })
+    decryptor.decrypt_init(build_init(scheme))
+    decrypted = decryptor.decrypt_segment(segment)
+
+    assert len(decrypted) == len(segment)
+    assert mdat_payload(decrypted) == b''.join(samples)
+    # the sample encryption info is hidden
+    assert find_box(decrypted, ['moof', 'traf', 'senc']) is None
+
+  @pytest.mark.parametrize('scheme', ['cenc', 'cbcs'])
+  def test_decrypts_samples_without_subsamples(self, scheme):
+    # for cbcs the 1:9 pattern of the track applies to the complete sample
+    samples = [os.urandom(size) for size in SAMPLE_SIZES + [16 * 25 + 3]]
+    segment = build_segment(scheme, samples, with_subsamples=False)
+    assert mdat_payload(segment) != b''.join(samples)
+
+    decryptor = CencDecryptor({ KID: KEY })
+    decryptor.decrypt_init(build_init(scheme))
+    assert mdat_payload(decryptor.decrypt_segment(segment)) == b''.join(samples)
+
+  def test_init_signalling_removed(self):
+    init = build_init('cenc')
+    decrypted = CencDecryptor({ KID: KEY }).decrypt_init(init)
+    assert len(decrypted) == len(init)
+    stsd = find_box(decrypted, ['moov', 'trak', 'mdia', 'minf', 'stbl', 'stsd'])
+    assert [entry.type for entry in iter_boxes(decrypted, stsd.payload + 8, stsd.end)] == ['avc1']
+    assert find_box(decrypted, ['moov', 'pssh']) is None
+
+  def test_missing_key_raises(self):
+    decryptor = CencDecryptor({ KID: KEY, '00' * 16: KEY })
+    with pytest.raises(Exception, match='No decryption key provided'):
+      decryptor.decrypt_init(build_init('cenc').replace(bytes.fromhex(KID), bytes(15) + b'\x01'))
+
+  def test_clear_segment_unchanged(self):
+    decryptor = CencDecryptor({ KID: KEY })
+    segment = build_segment('cenc', [b'x' * 32])
+    assert decryptor.decrypt_segment(segment) == segment
@@ -0,0 +1,83 @@
+import pytest
+
+from src.models.dl_request import DLRequest
+from src.models.dl_request_status import DLRequestStatus
+
+
+class FakePool:
+  def __init__(self, row=None, error=None):
+    self.row = row
+    self.error = error
+    self.executed = []
+    self.committed = False
+    self.rolled_back = False
+    self.returned = False
+
+  def getconn(self):
+    return self
+
+  def putconn(self, conn):
+    self.returned = True
+
+  def cursor(self):
+    return self
+
+  def execute(self, query, params):
+    if self.error is not None:
+      raise self.error
+    self.executed.append((' '.join(query.split()), params))
+
+  def fetchone(self):
+    return self.row
+
+  @property
+  def rowcount(self):
+    return 3
+
+  def commit(self):
+    self.committed = True
+
+  def rollback(self):
+    self.rolled_back = True
+
+  def close(self):
+    pass
+
+
+class TestClaimNextPending:
+
+  def test_claims_oldest_pending_skipping_locked_rows(self):
+    db = FakePool(row=(7, 'PENDING', 'GOPLAY', 'https://www.play.tv/video/x', None, None, None, 'best'))
+    dl_request = DLRequest.claim_next_pending(db)
+
+    query, params = db.executed[0]
+    assert query.startswith('UPDATE dl.dl_request SET status = %s')
+    assert 'WHERE status = %s ORDER BY created ASC LIMIT 1 FOR UPDATE SKIP LOCKED' in query
+    assert query.endswith('RETURNING *')
+    assert params == (DLRequestStatus.IN_PROGRESS.value, DLRequestStatus.PENDING.value)
+    assert db.committed and db.returned
+    assert dl_request.id == 7
+    assert dl_request.status == DLRequestStatus.IN_PROGRESS
+
+  def test_nothing_pending(self):
+    db = FakePool(row=None)
+    assert DLRequest.claim_next_pending(db) is None
+    assert db.committed and db.returned
+
+  def test_failure_rolls_back_and_returns_connection(self):
+    db = FakePool(error=RuntimeError('connection lost'))
+    with pytest.raises(RuntimeError):
+      DLRequest.claim_next_pending(db)
+    assert db.rolled_back and db.returned
+    assert not db.committed
+
+
+class TestRequeueInProgress:
+
+  def test_in_progress_back_to_pending(self):
+    db = FakePool()
+    assert DLRequest.requeue_in_progress(db) == 3
+    query, params = db.executed[0]
+    assert query == 'UPDATE dl.dl_request SET status = %s, updated = NOW() WHERE status = %s'
+    assert params == (DLRequestStatus.PENDING.value, DLRequestStatus.IN_PROGRESS.value)
+    assert db.committed and db.returned
@@ -0,0 +1,93 @@
+import importlib.metadata
+import os
+import subprocess
+import sys
+import pytest
+
+from src.models.dl_request_platform import DLRequestPlatform
+from src.utils import downloader_registry
+from src.utils.downloader_registry import DownloaderPlugin, get_downloader, get_downloader_for_url
+from src.utils.get_platform_for_url import get_platform_for_url
+
+
+PLUGIN_MODULE = '''
+from src.utils.downloader_registry import DownloaderPlugin
+
+plugin = DownloaderPlugin('EXAMPLE', 'example_downloader:EXAMPLE_DL', ['example.com'])
+'''
+
+DOWNLOADER_MODULE = '''
+def EXAMPLE_DL(dl_request):
+  return 'downloaded'
+'''
+
+
+@pytest.fixture
+def installed_plugin(tmp_path, monkeypatch):
+  ''' A third party package registering a downloader through an entry point '''
+  (tmp_path / 'example_plugin.py').write_text(PLUGIN_MODULE)
+  (tmp_path / 'example_downloader.py').write_text(DOWNLOADER_MODULE)
+  monkeypatch.syspath_prepend(str(tmp_path))
+  entry_points = [
+    importlib.metadata.EntryPoint('EXAMPLE', 'example_plugin:plugin', downloader_registry.ENTRY_POINT_GROUP),
+    importlib.metadata.EntryPoint('BROKEN', 'missing_module:plugin', downloader_registry.ENTRY_POINT_GROUP),
+  ]
+  monkeypatch.setattr(importlib.metadata, 'entry_points', lambda group: [e for e in entry_points if e.group == group])
+  monkeypatch.setattr(downloader_registry, '_installed_downloaders', None)
+  yield
+  sys.modules.pop('example_plugin', None)
+  sys.modules.pop('example_downloader', None)
+
+
+class TestDownloaderRegistry:
+
+  @pytest.mark.parametrize('url, platform', [
+    ('https://www.vrt.be/vrtmax/a-z/x/', DLRequestPlatform.VRTMAX.value),
+    ('https://www.goplay.be/video/x', DLRequestPlatform.GOPLAY.value),
+    ('https://www.play.tv/video/x', DLRequestPlatform.GOPLAY.value),
+    ('https://www.vtmgo.be/vtmgo/afspelen/x', DLRequestPlatform.VTMGO.value),
+    ('https://www.streamz.be/streamz/afspelen/x', DLRequestPlatform.STREAMZ.value),
+    ('https://www.example.org/video', DLRequestPlatform.UNKNOWN),
+  ])
+  def test_platform_for_url(self, url, platform, monkeypatch):
+    monkeypatch.setattr(downloader_registry, '_installed_downloaders', [])
+    assert get_platform_for_url(url) == platform
+
+  def test_builtin_downloader(self):
+    plugin = get_downloader(DLRequestPlatform.YOUTUBE.value)
+    from src.downloaders.YOUTUBE import YOUTUBE_DL
+    assert plugin.load() is YOUTUBE_DL
+
+  def test_unknown_platform(self, monkeypatch):
+    monkeypatch.setattr(downloader_registry, '_installed_downloaders', [])
+    assert get_downloader('NOPE') is None
+
+  def test_installed_downloader(self, installed_plugin):
+    plugin = get_downloader_for_url('https://www.example.com/video/1')
+    assert plugin.platform == 'EXAMPLE'
+    assert get_downloader('EXAMPLE') is plugin
+    # the download function is only imported when it is needed
+    assert 'example_downloader' not in sys.modules
+    assert plugin.load()(None) == 'downloaded'
+    # the broken entry point is skipped
+    assert [p.platform for p in downloader_registry.load_installed_downloaders()] == ['EXAMPLE']
+
+  def test_builtin_platforms_come_first(self, installed_plugin):
+    assert get_downloader_for_url('https://www.vrt.be/vrtmax/').platform == DLRequestPlatform.VRTMAX.value
+
+  def test_youtube_worker_does_not_import_drm_dependencies(self):
+    code = (
+      'import sys\n'
+      'import src.server\n'
+      'from src.utils.downloader_registry import get_downloader\n'
+      'get_downloader("YOUTUBE").load()\n'
+      'print(" ".join(m for m in ["playwright", "pywidevine"] if m in sys.modules))\n'
+    )
+    result = subprocess.run(
+      [sys.executable, '-c', code],
+      cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+      capture_output=True,
+      text=True,
+      check=True,
+    )
+    assert result.stdout.strip() == ''
@@ -0,0 +1,199 @@
+import os
+import subprocess
+import pytest
+
+from src.utils import files
+from src.utils.files import MuxPlan, concat_files, insert_subtitles, move_file
+
+
+def directory_size(path):
+  return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def fake_ffmpeg_concat(peak_sizes, watched_dir):
+  '''Stands in for ffmpeg: writes the output from the concat list, recording the disk usage'''
+  def run(command, check=False):
+    list_file = command[command.index('-i') + 1]
+    with open(list_file) as f:
+      inputs = [line.strip()[len("file '"):-1] for line in f if line.strip()]
+    with open(command[-1], 'wb') as out:
+      for input_file in inputs:
+        assert os.path.isabs(input_file)
+        with open(input_file, 'rb') as f:
+          out.write(f.read())
+        peak_sizes.append(directory_size(watched_dir))
+    return subprocess.CompletedProcess(command, 0)
+  return run
+
+
+class TestMuxPlan:
+
+  def test_single_command_for_all_inputs(self, tmp_path):
+    plan = MuxPlan(str(tmp_path))
+    plan.add_track([str(tmp_path / 'audio-0.mp4'), str(tmp_path / 'audio-1.mp4')])
+    plan.add_track([str(tmp_path / 'video-0.mp4')])
+    plan.add_subtitle(str(tmp_path / 'subs.vtt'), language='nld')
+    command = plan.build_command(str(tmp_path / 'out.mkv'))
+
+    assert command.count('ffmpeg') == 1
+    assert command.count('-i') == 3
+    # the concat demuxer reads the original files, by absolute path
+    concat_list = command[command.index('concat') + 4]
+    assert open(concat_list).read() == f"file '{tmp_path}/audio-0.mp4'\nfile '{tmp_path}/audio-1.mp4'\n"
+    assert command[command.index('-safe') + 1] == '0'
+    assert command.index('-safe') < command.index('-i')
+    # every stream of every input is kept
+    assert [command[i + 1] for i, arg in enumerate(command) if arg == '-map'] == ['0', '1', '2']
+    assert command[command.index('-c:s:0') + 1] == 'srt'
+    assert 'language=nld' in command
+    assert command[-1] == str(tmp_path / 'out.mkv')
+
+  def test_mp4_output_uses_mov_text(self, tmp_path):
+    plan = MuxPlan(str(tmp_path))
+    plan.add_track(['video.mp4'])
+    plan.add_subtitle('subs.srt')
+    command = plan.build_command('out.mp4')
+    assert command[command.index('-c:s:0') + 1] == 'mov_text'
+
+  def test_quotes_are_escaped_in_concat_list(self, tmp_path):
+    plan = MuxPlan(str(tmp_path))
+    plan.add_track(["/videos/it's.mp4", '/videos/b.mp4'])
+    command = plan.build_command('out.mkv')
+    concat_list = command[command.index('concat') + 4]
+    assert open(concat_list).read().splitlines()[0] == "file '/videos/it'\\''s.mp4'"
+
+
+  def test_added_subtitles_before_existing_ones(self, tmp_path):
+    plan = MuxPlan(str(tmp_path))
+    plan.add_track(['video.mkv'], subtitle_streams=True)
+    plan.add_subtitle('nl.srt', language='nl')
+    command = plan.build_command('out.mkv')
+    # the language applies to the first subtitle stream, the added one
+    assert [command[i + 1] for i, arg in enumerate(command) if arg == '-map'] == ['0', '-0:s', '1', '0:s?']
+    assert command[command.index('-metadata:s:s:0') + 1] == 'language=nl'
+    # only the added subtitle is converted, the existing ones are copied
+    assert command[command.index('-c:s:0') + 1] == 'srt'
+    assert not any(arg.startswith('-c:s') and arg != '-c:s:0' for arg in command)
+    assert command[command.index('-c') + 1] == 'copy'
+
+
+class TestInsertSubtitles:
+
+  def test_one_command_for_all_subtitles(self, tmp_path, monkeypatch):
+    commands = []
+    def run(command, check=False):
+      commands.append(command)
+      # the vtt is converted before ffmpeg runs
+      assert os.path.exists(tmp_path / 'en.srt')
+      with open(command[-1], 'wb') as f:
+        f.write(b'subbed')
+      return subprocess.CompletedProcess(command, 0)
+    monkeypatch.setattr(subprocess, 'run', run)
+    video = tmp_path / 'video.mkv'
+    video.write_bytes(b'video')
+    (tmp_path / 'nl.srt').write_text('1\n00:00:01,000 --> 00:00:02,000\nHallo\n')
+    (tmp_path / 'en.vtt').write_text('WEBVTT\n\n00:01.000 --> 00:02.000\nHello\n')
+
+    insert_subtitles(str(video), [(str(tmp_path / 'nl.srt'), 'nl'), (str(tmp_path / 'en.vtt'), 'en')])
+
+    assert len(commands) == 1
+    assert commands[0].count('-i') == 3
+    assert str(tmp_path / 'en.srt') in commands[0]
+    assert 'language=en' in commands[0]
+    assert video.read_bytes() == b'subbed'
+    # converted and temporary files are removed
+    assert sorted(os.listdir(tmp_path)) == ['en.vtt', 'nl.srt', 'video.mkv']
+
+
+class TestConcatFiles:
+
+  def test_inputs_are_not_copied(self, tmp_path, monkeypatch):
+    inputs = []
+    for i in range(3):
+      path = tmp_path / f'period-{i}.mp4'
+      path.write_bytes(bytes([i]) * 1024 * 1024)
+      inputs.append(str(path))
+    input_size = directory_size(tmp_path)
+
+    peak_sizes = []
+    monkeypatch.setattr(subprocess, 'run', fake_ffmpeg_concat(peak_sizes, tmp_path))
+    out_file = tmp_path / 'combined.mp4'
+    concat_files(inputs, str(out_file))
+
+    assert out_file.read_bytes() == b''.join(open(f, 'rb').read() for f in inputs)
+    # inputs + output (+ the tiny concat list), never a copy of the inputs
+    assert max(peak_sizes) <= input_size + out_file.stat().st_size + 4096
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['combined.mp4', 'period-0.mp4', 'period-1.mp4', 'period-2.mp4']
+
+  def test_concat_list_removed_on_failure(self, tmp_path, monkeypatch):
+    def fail(command, check=False):
+      raise subprocess.CalledProcessError(1, command)
+    monkeypatch.setattr(subprocess, 'run', fail)
+    with pytest.raises(subprocess.CalledProcessError):
+      concat_files([str(tmp_path / 'a.mp4')], str(tmp_path / 'out.mp4'))
+    assert list(tmp_path.iterdir()) == []
+
+
+class TestMoveFile:
+
+  def test_same_filesystem_is_a_rename(self, tmp_path):
+    src = tmp_path / 'tmp' / 'video.mkv'
+    src.parent.mkdir()
+    src.write_bytes(b'video')
+    inode = src.stat().st_ino
+    dst = tmp_path / 'library' / 'show' / 'video.mkv'
+
+    move_file(str(src), str(dst))
+    assert not src.exists()
+    assert dst.read_bytes() == b'video'
+    assert dst.stat().st_ino == inode
+
+  @pytest.mark.parametrize('copy_methods', [['copy_file_range', 'sendfile'], ['sendfile'], []])
+  def test_other_filesystem_copies_atomically(self, tmp_path, monkeypatch, copy_methods):
+    monkeypatch.setattr(files, 'is_same_filesystem', lambda *args: False)
+    monkeypatch.setattr(files, 'MOVE_CHUNK_SIZE', 1000)
+    for method in ['copy_file_range', 'sendfile']:
+      if method not in copy_methods:
+        monkeypatch.delattr(os, method, raising=False)
+    content = os.urandom(10 * 1000 + 123)
+    src = tmp_path / 'video.mkv'
+    src.write_bytes(content)
+    dst = tmp_path / 'library' / 'video.mkv'
+
+    move_file(str(src), str(dst))
+    assert not src.exists()
+    assert dst.read_bytes() == content
+    assert os.listdir(dst.parent) == ['video.mkv']
+
+  def test_failed_copy_leaves_no_partial_file(self, tmp_path, monkeypatch):
+    monkeypatch.setattr(files, 'is_same_filesystem', lambda *args: False)
+    def fail(*args):
+      raise OSError('disk full')
+    monkeypatch.setattr(files, 'copy_file_data', fail)
+    src = tmp_path / 'video.mkv'
+    src.write_bytes(b'video')
+    dst = tmp_path / 'library' / 'video.mkv'
+
+    with pytest.raises(OSError):
+      move_file(str(src), str(dst))
+    assert src.read_bytes() == b'video'
+    assert os.listdir(dst.parent) == []
+
+  def test_falls_back_when_copy_file_range_stops(self, tmp_path, monkeypatch):
+    monkeypatch.setattr(files, 'is_same_filesystem', lambda *args: False)
+    monkeypatch.setattr(files, 'MOVE_CHUNK_SIZE', 1000)
+    calls = []
+    def copy_file_range(src_fd, dst_fd, count, offset_src, offset_dst):
+      calls.append(count)
+      if len(calls) > 3:
+        raise OSError(18, 'Invalid cross-device link')
+      os.pwrite(dst_fd, os.pread(src_fd, count, offset_src), offset_dst)
+      return count
+    monkeypatch.setattr(os, 'copy_file_range', copy_file_range, raising=False)
+    content = os.urandom(10 * 1000 + 123)
+    src = tmp_path / 'video.mkv'
+    src.write_bytes(content)
+    dst = tmp_path / 'library' / 'video.mkv'
+
+    move_file(str(src), str(dst))
+    assert dst.read_bytes() == content
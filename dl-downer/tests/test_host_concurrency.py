@@ -0,0 +1,143 @@
+import threading
+import time
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.mpd.segment_download import fetch_segment
+from src.utils.host_concurrency import HostConcurrency, get_host_concurrency, parse_retry_after
+
+
+class FakeClock:
+  def __init__(self):
+    self.now = 100.0
+
+  def __call__(self):
+    return self.now
+
+
+@pytest.fixture
+def limiter():
+  limiter = HostConcurrency('cdn.example.com', initial_limit=4, max_limit=8)
+  limiter.clock = FakeClock()
+  limiter.interval_start = limiter.clock()
+  return limiter
+
+
+def run_interval(limiter, size, latency=0.01):
+  ''' Complete one request per slot during one adjust interval '''
+  slots = int(limiter.limit)
+  for _ in range(slots):
+    limiter.acquire()
+  for _ in range(slots - 1):
+    limiter.on_success(size, latency)
+    limiter.release()
+  # the last one closes the interval
+  limiter.clock.now += 1
+  limiter.on_success(size, latency)
+  limiter.release()
+
+
+class TestHostConcurrency:
+
+  def test_increases_while_throughput_improves(self, limiter):
+    run_interval(limiter, 1000)
+    assert limiter.limit == 5
+    run_interval(limiter, 2000)
+    assert limiter.limit == 6
+    # no improvement, keep the limit
+    run_interval(limiter, 2000 * 5 / 6 + 1)
+    assert limiter.limit == 6
+
+  def test_never_above_max(self, limiter):
+    for i in range(10):
+      run_interval(limiter, 1000 * (i + 1))
+    assert limiter.limit == 8
+
+  def test_backs_off_on_rising_latency(self, limiter):
+    run_interval(limiter, 1000, latency=0.01)
+    for _ in range(5):
+      limiter.on_success(0, 1.0)
+    limiter.clock.now += 1
+    limiter.on_success(0, 1.0)
+    assert limiter.limit == 5 * 0.75
+
+  def test_throttled_halves_once_per_burst(self, limiter):
+    limiter.on_throttled(429)
+    limiter.on_throttled(503)
+    assert limiter.limit == 2
+    limiter.clock.now += 1
+    limiter.on_throttled(503)
+    assert limiter.limit == 1
+    limiter.on_throttled(503)
+    limiter.clock.now += 1
+    limiter.on_throttled(503)
+    assert limiter.limit == 1
+
+  def test_retry_after_pauses_requests(self):
+    limiter = HostConcurrency('cdn.example.com')
+    limiter.on_throttled(429, 0.2)
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.15
+
+  def test_parse_retry_after(self):
+    assert parse_retry_after('3') == 3
+    assert parse_retry_after('3600') == 60
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after(None) is None
+
+  def test_limits_are_per_host_for_the_process(self):
+    assert get_host_concurrency('https://a.example.com/1.m4s') is get_host_concurrency('https://a.example.com/2.m4s')
+    assert get_host_concurrency('https://a.example.com/1.m4s') is not get_host_concurrency('https://b.example.com/1.m4s')
+
+
+requests_seen = []
+
+
+class ThrottlingHandler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):
+    requests_seen.append(self.path)
+    if requests_seen.count(self.path) == 1:
+      self.send_response(429)
+      self.send_header('Retry-After', '0')
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return
+    body = b'segment'
+    self.send_response(200)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+
+@pytest.fixture
+def throttling_server_url():
+  server = ThreadingHTTPServer(('127.0.0.1', 0), ThrottlingHandler)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  yield f'http://127.0.0.1:{server.server_address[1]}'
+  server.shutdown()
+
+
+class TestFetchSegmentThrottling:
+
+  def test_throttled_segment_is_retried_with_lower_limit(self, throttling_server_url, monkeypatch):
+    monkeypatch.setattr(time, 'sleep', lambda _: None)
+    url = f'{throttling_server_url}/0.m4s'
+    limit = get_host_concurrency(url).limit
+    assert fetch_segment(0, url) == b'segment'
+    assert requests_seen == ['/0.m4s', '/0.m4s']
+    assert get_host_concurrency(url).limit == max(1, limit / 2)
+    assert get_host_concurrency(url).in_flight == 0
+
+  def test_retry_waits_without_holding_a_slot(self, throttling_server_url, monkeypatch):
+    url = f'{throttling_server_url}/1.m4s'
+    in_flight_while_sleeping = []
+    monkeypatch.setattr(time, 'sleep', lambda _: in_flight_while_sleeping.append(get_host_concurrency(url).in_flight))
+    assert fetch_segment(1, url) == b'segment'
+    assert in_flight_while_sleeping == [0]
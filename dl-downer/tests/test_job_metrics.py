@@ -0,0 +1,116 @@
+import json
+import subprocess
+import pytest
+
+from src.models.dl_request import DLRequest
+from src.utils import job_metrics
+from src.utils.files import MuxPlan
+from src.utils.job_metrics import job_metrics as metrics_of_job, metrics_stage, record_stage
+
+
+def dl_request(id=7):
+  return DLRequest(id, 'IN_PROGRESS', 'GOPLAY', 'https://www.play.tv/video/x', None, None, None, 'best')
+
+
+@pytest.fixture
+def metrics_file(tmp_path, monkeypatch):
+  path = tmp_path / 'metrics' / 'metrics.jsonl'
+  monkeypatch.setenv('DL_METRICS', 'jsonl')
+  monkeypatch.setenv('DL_METRICS_FILE', str(path))
+  return path
+
+
+class FakePool:
+  def __init__(self):
+    self.rows = None
+    self.committed = False
+
+  def getconn(self):
+    return self
+
+  def putconn(self, conn):
+    pass
+
+  def cursor(self):
+    return self
+
+  def executemany(self, query, rows):
+    assert 'dl.dl_request_metrics' in query
+    self.rows = rows
+
+  def commit(self):
+    self.committed = True
+
+  def rollback(self):
+    pass
+
+  def close(self):
+    pass
+
+
+class TestJobMetrics:
+
+  def test_nothing_recorded_outside_of_a_job(self, metrics_file):
+    with metrics_stage('segments') as stage:
+      stage.bytes = 100
+    record_stage('decrypt', 1.0)
+    assert not metrics_file.exists()
+
+  def test_stages_are_stored_as_json_lines(self, metrics_file):
+    for id in [1, 2]:
+      with metrics_of_job(dl_request(id)):
+        with metrics_stage('segments', representation='video=1') as stage:
+          stage.bytes = 5000000
+        record_stage('decrypt', 0.5, 5000000, tool='inline')
+
+    lines = metrics_file.read_text().splitlines()
+    assert len(lines) == 2
+    job = json.loads(lines[0])
+    assert job['dl_request_id'] == 1
+    assert job['platform'] == 'GOPLAY'
+    assert job['status'] == 'COMPLETED'
+    assert job['seconds'] >= 0
+    assert [s['stage'] for s in job['stages']] == ['segments', 'decrypt']
+    assert job['stages'][0]['detail'] == { 'representation': 'video=1' }
+    assert job['stages'][1]['mb_per_s'] == pytest.approx(10)
+
+  def test_failed_job_and_stage(self, metrics_file):
+    with pytest.raises(Exception, match='license server down'):
+      with metrics_of_job(dl_request()):
+        with metrics_stage('license'):
+          raise Exception('license server down')
+    job = json.loads(metrics_file.read_text())
+    assert job['status'] == 'FAILED'
+    assert job['stages'][0]['detail'] == { 'failed': True }
+
+  def test_ffmpeg_runs_are_recorded(self, tmp_path, metrics_file, monkeypatch):
+    def run(command, check=False):
+      with open(command[-1], 'wb') as f:
+        f.write(b'x' * 1000)
+      return subprocess.CompletedProcess(command, 0)
+    monkeypatch.setattr(subprocess, 'run', run)
+    with metrics_of_job(dl_request()) as metrics:
+      plan = MuxPlan(str(tmp_path))
+      plan.add_track(['video.mp4'])
+      plan.run(str(tmp_path / 'out.mkv'))
+      stage = metrics.to_dict()['stages'][0]
+    assert stage['stage'] == 'ffmpeg'
+    assert stage['bytes'] == 1000
+    assert stage['detail'] == { 'step': 'mux', 'inputs': 1 }
+
+  def test_stored_in_database(self, metrics_file, monkeypatch):
+    monkeypatch.setenv('DL_METRICS', 'db')
+    pool = FakePool()
+    with metrics_of_job(dl_request(), pool):
+      record_stage('move', 0.25, 1000)
+    assert pool.committed
+    assert [row[1] for row in pool.rows] == ['total', 'move']
+    assert json.loads(pool.rows[0][5]) == { 'platform': 'GOPLAY', 'status': 'COMPLETED' }
+    assert pool.rows[1][3:5] == (0.25, 1000)
+    assert not metrics_file.exists()
+
+  def test_off(self, metrics_file, monkeypatch):
+    monkeypatch.setenv('DL_METRICS', 'off')
+    with metrics_of_job(dl_request()):
+      record_stage('move', 0.25, 1000)
+    assert not metrics_file.exists()
@@ -0,0 +1,42 @@
+import pytest
+
+from src.utils import key_cache
+from src.utils.key_cache import get_cached_keys, store_keys
+
+
+PSSH = 'AAAAQ3Bzc2gAAAAA7e+LqXnWSs6jyCfc1R0h7QAAACMIARIQ'
+KEYS = {
+  '0123456789abcdef0123456789abcdef': 'fedcba9876543210fedcba9876543210',
+  '11111111111111111111111111111111': '22222222222222222222222222222222',
+}
+
+
+@pytest.fixture(autouse=True)
+def storage_states_folder(tmp_path, monkeypatch):
+  monkeypatch.setenv('STORAGE_STATES_FOLDER', str(tmp_path))
+  return tmp_path
+
+
+class TestKeyCache:
+
+  def test_miss(self):
+    assert get_cached_keys(PSSH) is None
+
+  def test_store_and_get(self, storage_states_folder):
+    store_keys(PSSH, KEYS)
+    assert get_cached_keys(PSSH) == KEYS
+    assert (storage_states_folder / 'key_cache.sqlite').is_file()
+
+  def test_lookup_by_kid(self, monkeypatch):
+    store_keys(PSSH, KEYS)
+    monkeypatch.setattr(key_cache, '_get_pssh_kids', lambda pssh: ['0123456789abcdef0123456789abcdef'])
+    assert get_cached_keys('other-pssh') == { '0123456789abcdef0123456789abcdef': 'fedcba9876543210fedcba9876543210' }
+
+  def test_lookup_by_kid_needs_all_kids(self, monkeypatch):
+    store_keys(PSSH, KEYS)
+    monkeypatch.setattr(key_cache, '_get_pssh_kids', lambda pssh: ['0123456789abcdef0123456789abcdef', 'ff' * 16])
+    assert get_cached_keys('other-pssh') is None
+
+  def test_empty_keys_not_stored(self):
+    store_keys(PSSH, {})
+    assert get_cached_keys(PSSH) is None
@@ -0,0 +1,63 @@
+import threading
+import pytest
+from Crypto.PublicKey import RSA
+from pywidevine.device import Device, DeviceTypes
+from pywidevine.license_protocol_pb2 import ClientIdentification, DrmCertificate, SignedDrmCertificate
+
+from src.utils.local_cdm import CdmManager, Local_CDM, get_cdm_manager
+
+
+@pytest.fixture(scope='module')
+def wvd_file(tmp_path_factory):
+  certificate = SignedDrmCertificate(drm_certificate=DrmCertificate(system_id=1234).SerializeToString())
+  device = Device(
+    type_=DeviceTypes.ANDROID,
+    security_level=3,
+    flags=None,
+    private_key=RSA.generate(2048).export_key(),
+    client_id=ClientIdentification(type=ClientIdentification.DRM_DEVICE_CERTIFICATE, token=certificate.SerializeToString()).SerializeToString(),
+  )
+  path = tmp_path_factory.mktemp('cdm') / 'test.wvd'
+  device.dump(path)
+  return str(path)
+
+
+class TestCdmManager:
+
+  def test_device_loaded_once(self, wvd_file):
+    assert get_cdm_manager(wvd_file) is get_cdm_manager(wvd_file)
+    with Local_CDM(wvd_file) as first:
+      pass
+    with Local_CDM(wvd_file) as second:
+      pass
+    assert first.device is second.device
+
+  def test_sessions_are_reused(self, wvd_file):
+    manager = CdmManager(wvd_file, max_sessions=2)
+    session_id = manager.acquire()
+    manager.release(session_id)
+    assert manager.acquire() == session_id
+
+  def test_session_count_is_bounded(self, wvd_file):
+    manager = CdmManager(wvd_file, max_sessions=2)
+    manager.acquire()
+    second = manager.acquire()
+    with pytest.raises(Exception, match='No CDM session became available'):
+      manager.acquire(timeout=0.1)
+
+    # a waiting job gets the session once it is released
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(manager.acquire(timeout=5)))
+    waiter.start()
+    manager.release(second)
+    waiter.join()
+    assert acquired == [second]
+
+  def test_session_closed_after_error(self, wvd_file):
+    manager = get_cdm_manager(wvd_file)
+    with pytest.raises(ValueError):
+      with Local_CDM(wvd_file) as cdm:
+        session_id = cdm.session_id
+        raise ValueError('license request failed')
+    assert session_id not in manager.idle_sessions
+    assert cdm.session_id is None
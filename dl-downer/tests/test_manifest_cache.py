@@ -0,0 +1,88 @@
+import os
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.mpd.mpd import MPD
+from src.utils.download_video_nre import get_manifest_args
+from src.utils.manifest_cache import get_manifest, get_manifest_file, job_manifest_cache
+
+
+MANIFEST = '<MPD xmlns="urn:mpeg:dash:schema:mpd:2011"><Period id="p0"/></MPD>'
+requests_seen = []
+
+
+class ManifestHandler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):
+    requests_seen.append(dict(self.headers))
+    if self.headers.get('If-None-Match') == '"v1"':
+      self.send_response(304)
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return
+    body = MANIFEST.encode()
+    self.send_response(200)
+    self.send_header('ETag', '"v1"')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+
+@pytest.fixture(scope='module')
+def manifest_url():
+  server = ThreadingHTTPServer(('127.0.0.1', 0), ManifestHandler)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  yield f'http://127.0.0.1:{server.server_address[1]}/video/manifest.mpd'
+  server.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def clear_requests(tmp_path, monkeypatch):
+  # local copies are written to ./tmp
+  monkeypatch.chdir(tmp_path)
+  requests_seen.clear()
+
+
+class TestManifestCache:
+
+  def test_fetched_once_per_job(self, manifest_url):
+    with job_manifest_cache():
+      assert get_manifest(manifest_url) == MANIFEST
+      mpd = MPD.from_url(f'{manifest_url}?token=abc')
+      assert mpd.base_url == manifest_url
+      assert len(mpd.periods) == 1
+    assert len(requests_seen) == 1
+    # a new job fetches it again
+    with job_manifest_cache():
+      get_manifest(manifest_url)
+    assert len(requests_seen) == 2
+
+  def test_revalidated_when_old(self, manifest_url, monkeypatch):
+    monkeypatch.setenv('DL_MANIFEST_MAX_AGE', '0')
+    with job_manifest_cache():
+      assert get_manifest(manifest_url) == MANIFEST
+      assert get_manifest(manifest_url) == MANIFEST
+    assert len(requests_seen) == 2
+    assert requests_seen[1]['If-None-Match'] == '"v1"'
+
+  def test_local_copy_for_external_tools(self, manifest_url):
+    with job_manifest_cache():
+      # nothing fetched yet, the tool fetches it itself
+      assert get_manifest_args(manifest_url) == [manifest_url]
+      get_manifest(manifest_url)
+      manifest_file = get_manifest_file(manifest_url)
+      with open(manifest_file) as f:
+        assert f.read() == MANIFEST
+      assert get_manifest_args(manifest_url) == [manifest_file, '--base-url', manifest_url]
+    assert get_manifest_file(manifest_url) is None
+    assert not os.path.exists(manifest_file)
+
+  def test_without_job(self, manifest_url):
+    assert get_manifest(manifest_url) == MANIFEST
+    assert get_manifest(manifest_url) == MANIFEST
+    assert len(requests_seen) == 2
@@ -0,0 +1,35 @@
+from src.mpd.mpd import MPD
+from src.mpd.mpd_download_options import MPDDownloadOptions
+from src.utils.files import MuxPlan
+
+
+class TestSubtitles:
+
+  def test_list(self):
+    options = MPDDownloadOptions(subtitles=['a.srt'])
+    assert options.get_subtitles() == ['a.srt']
+
+  def test_default_not_shared(self):
+    options = MPDDownloadOptions()
+    options.get_subtitles().append('a.srt')
+    assert MPDDownloadOptions().get_subtitles() == []
+
+  def test_provider_called_when_muxing(self, tmp_path, monkeypatch):
+    events = []
+    def provider():
+      events.append('subtitles')
+      return ['nl.srt', 'en.srt']
+    def run(plan, out_file):
+      events.append('mux')
+      # all subtitles in the same command as the tracks
+      assert [args[1] for args, is_subtitle, _ in plan.inputs if is_subtitle] == ['nl.srt', 'en.srt']
+      return out_file
+    monkeypatch.setattr(MuxPlan, 'run', run)
+
+    options = MPDDownloadOptions(merge_method='format', subtitles=provider)
+    mpd = MPD.from_string('<MPD xmlns="urn:mpeg:dash:schema:mpd:2011"><Period/></MPD>')
+    results = [[str(tmp_path / 'audio.mp4'), str(tmp_path / 'video.mp4')]]
+    out_file = mpd.mux_single_pass(results, str(tmp_path), str(tmp_path), 'abcd', options)
+
+    assert events == ['subtitles', 'mux']
+    assert out_file == str(tmp_path / 'merged-formats-abcd.mkv')
@@ -0,0 +1,94 @@
+import pytest
+
+from src.mpd.adaptation_set import AdaptationSet
+from src.mpd.mpd import MPD
+from src.mpd.mpd_download_options import MPDDownloadOptions
+from src.mpd.segment import SegmentTimeline
+from src.mpd.segment_template import TemplateSegmentUrls
+
+
+MANIFEST = '''<?xml version="1.0" encoding="utf-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" xmlns:cenc="urn:mpeg:cenc:2013" type="static">
+  <BaseURL>https://cdn.example.com/</BaseURL>
+  <Period id="p0">
+    <AdaptationSet id="1" mimeType="video/mp4" contentType="video">
+      <ContentProtection schemeIdUri="urn:uuid:edef8ba9-79d6-4ace-a3c8-27dcd51d21ed">
+        <cenc:pssh>AAAA</cenc:pssh>
+      </ContentProtection>
+      <SegmentTemplate timescale="1000" startNumber="5" initialization="$RepresentationID$/init.mp4" media="$RepresentationID$/$Number$-$Time$.m4s">
+        <SegmentTimeline>
+          <S t="1000" d="2000" r="2"/>
+          <S d="1000"/>
+          <S d="1000"/>
+          <S t="20000" d="2000"/>
+        </SegmentTimeline>
+      </SegmentTemplate>
+      <Representation id="video=1" bandwidth="1000000" width="1920" height="1080"/>
+    </AdaptationSet>
+  </Period>
+</MPD>
+'''
+
+
+class TestSegmentTimeline:
+
+  def test_run_length_encoded(self):
+    timeline = SegmentTimeline()
+    timeline.append(0, 10, 2)
+    # continues the previous entry with the same duration
+    timeline.append(30, 10)
+    timeline.append(40, 5)
+    # gap: new entry
+    timeline.append(100, 5)
+    assert len(timeline) == 6
+    assert len(timeline.entries) == 3 * 3
+    assert [(s.start, s.duration) for s in timeline] == [(0, 10), (10, 10), (20, 10), (30, 10), (40, 5), (100, 5)]
+    assert [(timeline[i].start, timeline[i].duration) for i in range(6)] == [(s.start, s.duration) for s in timeline]
+    assert timeline[-1].start == 100
+    with pytest.raises(IndexError):
+      timeline[6]
+
+
+class TestMPDParsing:
+
+  def test_namespaces_are_dropped(self):
+    mpd = MPD.from_string(MANIFEST)
+    adaptation_set = mpd.periods[0].adaptation_sets[0]
+    assert mpd.base_url == 'https://cdn.example.com/'
+    assert adaptation_set.has_content_protections
+    assert adaptation_set.representations[0].id == 'video=1'
+
+  def test_segment_urls_are_built_lazily(self):
+    template = MPD.from_string(MANIFEST).periods[0].adaptation_sets[0].segment_template
+    assert len(template.segments) == 6
+    urls = TemplateSegmentUrls(f'https://cdn.example.com/{template.media}', 'video=1', template.segments, template.start_number)
+    assert list(urls) == [
+      'https://cdn.example.com/video=1/5-1000.m4s',
+      'https://cdn.example.com/video=1/6-3000.m4s',
+      'https://cdn.example.com/video=1/7-5000.m4s',
+      'https://cdn.example.com/video=1/8-7000.m4s',
+      'https://cdn.example.com/video=1/9-8000.m4s',
+      'https://cdn.example.com/video=1/10-20000.m4s',
+    ]
+    assert urls[4] == 'https://cdn.example.com/video=1/9-8000.m4s'
+
+
+class TestPeriodDownload:
+
+  def test_representation_selected_once(self, tmp_path, monkeypatch):
+    selected = []
+    select_representation = AdaptationSet.select_representation
+    def tracked_select(self, download_options=None):
+      selected.append(self.id)
+      return select_representation(self, download_options)
+    downloaded = []
+    def download(self, tmp_dir, base_url, download_options=None, scheduler=None, representation=None):
+      downloaded.append(representation.id)
+      return None
+    monkeypatch.setattr(AdaptationSet, 'select_representation', tracked_select)
+    monkeypatch.setattr(AdaptationSet, 'download', download)
+
+    period = MPD.from_string(MANIFEST).periods[0]
+    assert period.download(str(tmp_path), 'https://cdn.example.com/', MPDDownloadOptions(merge_method='format')) == [None, None]
+    assert selected == ['1']
+    assert downloaded == ['video=1']
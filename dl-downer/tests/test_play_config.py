@@ -0,0 +1,105 @@
+import json
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.models.dl_request_platform import DLRequestPlatform
+from src.utils.play_config import resolve_play_config, save_play_config_request
+
+
+received = []
+
+
+class PlayConfigHandler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def do_POST(self):
+    body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+    received.append({ 'path': self.path, 'headers': dict(self.headers), 'body': body })
+    if self.headers.get('x-dpp-jwt') == 'server-error':
+      status, response = 503, b'{}'
+    elif self.headers.get('x-dpp-jwt') == 'not-json':
+      status, response = 200, b'<html>maintenance</html>'
+    elif self.headers.get('x-dpp-jwt') != 'valid-token':
+      status, response = 401, b'{}'
+    else:
+      status, response = 200, json.dumps({ 'video': { 'path': self.path } }).encode()
+    self.send_response(status)
+    self.send_header('Content-Length', str(len(response)))
+    self.end_headers()
+    self.wfile.write(response)
+
+  def log_message(self, format, *args):
+    pass
+
+
+@pytest.fixture(scope='module')
+def server_url():
+  server = ThreadingHTTPServer(('127.0.0.1', 0), PlayConfigHandler)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  yield f'http://127.0.0.1:{server.server_address[1]}'
+  server.shutdown()
+
+
+class FakeRequest:
+  def __init__(self, url, headers):
+    self.url = url
+    self.method = 'POST'
+    self.headers = headers
+    self.post_data = '{"deviceType":"web"}'
+
+  def all_headers(self):
+    return self.headers
+
+
+@pytest.fixture(autouse=True)
+def storage_states_folder(tmp_path, monkeypatch):
+  monkeypatch.setenv('STORAGE_STATES_FOLDER', str(tmp_path))
+  (tmp_path / f'{DLRequestPlatform.VTMGO.value}.json').write_text(json.dumps({ 'cookies': [
+    { 'name': 'session', 'value': 'abc', 'domain': '127.0.0.1', 'expires': -1 },
+    { 'name': 'other-site', 'value': 'xyz', 'domain': '.example.com', 'expires': -1 },
+  ] }))
+  received.clear()
+  return tmp_path
+
+
+def capture(server_url, token):
+  save_play_config_request(
+    DLRequestPlatform.VTMGO,
+    'https://www.vtmgo.be/vtmgo/afspelen/eaaaa-1111',
+    FakeRequest(
+      f'{server_url}/play-config/eaaaa-1111?startPosition=0',
+      { ':authority': '127.0.0.1', 'x-dpp-jwt': token, 'cookie': 'stale=1', 'content-type': 'application/json' },
+    ),
+  )
+
+
+class TestPlayConfigResolver:
+
+  def test_nothing_captured(self):
+    assert resolve_play_config(DLRequestPlatform.VTMGO, 'https://www.vtmgo.be/vtmgo/afspelen/ebbbb-2222') is None
+
+  def test_replays_request_for_new_asset(self, server_url):
+    capture(server_url, 'valid-token')
+    config = resolve_play_config(DLRequestPlatform.VTMGO, 'https://www.vtmgo.be/vtmgo/afspelen/ebbbb-2222')
+    assert config == { 'video': { 'path': '/play-config/ebbbb-2222?startPosition=0' } }
+    request = received[0]
+    assert request['body'] == b'{"deviceType":"web"}'
+    # cookies come from the storage state, for this host only
+    assert request['headers']['cookie'] == 'session=abc'
+
+  def test_auth_failure_falls_back_to_browser(self, server_url):
+    capture(server_url, 'expired-token')
+    assert resolve_play_config(DLRequestPlatform.VTMGO, 'https://www.vtmgo.be/vtmgo/afspelen/ebbbb-2222') is None
+    assert len(received) == 1
+
+  @pytest.mark.parametrize('token', ['server-error', 'not-json'])
+  def test_failed_response_falls_back_to_browser(self, server_url, token):
+    capture(server_url, token)
+    assert resolve_play_config(DLRequestPlatform.VTMGO, 'https://www.vtmgo.be/vtmgo/afspelen/ebbbb-2222') is None
+    assert len(received) == 1
+
+  def test_network_error_falls_back_to_browser(self):
+    # nothing listens on port 1
+    capture('http://127.0.0.1:1', 'valid-token')
+    assert resolve_play_config(DLRequestPlatform.VTMGO, 'https://www.vtmgo.be/vtmgo/afspelen/ebbbb-2222') is None
@@ -0,0 +1,145 @@
+import struct
+import threading
+import pytest
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.mpd.mp4_boxes import find_box, parse_sidx
+from src.mpd.mpd_download_options import MPDDownloadOptions
+from src.mpd.representation import Representation
+from src.mpd import segment_base
+from src.mpd.segment_base import SegmentBase
+
+
+def box(box_type, payload):
+  return struct.pack('>I4s', 8 + len(payload), box_type.encode()) + payload
+
+
+def sidx(sizes, first_offset=0, version=0, reference_type=0, reference_types=None):
+  '''
+  :param reference_types: the reference type per size, defaults to reference_type for all
+  '''
+  if reference_types is None:
+    reference_types = [reference_type] * len(sizes)
+  payload = struct.pack('>I', version << 24) + struct.pack('>II', 1, 1000)
+  if version == 0:
+    payload += struct.pack('>II', 500, first_offset)
+  else:
+    payload += struct.pack('>QQ', 500, first_offset)
+  payload += struct.pack('>HH', 0, len(sizes))
+  for size, ref_type in zip(sizes, reference_types):
+    payload += struct.pack('>III', (ref_type << 31) | size, 2000, 0x90000000)
+  return box('sidx', payload)
+
+
+INIT = box('ftyp', b'isom') + box('moov', b'\x00' * 40)
+FRAGMENTS = [box('moof', bytes([i]) * 10) + box('mdat', bytes([i]) * (100 + i)) for i in range(12)]
+INDEX = sidx([len(f) for f in FRAGMENTS])
+MEDIA_FILE = INIT + INDEX + b''.join(FRAGMENTS)
+range_requests = []
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):
+    first, last = self.headers['Range'].replace('bytes=', '').split('-')
+    range_requests.append((int(first), int(last)))
+    body = MEDIA_FILE[int(first):int(last) + 1]
+    self.send_response(206)
+    self.send_header('Content-Range', f'bytes {first}-{last}/{len(MEDIA_FILE)}')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+
+@pytest.fixture(scope='module')
+def server_url():
+  server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  yield f'http://127.0.0.1:{server.server_address[1]}'
+  server.shutdown()
+
+
+class TestSidx:
+
+  @pytest.mark.parametrize('version', [0, 1])
+  def test_references_are_absolute_offsets(self, version):
+    data = sidx([100, 200, 300], first_offset=16, version=version)
+    index = parse_sidx(data, find_box(data, ['sidx']), 1000)
+    assert index.timescale == 1000
+    assert index.earliest_presentation_time == 500
+    assert [(r.offset, r.size, r.duration) for r in index.references] == [
+      (1000 + len(data) + 16, 100, 2000),
+      (1000 + len(data) + 116, 200, 2000),
+      (1000 + len(data) + 316, 300, 2000),
+    ]
+    assert all(r.reference_type == 0 for r in index.references)
+
+  def test_reference_to_index(self):
+    data = sidx([100], reference_type=1)
+    assert parse_sidx(data, find_box(data, ['sidx']), 0).references[0].reference_type == 1
+
+
+class TestSegmentBase:
+
+  def test_single_file_downloaded_in_ranges(self, server_url, tmp_path):
+    representation = Representation.from_element(ET.fromstring(
+      f'<Representation id="video=1" bandwidth="1000">'
+      f'<BaseURL>media/video.mp4</BaseURL>'
+      f'<SegmentBase indexRange="{len(INIT)}-{len(INIT) + len(INDEX) - 1}">'
+      f'<Initialization range="0-{len(INIT) - 1}"/>'
+      f'</SegmentBase>'
+      f'</Representation>'
+    ))
+    range_requests.clear()
+    out_file = representation.download(str(tmp_path), f'{server_url}/manifest.mpd', download_options=MPDDownloadOptions())
+    with open(out_file, 'rb') as f:
+      assert f.read() == INIT + b''.join(FRAGMENTS)
+    # init and index in one request, then one request per fragment
+    assert range_requests[0] == (0, len(INIT) + len(INDEX) - 1)
+    assert len(range_requests) == 1 + len(FRAGMENTS)
+
+  def test_hierarchical_index_in_presentation_order(self, monkeypatch):
+    # top -> [a -> [a1 -> [0, 1], 2], b -> [3]]
+    f0, f1, f2, f3 = FRAGMENTS[:4]
+    a1 = sidx([len(f0), len(f1)])
+    a = sidx([len(a1) + len(f0) + len(f1), len(f2)], reference_types=[1, 0])
+    b = sidx([len(f3)])
+    top = sidx([len(a) + len(a1) + len(f0) + len(f1) + len(f2), len(b) + len(f3)], reference_type=1)
+    media = INIT + top + a + a1 + f0 + f1 + f2 + b + f3
+    monkeypatch.setattr(segment_base, 'fetch_byte_range', lambda url, first, last: media[first:last + 1])
+
+    segment_base_info = SegmentBase(index_range=f'{len(INIT)}-{len(INIT) + len(top) - 1}')
+    init_data, segment_ranges = segment_base_info.get_segment_ranges('media.mp4')
+    assert init_data == INIT
+    fragments = []
+    for byte_range in segment_ranges:
+      first, last = byte_range.split('-')
+      fragments.append(media[int(first):int(last) + 1])
+    assert fragments == [f0, f1, f2, f3]
+
+
+class TestSegmentList:
+
+  def test_media_ranges(self, server_url, tmp_path):
+    offset = len(INIT) + len(INDEX)
+    segment_urls = ''
+    for fragment in FRAGMENTS:
+      segment_urls += f'<SegmentURL mediaRange="{offset}-{offset + len(fragment) - 1}"/>'
+      offset += len(fragment)
+    representation = Representation.from_element(ET.fromstring(
+      f'<Representation id="audio=1" bandwidth="1000">'
+      f'<BaseURL>{server_url}/audio.mp4</BaseURL>'
+      f'<SegmentList timescale="1000" duration="2000">'
+      f'<Initialization range="0-{len(INIT) - 1}"/>'
+      f'{segment_urls}'
+      f'</SegmentList>'
+      f'</Representation>'
+    ))
+    out_file = representation.download(str(tmp_path), 'https://example.com/manifest.mpd', download_options=MPDDownloadOptions())
+    with open(out_file, 'rb') as f:
+      assert f.read() == INIT + b''.join(FRAGMENTS)
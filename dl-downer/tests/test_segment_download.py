@@ -0,0 +1,311 @@
+import asyncio
+import random
+import threading
+import time
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.mpd.async_segment_download import AsyncSegmentDownloader, ByteBudget
+from src.mpd.download_scheduler import DownloadScheduler
+from src.mpd.mpd_download_options import MPDDownloadOptions
+from src.mpd.segment_download import DownloadAborted, SegmentDownloader, download_segments
+from src.mpd.segment_state import SegmentState
+from src.utils.host_concurrency import get_host_concurrency
+from src.utils.http_session import get_connection_stats
+
+
+SEGMENT_COUNT = 40
+served_paths = []
+# requests being served right now, and the most at once
+requests_in_flight = { 'now': 0, 'peak': 0 }
+requests_in_flight_lock = threading.Lock()
+
+
+def segment_content(index):
+  return f'segment-{index:04d};'.encode() * (index + 1)
+
+
+class SegmentHandler(BaseHTTPRequestHandler):
+  # keep-alive, so pooled connections can be reused
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):
+    served_paths.append(self.path)
+    index = int(self.path.strip('/').split('.')[0])
+    if index >= SEGMENT_COUNT:
+      self.send_response(404)
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return
+    with requests_in_flight_lock:
+      requests_in_flight['now'] += 1
+      requests_in_flight['peak'] = max(requests_in_flight['peak'], requests_in_flight['now'])
+    # Finish segments out of order
+    time.sleep(random.uniform(0, 0.02))
+    if self.path.endswith('?slow'):
+      # not time.sleep, tests replace that to skip the retry delays
+      threading.Event().wait(0.1)
+    with requests_in_flight_lock:
+      requests_in_flight['now'] -= 1
+    body = segment_content(index)
+    self.send_response(200)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+
+@pytest.fixture(scope='module')
+def server_url():
+  server = ThreadingHTTPServer(('127.0.0.1', 0), SegmentHandler)
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+  yield f'http://127.0.0.1:{server.server_address[1]}'
+  server.shutdown()
+
+
+real_async_sleep = asyncio.sleep
+async def fake_async_sleep(delay):
+  # skip the retry delays, but keep polling for slots at its pace
+  await real_async_sleep(delay if delay < 0.5 else 0)
+
+
+def expected_output(count=SEGMENT_COUNT):
+  return b'INIT' + b''.join(segment_content(i) for i in range(count))
+
+
+class TestSegmentDownloader:
+
+  @pytest.mark.parametrize('stream', [True, False])
+  def test_segments_written_in_order(self, server_url, tmp_path, stream):
+    urls = [f'{server_url}/{i}.m4s' for i in range(SEGMENT_COUNT)]
+    out_file = tmp_path / 'out.mp4'
+    SegmentDownloader(urls, str(out_file), str(tmp_path), stream=stream, max_threads=8).download(b'INIT')
+    assert out_file.read_bytes() == expected_output()
+
+  def test_small_reorder_window(self, server_url, tmp_path):
+    urls = [f'{server_url}/{i}.m4s' for i in range(SEGMENT_COUNT)]
+    out_file = tmp_path / 'out.mp4'
+    SegmentDownloader(urls, str(out_file), str(tmp_path), max_threads=4, reorder_window=4).download(b'INIT')
+    assert out_file.read_bytes() == expected_output()
+
+  def test_streaming_writes_no_segment_files(self, server_url, tmp_path):
+    urls = [f'{server_url}/{i}.m4s' for i in range(SEGMENT_COUNT)]
+    out_file = tmp_path / 'out.mp4'
+    SegmentDownloader(urls, str(out_file), str(tmp_path), max_threads=4).download(b'INIT')
+    assert [p.name for p in tmp_path.iterdir()] == ['out.mp4']
+
+  def test_failed_segment_raises(self, server_url, tmp_path, monkeypatch):
+    monkeypatch.setattr(time, 'sleep', lambda _: None)
+    urls = [f'{server_url}/{i}.m4s' for i in range(SEGMENT_COUNT)]
+    urls[5] = f'{server_url}/{SEGMENT_COUNT + 1}.m4s'
+    with pytest.raises(Exception, match='First failed segment index: 5'):
+      SegmentDownloader(urls, str(tmp_path / 'out.mp4'), str(tmp_path), max_threads=4).download(b'INIT')
+
+  def test_connections_are_reused(self, server_url, tmp_path):
+    before = get_connection_stats()
+    urls = [f'{server_url}/{i}.m4s' for i in range(SEGMENT_COUNT)]
+    SegmentDownloader(urls, str(tmp_path / 'out.mp4'), str(tmp_path), max_threads=4).download(b'INIT')
+    after = get_connection_stats()
+    assert after['requests'] - before['requests'] == SEGMENT_COUNT
+    assert after['connections'] - before['connections'] <= 4
+
+  @pytest.mark.parametrize('stream', [True, False])
+  def test_resume_after_failure(self, server_url, tmp_path, monkeypatch, stream):
+    monkeypatch.setattr(time, 'sleep', lambda _: None)
+    urls = [f'{server_url}/{i}.m4s' for i in range(SEGMENT_COUNT)]
+    broken_urls = list(urls)
+    broken_urls[25] = f'{server_url}/{SEGMENT_COUNT + 1}.m4s'
+    out_file = tmp_path / 'out.mp4'
+    resume_path = str(tmp_path / 'resume' / 'video')
+    (tmp_path / 'resume').mkdir()
+
+    with pytest.raises(Exception):
+      SegmentDownloader(broken_urls, str(out_file), str(tmp_path), stream=stream, max_threads=1, resume_path=resume_path).download(b'INIT')
+
+    served_paths.clear()
+    SegmentDownloader(urls, str(out_file), str(tmp_path), stream=stream, max_threads=1, resume_path=resume_path).download(b'INIT')
+    assert out_file.read_bytes() == expected_output()
+    # only the segments from the failed one onwards are downloaded again
+    assert served_paths[0] == '/25.m4s'
+    assert len(served_paths) <= SEGMENT_COUNT - 25 + 1
+    assert list((tmp_path / 'resume').iterdir()) == []
+
+  def test_resume_ignores_corrupt_partial_file(self, server_url, tmp_path):
+    urls = [f'{server_url}/{i}.m4s' for i in range(SEGMENT_COUNT)]
+    out_file = tmp_path / 'out.mp4'
+    resume_path = str(tmp_path / 'video')
+    # leave a partial download with a corrupted segment 3 behind
+    with open(f'{resume_path}.part', 'wb') as f:
+      f.write(b'INIT')
+      for i in range(10):
+        f.write(segment_content(i) if i != 3 else b'x' * len(segment_content(i)))
+    state = SegmentState(f'{resume_path}.state', SEGMENT_COUNT, b'INIT')
+    state.reset()
+    for i in range(10):
+      state.record(i, segment_content(i))
+
+    served_paths.clear()
+    SegmentDownloader(urls, str(out_file), str(tmp_path), max_threads=1, resume_path=resume_path).download(b'INIT')
+    assert out_file.read_bytes() == expected_output()
+    assert served_paths[0] == '/3.m4s'
+
+
+class TestAsyncSegmentDownloader:
+
+  def test_segments_written_in_order(self, server_url, tmp_path):
+    urls = [f'{server_url}/{i}.m4s' for i in range(SEGMENT_COUNT)]
+    out_file = tmp_path / 'out.mp4'
+    AsyncSegmentDownloader(urls, str(out_file), str(tmp_path)).download(b'INIT')
+    assert out_file.read_bytes() == expected_output()
+    assert [p.name for p in tmp_path.iterdir()] == ['out.mp4']
+
+  def test_transform_applied(self, server_url, tmp_path):
+    urls = [f'{server_url}/{i}.m4s' for i in range(SEGMENT_COUNT)]
+    out_file = tmp_path / 'out.mp4'
+    AsyncSegmentDownloader(urls, str(out_file), str(tmp_path), transform=bytes.upper).download(b'INIT')
+    assert out_file.read_bytes() == b'INIT' + expected_output()[4:].upper()
+
+  def test_bytes_in_flight_are_bounded(self, server_url, tmp_path, monkeypatch):
+    limit = 3 * len(segment_content(SEGMENT_COUNT - 1))
+    peak = []
+    acquire = ByteBudget.acquire
+    async def tracked_acquire(self, size):
+      await acquire(self, size)
+      peak.append((size, self.used))
+    monkeypatch.setattr(ByteBudget, 'acquire', tracked_acquire)
+    urls = [f'{server_url}/{i}.m4s' for i in range(SEGMENT_COUNT)]
+    out_file = tmp_path / 'out.mp4'
+    AsyncSegmentDownloader(urls, str(out_file), str(tmp_path), max_bytes_in_flight=limit).download(b'INIT')
+    assert out_file.read_bytes() == expected_output()
+    # a reservation larger than the budget (the initial estimate) only gets through on its own
+    assert all(used <= limit or used == size for size, used in peak)
+    assert any(used > size for size, used in peak)
+
+  def test_requests_bounded_by_shared_slots(self, server_url, tmp_path):
+    slots = threading.BoundedSemaphore(2)
+    requests_in_flight['peak'] = 0
+    urls = [f'{server_url}/{i}.m4s' for i in range(SEGMENT_COUNT)]
+    out_file = tmp_path / 'out.mp4'
+    AsyncSegmentDownloader(urls, str(out_file), str(tmp_path), segment_slots=slots).download(b'INIT')
+    assert out_file.read_bytes() == expected_output()
+    assert requests_in_flight['peak'] <= 2
+    # every slot was given back
+    assert slots.acquire(blocking=False) and slots.acquire(blocking=False)
+
+  def test_requests_bounded_by_host_concurrency(self, server_url, tmp_path, monkeypatch):
+    host = get_host_concurrency(f'{server_url}/0.m4s')
+    monkeypatch.setattr(host, 'limit', 1.0)
+    monkeypatch.setattr(host, 'max_limit', 1)
+    requests_in_flight['peak'] = 0
+    urls = [f'{server_url}/{i}.m4s' for i in range(SEGMENT_COUNT)]
+    out_file = tmp_path / 'out.mp4'
+    AsyncSegmentDownloader(urls, str(out_file), str(tmp_path)).download(b'INIT')
+    assert out_file.read_bytes() == expected_output()
+    assert requests_in_flight['peak'] == 1
+    assert host.in_flight == 0
+
+  def test_failed_segment_raises(self, server_url, tmp_path, monkeypatch):
+    monkeypatch.setattr(asyncio, 'sleep', fake_async_sleep)
+    urls = [f'{server_url}/{i}.m4s' for i in range(SEGMENT_COUNT)]
+    urls[5] = f'{server_url}/{SEGMENT_COUNT + 1}.m4s'
+    with pytest.raises(Exception, match='First failed segment index: 5'):
+      AsyncSegmentDownloader(urls, str(tmp_path / 'out.mp4'), str(tmp_path)).download(b'INIT')
+    assert get_host_concurrency(urls[0]).in_flight == 0
+
+  def test_resume_after_failure(self, server_url, tmp_path, monkeypatch):
+    monkeypatch.setattr(asyncio, 'sleep', fake_async_sleep)
+    urls = [f'{server_url}/{i}.m4s' for i in range(SEGMENT_COUNT)]
+    broken_urls = list(urls)
+    broken_urls[25] = f'{server_url}/{SEGMENT_COUNT + 1}.m4s'
+    out_file = tmp_path / 'out.mp4'
+    resume_path = str(tmp_path / 'resume' / 'video')
+    (tmp_path / 'resume').mkdir()
+
+    with pytest.raises(Exception):
+      AsyncSegmentDownloader(broken_urls, str(out_file), str(tmp_path), resume_path=resume_path).download(b'INIT')
+
+    served_paths.clear()
+    AsyncSegmentDownloader(urls, str(out_file), str(tmp_path), resume_path=resume_path).download(b'INIT')
+    assert out_file.read_bytes() == expected_output()
+    assert sorted(served_paths, key=lambda p: int(p.strip('/').split('.')[0]))[0] == '/25.m4s'
+    assert list((tmp_path / 'resume').iterdir()) == []
+
+
+class TestSegmentEngine:
+
+  @pytest.mark.parametrize('option, env, expected', [
+    (None, None, SegmentDownloader),
+    (None, 'async', AsyncSegmentDownloader),
+    ('async', None, AsyncSegmentDownloader),
+    ('threads', 'async', SegmentDownloader),
+  ])
+  def test_engine_from_option_or_env(self, server_url, tmp_path, monkeypatch, option, env, expected):
+    if env is None:
+      monkeypatch.delenv('DL_SEGMENT_ENGINE', raising=False)
+    else:
+      monkeypatch.setenv('DL_SEGMENT_ENGINE', env)
+    used = []
+    def tracked(download):
+      def tracked_download(self, init_data):
+        used.append(type(self))
+        return download(self, init_data)
+      return tracked_download
+    monkeypatch.setattr(SegmentDownloader, 'download', tracked(SegmentDownloader.download))
+    monkeypatch.setattr(AsyncSegmentDownloader, 'download', tracked(AsyncSegmentDownloader.download))
+
+    urls = [f'{server_url}/{i}.m4s' for i in range(SEGMENT_COUNT)]
+    out_file = tmp_path / 'out.mp4'
+    with DownloadScheduler(4) as scheduler:
+      download_segments(b'INIT', urls, str(out_file), str(tmp_path), 'video', 'video', MPDDownloadOptions(segment_engine=option), scheduler)
+    assert used == [expected]
+    assert out_file.read_bytes() == expected_output()
+
+
+def all_slots_free(semaphore, count):
+  taken = [semaphore.acquire(blocking=False) for _ in range(count + 1)]
+  return taken == [True] * count + [False]
+
+
+class TestSharedScheduler:
+
+  @pytest.mark.parametrize('engine', ['threads', 'async'])
+  def test_tracks_share_the_reorder_window(self, server_url, tmp_path, engine):
+    urls = [f'{server_url}/{i}.m4s' for i in range(SEGMENT_COUNT)]
+    options = MPDDownloadOptions(segment_engine=engine)
+    with DownloadScheduler(2, reorder_window=3) as scheduler:
+      out_files = scheduler.run_all(
+        lambda name: download_segments(b'INIT', urls, str(tmp_path / f'{name}.mp4'), str(tmp_path), name, name, options, scheduler),
+        ['audio', 'video'],
+      )
+      assert scheduler.reorder_window == 3
+      assert all_slots_free(scheduler.reorder_slots, 3)
+    assert [open(f, 'rb').read() for f in out_files] == [expected_output(), expected_output()]
+
+  @pytest.mark.parametrize('engine', ['threads', 'async'])
+  def test_failed_track_stops_the_others(self, server_url, tmp_path, monkeypatch, engine):
+    monkeypatch.setattr(time, 'sleep', lambda _: None)
+    monkeypatch.setattr(asyncio, 'sleep', fake_async_sleep)
+    urls = [f'{server_url}/{i}.m4s?slow' for i in range(SEGMENT_COUNT)]
+    broken_urls = [f'{server_url}/{SEGMENT_COUNT + 1}.m4s'] + [f'{server_url}/{i}.m4s' for i in range(1, SEGMENT_COUNT)]
+    options = MPDDownloadOptions(segment_engine=engine)
+    served_paths.clear()
+    with DownloadScheduler(2, reorder_window=4) as scheduler:
+      with pytest.raises(Exception, match='First failed segment index: 0'):
+        scheduler.run_all(
+          lambda track: download_segments(b'INIT', track[1], str(tmp_path / f'{track[0]}.mp4'), str(tmp_path), track[0], track[0], options, scheduler),
+          [('audio', urls), ('video', broken_urls)],
+        )
+      assert scheduler.abort.is_set()
+      assert all_slots_free(scheduler.reorder_slots, 4)
+    # the healthy track stopped long before all of its segments were downloaded
+    assert len([p for p in served_paths if p.endswith('?slow')]) < SEGMENT_COUNT / 2
+
+  def test_stopped_download_raises_aborted(self, server_url, tmp_path):
+    abort = threading.Event()
+    abort.set()
+    urls = [f'{server_url}/{i}.m4s' for i in range(SEGMENT_COUNT)]
+    with pytest.raises(DownloadAborted):
+      SegmentDownloader(urls, str(tmp_path / 'out.mp4'), str(tmp_path), abort=abort).download(b'INIT')
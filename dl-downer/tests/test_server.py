@@ -0,0 +1,93 @@
+import multiprocessing
+import os
+import signal
+import time
+import pytest
+
+from src import server
+from src.server import exit_on_sigterm, get_worker_count, stop_workers
+
+
+class TestGetWorkerCount:
+
+  def test_default(self, monkeypatch):
+    monkeypatch.delenv('DL_WORKERS', raising=False)
+    assert get_worker_count() == 1
+
+  @pytest.mark.parametrize('value, expected', [('4', 4), ('0', 1), ('-2', 1), ('many', 1), ('', 1)])
+  def test_parsing(self, monkeypatch, value, expected):
+    monkeypatch.setenv('DL_WORKERS', value)
+    assert get_worker_count() == expected
+
+
+class TestExitOnSigterm:
+
+  def test_sigterm_raises_system_exit(self):
+    previous = signal.getsignal(signal.SIGTERM)
+    try:
+      exit_on_sigterm()
+      with pytest.raises(SystemExit):
+        os.kill(os.getpid(), signal.SIGTERM)
+    finally:
+      signal.signal(signal.SIGTERM, previous)
+
+
+def wait_for(condition, timeout=10):
+  deadline = time.time() + timeout
+  while not condition():
+    assert time.time() < deadline, 'timed out'
+    time.sleep(0.05)
+
+
+def fake_worker(folder, slot=0, handle_sigterm=True):
+  ''' Marks when it started and when its finally block ran '''
+  if handle_sigterm:
+    exit_on_sigterm()
+  else:
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+  try:
+    open(os.path.join(folder, f'started-{slot}'), 'w').close()
+    while True:
+      time.sleep(0.05)
+  finally:
+    open(os.path.join(folder, f'stopped-{slot}'), 'w').close()
+
+
+class TestStopWorkers:
+
+  def test_workers_run_finally(self, tmp_path):
+    workers = { slot: multiprocessing.Process(target=fake_worker, args=(str(tmp_path), slot)) for slot in range(2) }
+    for worker in workers.values():
+      worker.start()
+    wait_for(lambda: (tmp_path / 'started-0').exists() and (tmp_path / 'started-1').exists())
+    stop_workers(workers)
+    assert not any(worker.is_alive() for worker in workers.values())
+    assert (tmp_path / 'stopped-0').exists() and (tmp_path / 'stopped-1').exists()
+
+  def test_stuck_worker_is_killed(self, tmp_path):
+    workers = { 0: multiprocessing.Process(target=fake_worker, args=(str(tmp_path), 0, False)) }
+    workers[0].start()
+    wait_for(lambda: (tmp_path / 'started-0').exists())
+    stop_workers(workers, timeout=0.2)
+    assert not workers[0].is_alive()
+    assert workers[0].exitcode == -signal.SIGKILL
+
+
+class TestStartServer:
+
+  def test_sigterm_stops_workers(self, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('DL_WORKERS', '2')
+    monkeypatch.setattr(server, 'validate_server_structure', lambda: None)
+    monkeypatch.setattr(server, 'requeue_interrupted_requests', lambda: None)
+    monkeypatch.setattr(server, 'run_worker', lambda slot=0: fake_worker(str(tmp_path), slot))
+
+    # forked, so the patches above apply to the server and its workers
+    process = multiprocessing.get_context('fork').Process(target=server.start_server)
+    process.start()
+    wait_for(lambda: (tmp_path / 'started-0').exists() and (tmp_path / 'started-1').exists())
+    os.kill(process.pid, signal.SIGTERM)
+    process.join(10)
+    assert not process.is_alive()
+    # the workers were stopped with SIGTERM, not left behind or killed
+    assert (tmp_path / 'stopped-0').exists() and (tmp_path / 'stopped-1').exists()
@@ -0,0 +1,49 @@
+from src.utils.webvtt import webvtt_to_srt, convert_webvtt_file
+
+
+VTT = '''\ufeffWEBVTT
+Kind: captions
+Language: nl
+
+STYLE
+::cue { color: yellow }
+
+NOTE this is a comment
+
+intro
+00:01.000 --> 00:03.500 line:90% align:center
+<v Jan>Hallo <i>daar</i></v>
+
+01:00:04.000 --> 01:00:06.250
+<c.yellow>Tom &amp; Jerry</c>
+tweede <00:00:05.000>regel
+
+00:00:07.000 --> 00:00:08.000
+<c></c>
+'''
+
+
+class TestWebVTTToSRT:
+
+  def test_cues(self):
+    assert webvtt_to_srt(VTT) == (
+      '1\n'
+      '00:00:01,000 --> 00:00:03,500\n'
+      'Hallo <i>daar</i>\n'
+      '\n'
+      '2\n'
+      '01:00:04,000 --> 01:00:06,250\n'
+      'Tom & Jerry\n'
+      'tweede regel\n'
+    )
+
+  def test_windows_line_endings(self):
+    vtt = 'WEBVTT\r\n\r\n00:00:01.000 --> 00:00:02.000\r\nHallo\r\n'
+    assert webvtt_to_srt(vtt) == '1\n00:00:01,000 --> 00:00:02,000\nHallo\n'
+
+  def test_file(self, tmp_path):
+    vtt_file = tmp_path / 'subs.nl.vtt'
+    vtt_file.write_text(VTT, encoding='utf-8')
+    srt_file = convert_webvtt_file(str(vtt_file))
+    assert srt_file == str(tmp_path / 'subs.nl.srt')
+    assert open(srt_file, encoding='utf-8').read().startswith('1\n00:00:01,000')